@@ -1,7 +1,7 @@
-from genologics.lims import Lims
-from genologics.config import BASEURI, USERNAME, PASSWORD
-import genologics.entities
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from clarity_ext.domain.process import Process
 
 
@@ -9,27 +9,162 @@ class ClaritySession(object):
     """
     A wrapper around connections to Clarity.
 
+    All raw REST calls that don't go through the genologics package (e.g. file downloads and
+    unlinking files) share one pooled `requests.Session`, so connections to the LIMS are kept alive
+    between calls instead of paying for a new TCP+TLS handshake on each request. The genologics
+    api object is set up to use the same pool for its GET requests.
+
     :param api: A proxy for the REST API, looking like Lims from the genologics package.
     :param current_step_id: The step we're currently in.
+    :param http_session: A `requests.Session` to use for raw REST calls. A pooled session is
+                         created if not provided.
+    :param lazy: If True, the version check and the fetching of the current step are deferred until
+                 the current step is first used.
+    :param version_check_ttl: The number of seconds a successful version check is valid for a server,
+                              for all sessions in the process, and in other processes if a metadata cache
+                              is provided.
+    :param batch_retriever: The `BatchRetriever` used by `get_batch`. One with default settings is
+                            created if not provided.
+    :param metadata_cache: A `MetadataCache` to keep the time of the last version check in, so it's
+                           shared by later runs. Optional.
     """
-    def __init__(self, api, current_step_id):
+
+    # Default settings for the pooled HTTP session. Override by sending the corresponding
+    # keyword arguments to `create` or `create_http_session`.
+    DEFAULT_POOL_SIZE = 20
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_BACKOFF_FACTOR = 0.5
+    RETRY_STATUS_CODES = (502, 503, 504)
+
+    DEFAULT_VERSION_CHECK_TTL = 3600
+    # The key of the time of the last version check of a server in the metadata cache
+    VERSION_CHECK_KEY = "version-check:{}"
+
+    # Time of the last successful version check, by server. Checked before the metadata cache.
+    _version_checked_at = dict()
+
+    def __init__(self, api, current_step_id, http_session=None, lazy=False, version_check_ttl=None,
+                 batch_retriever=None, metadata_cache=None):
+        from clarity_ext.repository.batch_retriever import BatchRetriever
         self.api = api
-        api.check_version()
+        self.http_session = http_session or self.create_http_session()
+        self.batch_retriever = batch_retriever or BatchRetriever(api, self.http_session)
+        # Let genologics use the same connection pool for its GET requests:
+        api.request_session = self.http_session
+        self.version_check_ttl = self.DEFAULT_VERSION_CHECK_TTL if version_check_ttl is None \
+            else version_check_ttl
+        self.metadata_cache = metadata_cache
         self.current_step_id = current_step_id
-        if current_step_id:
-            process_api_resource = genologics.entities.Process(self.api, id=current_step_id)
-            self.current_step = Process.create_from_rest_resource(process_api_resource)
-        else:
-            self.current_step = None
+        self._current_step = None
+        if not lazy:
+            self.check_version()
+            self._current_step = self._fetch_current_step()
 
     @staticmethod
-    def create(current_step_id):
-        return ClaritySession(Lims(BASEURI, USERNAME, PASSWORD), current_step_id)
+    def create(current_step_id, lazy=False, version_check_ttl=None, batch_options=None, metadata_cache=None,
+               **http_options):
+        """
+        Creates a session for the step, connecting to the LIMS configured for genologics.
+
+        :param batch_options: Keyword arguments sent to `BatchRetriever`, e.g. chunk_size
+        :param http_options: Keyword arguments sent to `create_http_session`, e.g. pool_size
+        """
+        from genologics.lims import Lims
+        from genologics.config import BASEURI, USERNAME, PASSWORD
+        from clarity_ext.repository.batch_retriever import BatchRetriever
+        api = Lims(BASEURI, USERNAME, PASSWORD)
+        http_session = ClaritySession.create_http_session(**http_options)
+        batch_retriever = BatchRetriever(api, http_session, **(batch_options or dict()))
+        return ClaritySession(api, current_step_id, http_session, lazy=lazy, version_check_ttl=version_check_ttl,
+                              batch_retriever=batch_retriever, metadata_cache=metadata_cache)
+
+    def for_step(self, step_id):
+        """
+        Returns a session for another step, sharing the api object and the pooled HTTP session with this one.
+
+        The step is fetched when first used.
+        """
+        return ClaritySession(self.api, step_id, self.http_session, lazy=True,
+                              version_check_ttl=self.version_check_ttl, batch_retriever=self.batch_retriever,
+                              metadata_cache=self.metadata_cache)
+
+    @property
+    def current_step(self):
+        """The `Process` domain object for the current step, or None if the session isn't for a step"""
+        if self._current_step is None and self.current_step_id:
+            self.check_version()
+            self._current_step = self._fetch_current_step()
+        return self._current_step
+
+    def _fetch_current_step(self):
+        if not self.current_step_id:
+            return None
+        import genologics.entities
+        process_api_resource = genologics.entities.Process(self.api, id=self.current_step_id)
+        return Process.create_from_rest_resource(process_api_resource)
 
-    def get(self, endpoint):
+    def check_version(self):
+        """
+        Checks that the server supports the API version, unless that was already done for the
+        server within `version_check_ttl` seconds.
+        """
+        server = self.api.baseuri
+        checked_at = self._version_checked_at.get(server)
+        if checked_at is None and self.metadata_cache is not None:
+            checked_at = self.metadata_cache.get(self.VERSION_CHECK_KEY.format(server))
+        if checked_at is not None and time.time() - checked_at < self.version_check_ttl:
+            self._version_checked_at[server] = checked_at
+            return
+        self.api.check_version()
+        self._version_checked_at[server] = time.time()
+        if self.metadata_cache is not None:
+            self.metadata_cache.set(self.VERSION_CHECK_KEY.format(server), self._version_checked_at[server])
+
+    @classmethod
+    def create_http_session(cls, pool_size=None, max_retries=None, backoff_factor=None, keep_alive=True):
+        """
+        Creates a `requests.Session` with a connection pool and a retry policy.
+
+        Only idempotent requests (GET, HEAD, PUT, DELETE) are retried, on connection errors and
+        on the status codes in RETRY_STATUS_CODES.
+
+        :param pool_size: The max number of connections kept open to the LIMS
+        :param max_retries: The number of times a failed request is retried
+        :param backoff_factor: Backoff factor between retries, in seconds (see urllib3's Retry)
+        :param keep_alive: Set to False to close the connection after each request
+        """
+        pool_size = pool_size or cls.DEFAULT_POOL_SIZE
+        retry = Retry(total=cls.DEFAULT_MAX_RETRIES if max_retries is None else max_retries,
+                      backoff_factor=cls.DEFAULT_BACKOFF_FACTOR if backoff_factor is None else backoff_factor,
+                      status_forcelist=cls.RETRY_STATUS_CODES,
+                      allowed_methods=frozenset(["GET", "HEAD", "PUT", "DELETE"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        http_session = requests.Session()
+        http_session.mount("http://", adapter)
+        http_session.mount("https://", adapter)
+        if not keep_alive:
+            http_session.headers["Connection"] = "close"
+        return http_session
+
+    def get(self, endpoint, **kwargs):
         """
         Executes a GET via the REST interface. One should rather use the api attribute instead.
         The endpoint is the part after /api/<version>/ in the API URI.
+
+        Extra keyword arguments are sent to `requests.Session.get`, e.g. stream=True
         """
+        from genologics.config import BASEURI, USERNAME, PASSWORD
         url = "{}/api/v2/{}".format(BASEURI, endpoint)
-        return requests.get(url, auth=(USERNAME, PASSWORD))
+        return self.http_session.get(url, auth=(USERNAME, PASSWORD), **kwargs)
+
+    def get_batch(self, instances, force=False):
+        """
+        Fetches artifacts, containers, files or samples (all of the same type) with batch calls, in
+        concurrent chunks. See `BatchRetriever`.
+        """
+        return self.batch_retriever.get_batch(instances, force=force)
+
+    def delete(self, uri):
+        """Executes a DELETE on the full uri, through the pooled session"""
+        return self.http_session.delete(uri, auth=(self.api.username, self.api.password))
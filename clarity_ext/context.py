@@ -1,3 +1,4 @@
+import logging
 from datetime import datetime
 
 from clarity_ext.inversion_of_control.ioc import ioc
@@ -9,13 +10,17 @@ from clarity_ext.utils import lazyprop
 from clarity_ext import ClaritySession
 from clarity_ext.service import (ArtifactService, FileService, StepLoggerService, ClarityService,
                                  ProcessService, ValidationService)
-from clarity_ext.repository import StepRepository
+from clarity_ext.repository import StepRepository, MetadataCache, AsyncRestClient, SnapshotStore
 from clarity_ext import utils
 from clarity_ext.service.file_service import OSService
+from clarity_ext.service.change_set import ChangeSet
+from clarity_ext.service.commit_scheduler import CommitScheduler
 from clarity_ext.mappers.clarity_mapper import ClarityMapper
 from clarity_ext.domain.validation import ValidationException
 from clarity_ext.domain.validation import ValidationType
 
+logger = logging.getLogger(__name__)
+
 
 class ExtensionContext(object):
     """
@@ -31,7 +36,7 @@ class ExtensionContext(object):
     def __init__(self, session, artifact_service, file_service, current_user,
                  step_logger_service, step_repo, clarity_service, dilution_service, process_service,
                  validation_service, test_mode=False,
-                 disable_commits=False):
+                 disable_commits=False, lazy=False, change_set_path=None):
         """
         Initializes the context.
 
@@ -47,16 +52,20 @@ class ExtensionContext(object):
                           returning a constant time.
         :param disable_commits: True if commits should be ignored, e.g. when uploading files or updating UDFs.
         Useful when testing.
+        :param lazy: If True, the current step and the current user (if not provided) are fetched on first use.
+        :param change_set_path: If provided, the writes made on commit (or that would have been made if commits
+                                are disabled) are saved to this file. See `ChangeSet`.
         """
         self.session = session
         self.logger = step_logger_service
         self.units = UnitConversion()
         self._update_queue = set()
-        self.current_step = step_repo.get_process()
+        self.step_repo = step_repo
+        self._lazy = lazy
+        self._current_step = None if lazy else step_repo.get_process()
         self.artifact_service = artifact_service
         self.file_service = file_service
-        self.current_user = current_user
-        self.step_repo = step_repo
+        self._current_user = current_user
         self.dilution_scheme = None
         self.disable_commits = False
         self.dilution_service = dilution_service
@@ -68,20 +77,56 @@ class ExtensionContext(object):
         self._calls_to_commit = 0
         self.validation_results = list()
         self.start = datetime.now()
+        self.change_set = ChangeSet()
+        self.change_set_path = change_set_path
+        self.commit_timings = dict()
 
     @staticmethod
-    def create(step_id, test_mode=False, uploaded_to_stdout=False, disable_commits=False):
+    def create(step_id, test_mode=False, uploaded_to_stdout=False, disable_commits=False,
+               session_options=None, lazy_bootstrap=False, version_check_ttl=None, metadata_cache=None,
+               loading_profile=None, async_bootstrap=False, snapshots=None, batch_options=None,
+               change_set_path=None):
         """
         Creates a context with all required services set up. This is the way
         a context is meant to be created in production and integration tests,
         use the constructor for custom use and unit tests.
+
+        :param session_options: Settings for the pooled HTTP session, sent as keyword arguments
+                                to `ClaritySession.create`, e.g. {"pool_size": 10, "max_retries": 5}
+        :param lazy_bootstrap: If True, the version check, the current step and the current user are
+                               not fetched until they are first used
+        :param version_check_ttl: Seconds a version check is valid for the server. See `ClaritySession`.
+        :param metadata_cache: Settings for the `MetadataCache`, e.g. {"path": "...", "ttl": 3600}. The
+                               cache is held in memory only in test mode.
+        :param loading_profile: A `LoadingProfile` defining which artifacts in the step are loaded
+        :param async_bootstrap: If True, the step, its process type, technician, artifacts, containers and
+                                samples are fetched up front with overlapping requests. See
+                                `StepRepository.load_async`. Takes precedence over lazy_bootstrap.
+        :param snapshots: Settings for the `SnapshotStore`, e.g. {"directory": ".cache/snapshots"}. If
+                          provided, the mapped artifacts of the step are saved and loaded from there.
+                          Snapshots are unpickled, so the directory must only be writable by the user
+                          running the extensions. Snapshots in directories that aren't are ignored.
+        :param batch_options: Settings for batch retrieve calls, e.g. {"chunk_size": 100, "workers": 4}.
+                              See `BatchRetriever`.
+        :param change_set_path: The file to save the writes made on commit to, see `ChangeSet`
         """
-        session = ClaritySession.create(step_id)
+        if test_mode:
+            metadata_cache = MetadataCache()
+        else:
+            metadata_cache = MetadataCache.shared(**(metadata_cache or dict()))
+        session = ClaritySession.create(step_id, lazy=lazy_bootstrap or async_bootstrap,
+                                        version_check_ttl=version_check_ttl, batch_options=batch_options,
+                                        metadata_cache=metadata_cache, **(session_options or dict()))
         clarity_mapper = ClarityMapper()
-        ioc.set_application(ApplicationService(session, clarity_mapper))
-        step_repo = StepRepository(session, clarity_mapper)
+        ioc.set_application(ApplicationService(session, clarity_mapper, metadata_cache))
+        snapshot_store = SnapshotStore(**snapshots) if snapshots else None
+        step_repo = StepRepository(session, clarity_mapper, metadata_cache, loading_profile, snapshot_store)
         artifact_service = ArtifactService(step_repo)
-        current_user = step_repo.current_user()
+        if async_bootstrap:
+            lazy_bootstrap = False
+            with AsyncRestClient(session) as client:
+                client.run(step_repo.load_async(client))
+        current_user = None if lazy_bootstrap else step_repo.current_user()
         file_repository = FileRepository(session)
         file_service = FileService(artifact_service, file_repository, False, OSService(),
                                    uploaded_to_stdout=uploaded_to_stdout,
@@ -97,7 +142,8 @@ class ExtensionContext(object):
                                 step_logger_service, step_repo, clarity_service,
                                 dilution_service, process_service,
                                 validation_service,
-                                test_mode=test_mode, disable_commits=disable_commits)
+                                test_mode=test_mode, disable_commits=disable_commits,
+                                lazy=lazy_bootstrap, change_set_path=change_set_path)
 
     @staticmethod
     def create_mocked(session, step_repo, os_service, file_repository, clarity_service,
@@ -129,6 +175,18 @@ class ExtensionContext(object):
                                 dilution_service, process_service, validation_service,
                                 test_mode=test_mode, disable_commits=disable_commits)
 
+    @property
+    def current_step(self):
+        if self._current_step is None:
+            self._current_step = self.step_repo.get_process()
+        return self._current_step
+
+    @property
+    def current_user(self):
+        if self._current_user is None and self._lazy:
+            self._current_user = self.step_repo.current_user()
+        return self._current_user
+
     @lazyprop
     def error_log_artifact(self):
         """
@@ -270,14 +328,37 @@ class ExtensionContext(object):
         self._update_queue.add(obj)
 
     def commit(self):
-        """Commits all objects that have been added via the update method, using batch processing if possible"""
-        self.clarity_service.update(self._update_queue, self.disable_commits)
-        self.file_service.commit(self.disable_commits)
+        """
+        Commits all objects that have been added via the update method, using batch processing if possible.
+
+        The process, the containers and samples, the artifacts and the files are written concurrently,
+        see `CommitScheduler`. The time each phase took is available in `commit_timings` afterwards.
+        """
+        scheduler = CommitScheduler()
+        for name, send in self.clarity_service.update_phases(self._update_queue, self.disable_commits,
+                                                             change_set=self.change_set):
+            scheduler.add(name, send)
+        # Uploading a file links it to an artifact, so the files are uploaded after the artifacts are updated,
+        # since an artifact resource fetched before the upload doesn't have the link:
+        scheduler.add("files", lambda: self.file_service.commit(self.disable_commits), depends_on=["artifacts"])
+        try:
+            scheduler.run()
+        finally:
+            self.commit_timings = scheduler.timings
+            if self.change_set_path:
+                self._save_change_set()
 
         # Clear the update queue (the previous calls don't do that) in case we want to call
         # commit again.
         self._update_queue.clear()
 
+    def _save_change_set(self):
+        # The change set is only used to compare test runs, so not being able to save it must not fail the commit
+        try:
+            self.change_set.save(self.change_set_path)
+        except (IOError, OSError) as e:
+            logger.warning("Not able to save the change set to {}: {}".format(self.change_set_path, e))
+
     def commit_step_log_only(self):
         log_file_names = self.validation_service.log_file_names
         self.file_service.commit_selective_files(self.disable_commits, log_file_names)
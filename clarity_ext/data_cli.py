@@ -5,7 +5,6 @@ from clarity_ext.service import ProcessService
 from clarity_ext import ClaritySession
 import subprocess
 import sys
-import requests_cache
 import re
 import yaml
 from clarity_ext.service.routing_service import RerouteInfo, RoutingService
@@ -70,6 +69,7 @@ def get_stages(workflow_status, workflow_name, protocol_name, stage_name, use_ca
     stage_pattern = re.compile(stage_name)
 
     if use_cache:
+        import requests_cache
         requests_cache.configure("workflow-info")
     session = ClaritySession.create(None)
     workflows = [workflow for workflow in session.api.get_workflows()
@@ -111,6 +111,14 @@ def move_artifacts(plan, commit):
     routing_service = RoutingService(session, commit)
     routing_service.route(reroute_infos)
 
+
+@main.command("clear-metadata-cache")
+def clear_metadata_cache():
+    """Clears the cache of configuration data, e.g. process types. Run after changing the configuration."""
+    from clarity_ext.repository.metadata_cache import MetadataCache
+    MetadataCache.shared().invalidate()
+
+
 @main.command("project-report")
 @click.option("--ignore-udf", multiple=True)
 @click.option("--ignore-project", multiple=True)
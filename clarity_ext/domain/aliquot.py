@@ -50,6 +50,12 @@ class Aliquot(Artifact):
     def set_qc_failed(self):
         self.qc_flag = self.QC_FLAG_FAILED
 
+    def __getstate__(self):
+        # The samples are not pickled (e.g. in a snapshot of the step), but fetched again when first used
+        state = dict(self.__dict__)
+        state["_samples"] = None
+        return state
+
     @property
     def samples(self):
         if self._samples is None:
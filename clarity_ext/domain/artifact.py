@@ -9,6 +9,8 @@ class Artifact(DomainObjectWithUdf):
     PER_INPUT = 1
     PER_ALL_INPUTS = 2
 
+    JOURNALED_FIELDS = ("name", "qc_flag")
+
     OUTPUT_TYPE_RESULT_FILE = 1
     OUTPUT_TYPE_ANALYTE = 2
     OUTPUT_TYPE_SHARED_RESULT_FILE = 3
@@ -7,6 +7,10 @@ class DomainObject(object):
         self.id = id
 
     def __eq__(self, other):
+        # Checked first, since comparing the fields is expensive and objects are compared with themselves
+        # when looked up in weak dictionaries, e.g. in the ClarityMapper
+        if self is other:
+            return True
         if isinstance(other, self.__class__):
             return self._eq_rec(self, other)
         else:
@@ -1,4 +1,5 @@
-from clarity_ext.domain.udf import DomainObjectWithUdf, UdfMapping
+from clarity_ext.domain.udf import DomainObjectWithUdf, UdfMapping, UdfSchema
+from clarity_ext.utils import lazyprop
 
 
 class Process(DomainObjectWithUdf):
@@ -57,6 +58,11 @@ class ProcessOutput(object):
         self.output_generation_type = output_generation_type
         self.field_definitions = field_definitions
 
+    @lazyprop
+    def udf_schema(self):
+        """The `UdfSchema` of the field definitions, shared by all artifacts of this output"""
+        return UdfSchema(self.field_definitions)
+
     @staticmethod
     def create_from_element(element):
         fields = [f.attrib["name"]
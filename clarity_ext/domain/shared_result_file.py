@@ -1,7 +1,6 @@
 from clarity_ext.domain.artifact import Artifact
 from clarity_ext.domain.udf import UdfMapping
 from clarity_ext import utils
-import requests
 
 
 class SharedResultFile(Artifact):
@@ -35,7 +34,7 @@ class SharedResultFile(Artifact):
                 logger.info("Removing (disabled) file: {}".format(f.uri))
                 return
             # TODO: Add to another service
-            r = requests.delete(f.uri, auth=(session.api.username, session.api.password))
+            r = session.delete(f.uri)
             if r.status_code != 204:
                 raise RemoveFileException("Can't remove file with id {}. Status code was {}".format(
                     f.id, r.status_code))
@@ -46,8 +45,7 @@ class SharedResultFile(Artifact):
         process_output = utils.single([process_output for process_output in process_type.process_outputs
                                        if process_output.output_generation_type == "PerAllInputs" and
                                        process_output.artifact_type == "ResultFile"])
-        udfs = UdfMapping.expand_udfs(resource, process_output)
-        udf_map = UdfMapping(udfs)
+        udf_map = UdfMapping.expand(resource, process_output)
 
         return SharedResultFile(api_resource=resource, id=resource.id, name=name, udf_map=udf_map,
                 files=resource.files)
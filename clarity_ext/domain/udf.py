@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 from clarity_ext.domain.common import DomainObject
 import logging
 
@@ -8,6 +9,10 @@ logger = logging.getLogger(__name__)
 # TODO: Ensure that this overrides the equality check too, to take into account the UDF
 # map (since we're not adding the udfs to the object, or add them to the object)
 class DomainObjectWithUdf(DomainObject):
+    # Fields, besides the UDFs, that are written to the LIMS on commit. Writes to them are recorded
+    # in a change journal, see `changed_fields`.
+    JOURNALED_FIELDS = ()
+
     def __init__(self, api_resource=None, id=None, udf_map=None):
         super().__init__(id)
 
@@ -40,8 +45,36 @@ class DomainObjectWithUdf(DomainObject):
             else:
                 raise self._create_udf_exception(key)
         else:
+            if key in self.JOURNALED_FIELDS:
+                self._journal_field(key)
             super(DomainObjectWithUdf, self).__setattr__(key, value)
 
+    def _journal_field(self, key):
+        # Records the original value on the first write. The first assignment, in the constructor, is
+        # the original value itself.
+        originals = self.__dict__.setdefault("_original_fields", dict())
+        if key not in originals:
+            try:
+                originals[key] = getattr(self, key)
+            except AttributeError:
+                pass
+
+    def changed_fields(self):
+        """Returns the journaled fields that have a different value than when the object was created"""
+        originals = self.__dict__.get("_original_fields", dict())
+        return [key for key, original in originals.items() if getattr(self, key) != original]
+
+    def enumerate_changes(self):
+        """
+        Yields (field, old value, new value) for each change in the change journals of the object and its
+        UDF map. UDF fields are named "udf:<name of the UDF>".
+        """
+        originals = self.__dict__.get("_original_fields", dict())
+        for key in self.changed_fields():
+            yield key, originals[key], getattr(self, key)
+        for udf_info in self.udf_map.enumerate_updated():
+            yield "udf:" + udf_info.key, udf_info.original_value, udf_info.value
+
     def __hash__(self):
         return hash(self.id)
 
@@ -59,12 +92,15 @@ class DomainObjectWithUdf(DomainObject):
 
     def is_dirty(self):
         """Returns True if the Artifact was updated since it was originally fetched"""
-        return sum(1 for _ in self.udf_map.enumerate_updated())
+        return sum(1 for _ in self.udf_map.enumerate_updated()) + len(self.changed_fields())
 
     def get_updated_api_resource(self):
         """
         Creates an updated api resource object based on changed values
         Returns None if the api resource has not updated
+
+        Only the fields in the change journals of the object and its UDF map are compared, so objects
+        that haven't changed are skipped without looking at the api resource.
         """
         assert self.api_resource is not None
 
@@ -72,27 +108,18 @@ class DomainObjectWithUdf(DomainObject):
         # The problem now is that if the update doesn't work out,
         # the api resource will not be in sync, which could lead to subtle errors.
         # new_api_resource = copy.deepcopy(self.api_resource)
-        new_api_resource = self.api_resource
         updated_fields = list(self.udf_map.enumerate_updated())
         # TODO: This is a patch to allow renaming artifacts. The whole approach to updating needs
-        # to be overhauled. Go through the mapper in all cases (as with Sample)
-        # and be able to ask the entire domain object if any of its attributes
-        # have changed since loading the object from the backend.
-        attrib_updates = False
-
-        if self.name != self.api_resource.name:
-            attrib_updates = True
-
-        if self.qc_flag != self.api_resource.qc_flag:
-            attrib_updates = True
-        if len(updated_fields) == 0 and not attrib_updates:
+        # to be overhauled. Go through the mapper in all cases (as with Sample).
+        changed_fields = self.changed_fields()
+        if len(updated_fields) == 0 and len(changed_fields) == 0:
             return None
-        else:
-            for udf_info in updated_fields:
-                new_api_resource.udf[udf_info.key] = udf_info.value
-            new_api_resource.name = self.name
-            new_api_resource.qc_flag = self.qc_flag
-            return new_api_resource
+        new_api_resource = self.api_resource
+        for udf_info in updated_fields:
+            new_api_resource.udf[udf_info.key] = udf_info.value
+        for key in changed_fields:
+            setattr(new_api_resource, key, getattr(self, key))
+        return new_api_resource
 
 
 class UdfMapping(object):
@@ -114,6 +141,7 @@ class UdfMapping(object):
         self.raw_map = dict()  # Mapping from names (both Clarity style and Python style) to UdfInfo
         self.values = set()  # List of unique values
         self.py_names = set()  # A list of the python names for the UDFs
+        self._changed = dict()  # The change journal: UdfInfos with a value different from the original, by key
         if original_udf_map:
             self.create_from_dict(original_udf_map)
 
@@ -131,18 +159,20 @@ class UdfMapping(object):
         self[key].value = value
 
     def add(self, key, value):
+        self._add(key, self._automap_name(key), value)
+
+    def _add(self, key, py_name, value):
         if key in self.raw_map:
             raise ValueError("Key already in dictionary {}".format(key))
 
         # We add a mapping directly from the original key to the (wrapped) value:
         # It should be in a list, since those mapped by pyname will potentially be more
         # than one:
-        udf_info = UdfInfo(key, value)
+        udf_info = UdfInfo(key, value, self)
         self.values.add(udf_info)
         self.raw_map[key] = [udf_info]
 
-        # Then, we also fetch the py name, and add that to the raw map too
-        py_name = self._automap_name(key)
+        # Then, we also add the py name to the raw map
         self.raw_map.setdefault(py_name, list())
         self.raw_map[py_name].append(udf_info)
         self.py_names.add(py_name)
@@ -198,12 +228,21 @@ class UdfMapping(object):
         return ", ".join(self.py_names)
 
     def enumerate_updated(self):
-        return (value for value in self.values if value.is_dirty())
+        """Returns the UDFs that have changed, from the change journal"""
+        return iter(list(self._changed.values()))
+
+    def _record_change(self, udf_info):
+        if udf_info.is_dirty():
+            self._changed[udf_info.key] = udf_info
+        else:
+            # Set back to the original value:
+            self._changed.pop(udf_info.key, None)
 
     def __contains__(self, item):
         return item in self.raw_map
 
     @staticmethod
+    @lru_cache(maxsize=4096)
     def _automap_name(original_udf_name):
         """
         Maps a UDF name from Clarity to one that matches Python naming conventions
@@ -223,6 +262,29 @@ class UdfMapping(object):
         new_name = re.sub("_{2,}", "_", new_name)
         return new_name
 
+    @staticmethod
+    def create_from_schema(schema, udf):
+        """
+        Creates a UdfMapping with all UDFs in the schema, with values from the udf dictionary
+        (None if missing). Keys in the udf dictionary that are not in the schema are added too.
+        """
+        ret = UdfMapping()
+        for key in schema.keys:
+            ret._add(key, schema.py_names[key], udf.get(key, None))
+        for key, value in list(udf.items()):  # keys() is not available
+            if key not in schema.py_names:
+                ret.add(key, value)
+        return ret
+
+    @staticmethod
+    def expand(api_resource, process_output):
+        """
+        Creates a UdfMapping for the resource, with all UDFs defined by the process output, using the
+        process output's precompiled schema. Handles a usability issue in the API, where we don't get
+        values for UDFs that are not defined
+        """
+        return UdfMapping.create_from_schema(process_output.udf_schema, api_resource.udf)
+
     @staticmethod
     def expand_udfs(api_resource, process_output):
         """Expands udfs for a resouces, given the information in the process output. Handles a usability issue
@@ -239,21 +301,60 @@ class UdfMapping(object):
         return str({key: self[key].value for key in self.py_names})
 
 
+class UdfSchema(object):
+    """
+    The UDF names of e.g. a process output, compiled once and shared by all UdfMappings created with it.
+
+    :param keys: The UDF names in Clarity
+    """
+
+    def __init__(self, keys):
+        self.keys = tuple(sorted(set(keys)))
+        self.py_names = {key: UdfMapping._automap_name(key) for key in self.keys}
+        keys_by_py_name = dict()
+        for key, py_name in self.py_names.items():
+            keys_by_py_name.setdefault(py_name, list()).append(key)
+        # Python names that more than one UDF maps to. These can only be accessed by the Clarity name.
+        self.clashes = {py_name: keys for py_name, keys in keys_by_py_name.items() if len(keys) > 1}
+
+    def __repr__(self):
+        return "UdfSchema({})".format(", ".join(self.keys))
+
+
 class UdfInfo(object):
     """
     Represents a Udf. Contains the original value as well as the current value.
+
+    Changes to the value are recorded in the change journal of the UdfMapping it belongs to.
     """
-    def __init__(self, key, value):
+    def __init__(self, key, value, mapping=None):
         self.key = key
-        self.value = value
-        self._original_value = self.value
+        self._value = value
+        self._original_value = value
+        self._mapping = mapping
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def original_value(self):
+        return self._original_value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if self._mapping is not None:
+            self._mapping._record_change(self)
 
     def is_dirty(self):
         """Returns True if the value has changed since the object was created"""
         return self.value != self._original_value
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, UdfInfo):
+            return False
+        return (self.key, self._value, self._original_value) == (other.key, other._value, other._original_value)
 
     def __hash__(self):
         return hash(self.__repr__())
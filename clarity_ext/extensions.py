@@ -12,19 +12,18 @@ import difflib
 import traceback
 from clarity_ext.utils import lazyprop
 from clarity_ext import ClaritySession
-from clarity_ext.repository import StepRepository
+from clarity_ext.repository import StepRepository, LoadingProfile
 from clarity_ext.service import ArtifactService, FileService
+from clarity_ext.service.change_set import ChangeSet
 from clarity_ext.utility.integration_test_service import IntegrationTest
 from clarity_ext.service.dilution.index_generation import ConfigValidator
 from clarity_ext.service.dilution.index_generation import ConfigParser
 from clarity_ext.service.step_logger_service import StepLoggerService
 from clarity_ext.domain.validation import ValidationException
 from clarity_ext.domain.validation import ValidationType
-from jinja2 import Template
 import time
 import random
 import logging.handlers
-import lxml.objectify
 from clarity_ext.service.validation_service import UsageError
 import re
 
@@ -253,6 +252,9 @@ class ExtensionService(object):
         extension = instance.__class__
         context = instance.context
         try:
+            prefetch_file_handles = instance.prefetch_shared_files()
+            if prefetch_file_handles:
+                context.file_service.prefetch(prefetch_file_handles)
             if issubclass(extension, DriverFileExtension):
                 context.file_service.upload(instance.shared_file(), instance.filename(), instance.to_string(),
                                             instance.file_prefix())
@@ -282,9 +284,20 @@ class ExtensionService(object):
         old_dir = os.getcwd()
         os.chdir(path)
         self.logger.info("Executing at {}".format(path))
+        # The writes are saved to compare test runs with frozen runs. In production, all steps share the path.
+        change_set_path = os.path.join(path, ChangeSet.FILE_NAME) if test_mode else None
         context = ExtensionContext.create(pid, test_mode=test_mode,
                                           disable_commits=disable_context_commit,
-                                          uploaded_to_stdout=artifacts_to_stdout)
+                                          uploaded_to_stdout=artifacts_to_stdout,
+                                          session_options=config.get("http"),
+                                          lazy_bootstrap=config.get("lazy_bootstrap", False),
+                                          async_bootstrap=config.get("async_bootstrap", False),
+                                          version_check_ttl=config.get("version_check_ttl"),
+                                          metadata_cache=config.get("metadata_cache"),
+                                          snapshots=config.get("snapshots"),
+                                          batch_options=config.get("batch"),
+                                          change_set_path=change_set_path,
+                                          loading_profile=getattr(extension, "LOADING_PROFILE", None))
 
         instance = extension(context, config, self)
 
@@ -434,12 +447,24 @@ class RunDirectoryInfo(object):
             if len(diff) > 0:
                 yield ("logs", "extensions.log", "".join(diff[0:10]))
 
+        # Compare the writes. Runs frozen before change sets were saved don't have one:
+        change_set_a = os.path.join(self.path, ChangeSet.FILE_NAME)
+        change_set_b = os.path.join(other.path, ChangeSet.FILE_NAME)
+        if os.path.exists(change_set_a) and os.path.exists(change_set_b):
+            diff = self.compare_files(change_set_a, change_set_b)
+            if len(diff) > 0:
+                yield ("writes", ChangeSet.FILE_NAME, "".join(diff[0:10]))
+
 
 class GeneralExtension(object, metaclass=ABCMeta):
     """
     An extension that must implement the `execute` method
     """
 
+    # Defines which artifacts in the step are loaded. Override with e.g. LoadingProfile.ANALYTES
+    # if the extension doesn't need all artifacts. Forks run with the profile of the extension that was started.
+    LOADING_PROFILE = LoadingProfile.ALL
+
     def __init__(self, context, config=None, extension_svc=None):
         """
         @type context: clarity_ext.driverfile.DriverFileContext
@@ -537,6 +562,13 @@ class GeneralExtension(object, metaclass=ABCMeta):
         else:
             return random.Random()
 
+    def prefetch_shared_files(self):
+        """
+        Override to return the file handles of shared files that the extension reads. The files are then
+        downloaded concurrently before the extension runs, instead of one at a time when first requested.
+        """
+        return list()
+
     def handle_validation(self, validation_results):
         return self.validation_service.handle_validation(validation_results)
 
@@ -564,6 +596,7 @@ class GeneralExtension(object, metaclass=ABCMeta):
         """Parses the value using func, but adding extra information for the end user.
 
         If this is an XML file, it will also add information on which line the error occurred."""
+        import lxml.objectify
         try:
             return func(val)
         except ValueError:
@@ -606,7 +639,7 @@ class GeneralExtension(object, metaclass=ABCMeta):
                         continue
                     value = source.udf_map[udf].value
                     self.logger.info("  - {}: {}".format(udf, value))
-                    if value is None:
+                    if value is None or target.udf_map[udf].value == value:
                         continue
                     target.udf_map[udf] = value
                     self.context.update(target)
@@ -677,7 +710,8 @@ class IndexFileExtension(GeneralExtension):
         from clarity_ext.repository.reagent_type_repository import ReagentTypeRepository
         """ factory method"""
         label = input_analytes[0].get_reagent_label()
-        reagent_repo = ReagentTypeRepository(session=self.context.session)
+        reagent_repo = ReagentTypeRepository(session=self.context.session,
+                                             metadata_cache=self.context.step_repo.metadata_cache)
         reagent_type = reagent_repo.get_reagent_type(label=label)
         expected_sample_name = self._get_sample_name(reagent_type.category)
         sample_resources = self.context.session.api.get_samples(name=expected_sample_name)
@@ -781,6 +815,7 @@ class TemplateExtension(DriverFileExtension, metaclass=ABCMeta):
         return os.path.join(self.template_dir, self.default_template_name)
 
     def content(self):
+        from jinja2 import Template
         with open(self.template_path, 'r') as fs:
             text = fs.read()
             template = Template(text, newline_sequence=self.newline())
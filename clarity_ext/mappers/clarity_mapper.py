@@ -1,7 +1,9 @@
+import weakref
 from clarity_ext.domain.udf import UdfMapping
 from clarity_ext.domain.aliquot import Project, Sample
 from clarity_ext.domain import ResultFile
 from clarity_ext.domain import Analyte, Project
+from clarity_ext.domain.shared_result_file import SharedResultFile
 from clarity_ext import utils
 from clarity_ext.domain.container import ContainerPosition
 from clarity_ext.inversion_of_control.ioc import ioc
@@ -24,11 +26,14 @@ class ClarityMapper(object):
     """
 
     def __init__(self):
-        self.map = dict()
+        # The api resource of each domain object created by the mapper. See NOTE above.
+        self.map = weakref.WeakKeyDictionary()
 
-        # Cache of all domain objects, indexed by the ID in the LIMS
-        # TODO: Currently just caching analytes
-        self.domain_map = dict()
+        # Identity map of all artifact domain objects, indexed by the ID in the LIMS. This ensures
+        # there is only one domain object per artifact, even if it's in several rows of the input/output
+        # map or in several steps mapped by this mapper. The objects are held by the ones using them,
+        # e.g. the ArtifactService, so both maps are weak to not keep objects alive that are not used anymore.
+        self.domain_map = weakref.WeakValueDictionary()
 
         # TODO: The container_repo used here could be reused per the lifetime of the mapper instead, and not
         # passed around.
@@ -41,6 +46,21 @@ class ClarityMapper(object):
         # directly from the domain objects.
         self.map[domain_object] = resource
 
+    def register(self, domain_object):
+        """
+        Registers a domain object that was created elsewhere, e.g. loaded from a snapshot, as if it had
+        been created by this mapper
+        """
+        self._after_object_created(domain_object, domain_object.api_resource)
+        if isinstance(domain_object, (Analyte, ResultFile, SharedResultFile)):
+            self.domain_map[domain_object.id] = domain_object
+
+    def forget(self, artifact_id):
+        """Removes an artifact from the identity map, so it's created anew when it's mapped the next time"""
+        domain_object = self.domain_map.pop(artifact_id, None)
+        if domain_object is not None:
+            self.map.pop(domain_object, None)
+
     def _get_from_cache(self, domain_object):
         if domain_object not in self.map:
             raise Exception("The domain object was not created via the mapper. In this implementation "
@@ -92,10 +112,11 @@ class ClarityMapper(object):
         """
         # Map UDFs (which may be using different names in different Clarity setups)
         # to a key-value list with well-defined key names:
-        if resource.id in self.domain_map:
-            return self.domain_map[resource.id]
+        existing = self.domain_map.get(resource.id)
+        if existing is not None:
+            return existing
 
-        udfs = None
+        udf_map = None
         if not is_input:
             # Get the process-output section, output_generation_type is either PerInput for regular analytes or
             # PerAllInputs for pools
@@ -104,12 +125,10 @@ class ClarityMapper(object):
                                   if process_output.artifact_type == "Analyte"]
             process_output = utils.single_or_default(per_input_analytes)
             if process_output:
-                udfs = UdfMapping.expand_udfs(resource, process_output)
-
-        if udfs is None:
-            udfs = resource.udf
+                udf_map = UdfMapping.expand(resource, process_output)
 
-        udf_map = UdfMapping(udfs)
+        if udf_map is None:
+            udf_map = UdfMapping(resource.udf)
         well = self.well_create_object(resource, is_input)
         is_control = self._is_control(resource)
         # TODO: A better way to decide if analyte is output of a previous step?
@@ -138,7 +157,8 @@ class ClarityMapper(object):
         pass
 
     def well_create_object(self, resource, is_source):
-        # TODO: Batch call
+        # NOTE: Containers in a step are fetched in one batch call by the StepRepository, so this will
+        # usually not call the LIMS
         try:
             container = ioc.app.container_repository.get_container(
                 resource.location[0], is_source)
@@ -163,13 +183,16 @@ class ClarityMapper(object):
         Creates a `ResultFile` from the REST resource object.
         The container is fetched from the container_repo.
         """
+        existing = self.domain_map.get(resource.id)
+        if existing is not None:
+            return existing
+
         if not is_input:
             # We expect the process_type to define one PerInput ResultFile
             process_output = utils.single([process_output for process_output in process_type.process_outputs
                                            if process_output.output_generation_type == "PerInput" and
                                            process_output.artifact_type == "ResultFile"])
-        udfs = UdfMapping.expand_udfs(resource, process_output)
-        udf_map = UdfMapping(udfs)
+        udf_map = UdfMapping.expand(resource, process_output)
 
         well = self.well_create_object(resource, is_input)
         ret = ResultFile(api_resource=resource,
@@ -181,6 +204,18 @@ class ClarityMapper(object):
                          qc_flag=resource.qc_flag,
                          udf_map=udf_map,
                          mapper=self)
+        self.domain_map[resource.id] = ret
+        return ret
+
+    def shared_result_file_create_object(self, resource, process_type):
+        """
+        Creates a `SharedResultFile` from the REST resource object.
+        """
+        existing = self.domain_map.get(resource.id)
+        if existing is not None:
+            return existing
+        ret = SharedResultFile.create_from_rest_resource(resource, process_type)
+        self.domain_map[resource.id] = ret
         return ret
 
 
@@ -1,5 +1,4 @@
 
-import requests_cache
 import re
 
 
@@ -9,6 +8,7 @@ class ReportingService(object):
         if use_cache:
             # TODO: The cache is being ignored 
             cache_name = "reporting-svc-cache"
+            import requests_cache
             requests_cache.configure(cache_name)
 
     def create_project_report(self, ignore_udf, ignore_project):
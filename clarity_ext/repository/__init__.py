@@ -1,4 +1,7 @@
-from .step_repository import StepRepository
+from .step_repository import StepRepository, LoadingProfile
 from .file_repository import FileRepository
 from .container_repository import ContainerRepository
-from .clarity_repository import ClarityRepository
\ No newline at end of file
+from .clarity_repository import ClarityRepository, BatchUpdateError
+from .metadata_cache import MetadataCache
+from .async_rest import AsyncRestClient
+from .snapshot_store import SnapshotStore
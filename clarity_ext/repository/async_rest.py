@@ -0,0 +1,89 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncRestClient(object):
+    """
+    An asyncio interface to the REST API of the LIMS, for overlapping requests that don't depend on
+    each other.
+
+    The requests are made with the genologics api object of a `ClaritySession`, and so over its pooled
+    HTTP session, on a thread pool. Entities are loaded in place, i.e. their `root` is set, just as with
+    the synchronous calls, so code using them afterwards does not call the LIMS again.
+
+    Use `run` to call a coroutine from synchronous code:
+
+        with AsyncRestClient(session) as client:
+            client.run(step_repo.load_async(client))
+
+    :param session: A `ClaritySession`
+    :param workers: The max number of requests in flight. Should not be larger than the pool size
+                    of the HTTP session.
+    """
+
+    DEFAULT_WORKERS = 8
+
+    def __init__(self, session, workers=DEFAULT_WORKERS):
+        self.session = session
+        self.api = session.api
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    @staticmethod
+    def run(coroutine):
+        """Runs the coroutine to completion in a new event loop and returns its result"""
+        return asyncio.run(coroutine)
+
+    async def call(self, fn, *args, **kwargs):
+        """Calls a blocking function on the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def get(self, entity, force=False):
+        """Fetches a genologics entity, unless it's already loaded"""
+        if force or entity.root is None:
+            entity.root = await self.call(self.api.get, entity.uri)
+        return entity
+
+    async def get_all(self, entities, force=False):
+        """Fetches the entities one by one, concurrently. Use `batch_retrieve` for the types that support it."""
+        return await asyncio.gather(*[self.get(entity, force) for entity in entities])
+
+    async def batch_retrieve(self, entities, force=False):
+        """
+        Fetches artifacts, containers, files or samples (all of the same type) with batch calls.
+        Returns the distinct entities, see `ClaritySession.get_batch`.
+        """
+        entities = list(entities)
+        if not entities:
+            return list()
+        return await self.call(self.session.get_batch, entities, force=force)
+
+    async def put(self, entity):
+        """Updates the entity in the LIMS"""
+        await self.call(entity.put)
+        return entity
+
+    async def put_batch(self, entities):
+        """Updates artifacts, containers, files or samples (all of the same type) in one batch call"""
+        entities = list(entities)
+        if entities:
+            await self.call(self.api.put_batch, entities)
+        return entities
+
+    async def download(self, file_repository, remote_file_id, local_path):
+        """Downloads a file with a `FileRepository`. Returns its `DownloadResult`."""
+        return await self.call(file_repository.copy_remote_file, remote_file_id, local_path)
+
+    async def upload(self, entity, local_path):
+        """Uploads a local file and attaches it to the entity, e.g. an artifact"""
+        return await self.call(self.api.upload_new_file, entity, local_path)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
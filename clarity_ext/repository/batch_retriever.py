@@ -0,0 +1,86 @@
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BatchRetriever(object):
+    """
+    Fetches entities with the batch retrieve endpoints of the LIMS, like `Lims.get_batch`, but splits
+    large requests into chunks that are requested concurrently. Each response is parsed while it's being
+    received, so the entities in a chunk are loaded as the LIMS streams them.
+
+    Requests are sent over the pooled HTTP session of the `ClaritySession`.
+
+    :param api: The genologics api object
+    :param http_session: The `requests.Session` to use
+    :param chunk_size: The max number of entities in one request
+    :param workers: The max number of chunks requested at the same time
+    """
+
+    DEFAULT_CHUNK_SIZE = 200
+    DEFAULT_WORKERS = 4
+    ALLOWED_TAGS = ("artifact", "container", "file", "sample")
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, api, http_session, chunk_size=None, workers=None):
+        self.api = api
+        self.http_session = http_session
+        self.chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        self.workers = workers or self.DEFAULT_WORKERS
+
+    def get_batch(self, instances, force=False):
+        """
+        Loads the instances that are not loaded already (all of them if force is True). All instances
+        must be of the same type.
+
+        Returns the distinct instances, in the order they were first sent in.
+        """
+        instances = list(instances)
+        if not instances:
+            return list()
+        if instances[0]._TAG not in self.ALLOWED_TAGS:
+            raise TypeError("Cannot retrieve batch for instances of type '{}'".format(instances[0]._TAG))
+
+        instance_map = dict()
+        for instance in instances:
+            instance_map.setdefault(instance.id, instance)
+        to_fetch = [instance for instance in instance_map.values() if force or instance.root is None]
+        chunks = [to_fetch[i:i + self.chunk_size] for i in range(0, len(to_fetch), self.chunk_size)]
+
+        if len(chunks) == 1:
+            self._retrieve_chunk(chunks[0], instance_map)
+        elif chunks:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as executor:
+                # Consume the results to raise the first error, if any:
+                list(executor.map(lambda chunk: self._retrieve_chunk(chunk, instance_map), chunks))
+        return list(instance_map.values())
+
+    def _retrieve_chunk(self, chunk, instance_map):
+        from genologics.constants import nsmap
+        links = ET.Element(nsmap("ri:links"))
+        for instance in chunk:
+            ET.SubElement(links, "link", dict(uri=instance.uri, rel=instance.__class__._URI))
+        uri = self.api.get_uri(chunk[0].__class__._URI, "batch/retrieve")
+        response = self.http_session.post(uri, data=self.api.tostring(ET.ElementTree(links)),
+                                          auth=(self.api.username, self.api.password),
+                                          headers={"content-type": "application/xml",
+                                                   "accept": "application/xml"},
+                                          stream=True)
+        with response:
+            self.api.validate_response(response)
+            for node in self._parse_details(response):
+                instance_map[node.attrib["limsid"]].root = node
+
+    def _parse_details(self, response):
+        """Yields the child elements of the details element in the response, as soon as each is parsed"""
+        parser = ET.XMLPullParser(events=("start", "end"))
+        depth = 0
+        for data in response.iter_content(chunk_size=self.READ_SIZE):
+            parser.feed(data)
+            for event, element in parser.read_events():
+                if event == "start":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 1:
+                        yield element
+        parser.close()
@@ -1,3 +1,89 @@
+import re
+import logging
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+
 class ClarityRepository(object):
+    """
+    Updates resources in the LIMS.
+
+    :param batch_chunk_size: The max number of resources updated in one batch call
+    """
+
+    DEFAULT_BATCH_CHUNK_SIZE = 100
+    # The resource types that can be updated with the batch endpoints:
+    BATCH_TAGS = ("artifact", "container", "file", "sample")
+
+    def __init__(self, batch_chunk_size=None, logger=None):
+        self.batch_chunk_size = batch_chunk_size or self.DEFAULT_BATCH_CHUNK_SIZE
+        self.logger = logger or logging.getLogger(__name__)
+
     def update(self, resource):
         resource.put()
+
+    def update_batch(self, resources):
+        """
+        Updates the resources with the batch update endpoints, in chunks of at most `batch_chunk_size`
+        resources of the same type. Resources that don't support batch updates are updated one by one.
+
+        A chunk that fails doesn't stop the others. Each failing chunk is logged once, and a
+        `BatchUpdateError` listing all of them is raised when all chunks have been sent.
+        """
+        resources_by_tag = dict()
+        for resource in resources:
+            resources_by_tag.setdefault(resource._TAG, list()).append(resource)
+
+        failures = list()
+        for tag, tag_resources in resources_by_tag.items():
+            if tag not in self.BATCH_TAGS:
+                for resource in tag_resources:
+                    self.update(resource)
+                continue
+            for i in range(0, len(tag_resources), self.batch_chunk_size):
+                chunk = tag_resources[i:i + self.batch_chunk_size]
+                try:
+                    chunk[0].lims.put_batch(chunk)
+                except Exception as e:
+                    failure = BatchUpdateFailure(tag, [resource.id for resource in chunk], e)
+                    self.logger.error(str(failure))
+                    failures.append(failure)
+        if failures:
+            raise BatchUpdateError(failures)
+
+    def create_batch(self, instances):
+        """
+        Creates resources with the batch create endpoints, in chunks of at most `batch_chunk_size`. The
+        instances are genologics entities of the same type, created in memory but not posted.
+
+        Returns the created entities, in the same order as the instances.
+        """
+        instances = list(instances)
+        created = list()
+        for i in range(0, len(instances), self.batch_chunk_size):
+            chunk = instances[i:i + self.batch_chunk_size]
+            api = chunk[0].lims
+            # As in Lims.put_batch, the details element is in the namespace of the resources, e.g. con:details
+            namespace = re.match("{(.*)}.*", chunk[0].root.tag).group(1)
+            details = ET.Element("{%s}details" % namespace)
+            details.extend(instance.root for instance in chunk)
+            links = api.post(api.get_uri(chunk[0]._URI, "batch/create"), api.tostring(ET.ElementTree(details)))
+            created.extend(type(chunk[0])(api, uri=link.attrib["uri"]) for link in links.findall("link"))
+        return created
+
+
+class BatchUpdateFailure(namedtuple("BatchUpdateFailure", ["tag", "ids", "error"])):
+    """A chunk of resources that could not be updated in a batch update"""
+
+    def __str__(self):
+        return "Not able to update {} {}: {}".format(self.tag, ", ".join(self.ids), self.error)
+
+
+class BatchUpdateError(Exception):
+    """Raised when one or more chunks in a batch update failed. The other chunks were updated."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        super(BatchUpdateError, self).__init__(
+            "{} of the chunks in the batch update failed:\n{}".format(
+                len(failures), "\n".join(str(failure) for failure in failures)))
@@ -5,16 +5,41 @@ class ContainerRepository:
     """
     Used to fetch `Container` domain objects. Fetches from a cache before
     creating from a rest resource.
+
+    Container types are loaded through the metadata cache, if one is provided.
     """
 
-    def __init__(self):
+    def __init__(self, metadata_cache=None):
         self.cache = dict()
+        self.metadata_cache = metadata_cache
+
+    def prefetch(self, session, input_container_resources, output_container_resources):
+        """
+        Fetches all containers that are not already cached with batch calls and creates the
+        domain objects, so later calls to `get_container` don't need to call the LIMS.
+
+        Containers holding input artifacts are created as source containers.
+
+        :param session: The `ClaritySession`
+        """
+        source_ids = set(resource.id for resource in input_container_resources)
+        resources = dict()
+        for resource in list(input_container_resources) + list(output_container_resources):
+            if resource.id not in self.cache:
+                resources[resource.id] = resource
+        if not resources:
+            return
+        session.get_batch(list(resources.values()))
+        for resource in resources.values():
+            self.get_container(resource, is_source=resource.id in source_ids)
 
     def get_container(self, container_resource, is_source, artifacts=None):
         # TODO: It looks silly to have is_input here
         if container_resource.id in self.cache:
             return self.cache[container_resource.id]
         else:
+            if self.metadata_cache:
+                self.metadata_cache.hydrate(container_resource.type)
             ret = Container.create_from_rest_resource(
                 container_resource,
                 api_artifacts=artifacts,
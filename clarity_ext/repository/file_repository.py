@@ -1,22 +1,100 @@
-from bs4 import UnicodeDammit
+import os
+import time
+import hashlib
+import logging
+from collections import namedtuple
+import requests
 
 
 class FileRepository:
     """
     Handles remote and local file access.
 
+    Remote files are streamed to disk in large chunks. The download is written to a partial file
+    next to the target, which is renamed when the download completes. If a download is interrupted,
+    it's resumed from the partial file, either directly (up to `max_resume_attempts` times) or the
+    next time the same file is requested.
+
     TODO: Merge with "OSService"
     """
 
-    def __init__(self, session):
+    DEFAULT_CHUNK_SIZE = 2 ** 20
+    DEFAULT_MAX_RESUME_ATTEMPTS = 3
+    PARTIAL_SUFFIX = ".part"
+
+    def __init__(self, session, chunk_size=DEFAULT_CHUNK_SIZE, max_resume_attempts=DEFAULT_MAX_RESUME_ATTEMPTS,
+                 logger=None):
+        """
+        :param session: A ClaritySession
+        :param chunk_size: The number of bytes read from the network and written to disk at a time
+        :param max_resume_attempts: The number of times an interrupted download is resumed before giving up
+        """
         self.session = session
+        self.chunk_size = chunk_size
+        self.max_resume_attempts = max_resume_attempts
+        self.logger = logger or logging.getLogger(__name__)
 
     def copy_remote_file(self, remote_file_id, local_path):
+        """
+        Downloads the file to local_path, computing a SHA-256 checksum while streaming.
+
+        Returns a `DownloadResult`.
+        """
         # TODO: implemented in the genologics pip package?
-        response = self.session.get("files/{}/download".format(remote_file_id))
-        with open(local_path, 'wb') as fd:
-            for chunk in response.iter_content():
+        partial_path = local_path + self.PARTIAL_SUFFIX
+        start = time.time()
+        attempt = 0
+        while True:
+            try:
+                size, sha256 = self._download(remote_file_id, partial_path)
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > self.max_resume_attempts:
+                    raise
+                self.logger.warning("Download of file {} was interrupted ({}), resuming (attempt {}/{})".format(
+                    remote_file_id, e, attempt, self.max_resume_attempts))
+        os.replace(partial_path, local_path)
+        result = DownloadResult(local_path, size, sha256, time.time() - start)
+        # NOTE: Logged on debug level, since the timing differs between runs
+        self.logger.debug("Downloaded file {}: {} bytes in {:.3f}s ({:.2f} MB/s), sha256={}".format(
+            remote_file_id, result.size, result.seconds, result.throughput / 2 ** 20, result.sha256))
+        return result
+
+    def _download(self, remote_file_id, partial_path):
+        """
+        Streams the file to partial_path, resuming from what's already there if the server supports it.
+        Returns a tuple of (size, SHA-256 hex digest) of the complete file.
+        """
+        sha256 = hashlib.sha256()
+        offset = self._hash_partial_file(partial_path, sha256) if os.path.exists(partial_path) else 0
+        headers = {"Range": "bytes={}-".format(offset)} if offset > 0 else dict()
+        response = self.session.get("files/{}/download".format(remote_file_id), stream=True, headers=headers)
+
+        if offset > 0 and response.status_code != 206:
+            # The server doesn't support the range (or the partial file is stale), start over
+            self.logger.info("Not able to resume the download of file {}, starting over".format(remote_file_id))
+            response.close()
+            sha256 = hashlib.sha256()
+            offset = 0
+            response = self.session.get("files/{}/download".format(remote_file_id), stream=True)
+        response.raise_for_status()
+
+        size = offset
+        with open(partial_path, 'ab' if offset > 0 else 'wb') as fd:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
                 fd.write(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+        return size, sha256.hexdigest()
+
+    def _hash_partial_file(self, path, sha256):
+        size = 0
+        with open(path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(self.chunk_size), b""):
+                sha256.update(chunk)
+                size += len(chunk)
+        return size
 
     def open_local_file(self, local_path, mode):
         """
@@ -25,6 +103,7 @@ class FileRepository:
         Provided for being able to test with dependency injection instead of patching open.
         Services will always use this way of opening files.
         """
+        from bs4 import UnicodeDammit
         with open(local_path, 'rb') as f:
             byte_contents = f.read()
 
@@ -34,3 +113,12 @@ class FileRepository:
             raise UnicodeError("Failed to detect encoding for this file.")
         encoding = dammit.original_encoding or 'utf-8'
         return open(local_path, mode, encoding=encoding)
+
+
+class DownloadResult(namedtuple("DownloadResult", ["path", "size", "sha256", "seconds"])):
+    """Describes a completed download"""
+
+    @property
+    def throughput(self):
+        """Bytes per second"""
+        return self.size / self.seconds if self.seconds > 0 else float(self.size)
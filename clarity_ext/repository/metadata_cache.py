@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+
+class MetadataCache(object):
+    """
+    A cache for configuration data in the LIMS that only changes when an admin edits it, such as
+    process types, container types and reagent types.
+
+    Entries are keyed by URI (or by a query string for query results) and are kept in memory and,
+    if a path is provided, in an sqlite database so they survive between runs. Entries older than
+    `ttl` seconds are treated as missing. Use `invalidate` after changing the configuration in the LIMS,
+    or run the `clear-metadata-cache` command in data_cli.
+
+    NOTE: Only use this for configuration data, never for data on samples, artifacts, containers etc.
+    """
+
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "clarity-ext", "metadata.sqlite")
+    DEFAULT_TTL = 24 * 60 * 60
+
+    # Process-wide instances, by path
+    _shared = dict()
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, logger=None):
+        """
+        :param path: Path to the sqlite database. If None, the cache is held in memory only.
+        :param ttl: Number of seconds an entry is valid
+        """
+        self.path = path
+        self.ttl = ttl
+        self.logger = logger or logging.getLogger(__name__)
+        self._memory = dict()
+        self._lock = threading.Lock()
+        self._connection = self._connect(path) if path else None
+
+    @classmethod
+    def shared(cls, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        """Returns the cache for the path, creating it the first time it's requested in the process"""
+        with cls._shared_lock:
+            if path not in cls._shared:
+                cls._shared[path] = cls(path, ttl)
+            return cls._shared[path]
+
+    def _connect(self, path):
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(path, check_same_thread=False)
+            connection.execute("CREATE TABLE IF NOT EXISTS metadata "
+                               "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+            connection.commit()
+            return connection
+        except (OSError, sqlite3.Error) as e:
+            # The cache is an optimization only, so we run without persistence rather than failing
+            self.logger.warning("Not able to open the metadata cache at {} ({}), using memory only".format(path, e))
+            return None
+
+    def get(self, key):
+        """Returns the value stored for the key, or None if it's missing or has expired"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None and self._connection:
+                try:
+                    row = self._connection.execute(
+                        "SELECT value, stored_at FROM metadata WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error as e:
+                    self._disconnect(e)
+                    row = None
+                if row:
+                    entry = (json.loads(row[0]), row[1])
+                    self._memory[key] = entry
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.time() - stored_at >= self.ttl:
+                return None
+            return value
+
+    def set(self, key, value):
+        """Stores a JSON serializable value for the key"""
+        stored_at = time.time()
+        with self._lock:
+            self._memory[key] = (value, stored_at)
+            if self._connection:
+                try:
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO metadata (key, value, stored_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), stored_at))
+                    self._connection.commit()
+                except sqlite3.Error as e:
+                    self._disconnect(e)
+
+    def invalidate(self, key=None):
+        """Removes the entry for the key, or all entries if no key is provided"""
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+            else:
+                self._memory.pop(key, None)
+            if self._connection:
+                try:
+                    if key is None:
+                        self._connection.execute("DELETE FROM metadata")
+                    else:
+                        self._connection.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                    self._connection.commit()
+                except sqlite3.Error as e:
+                    self._disconnect(e)
+
+    def _disconnect(self, error):
+        # As in _connect, the cache is an optimization only, so an error in the database (e.g. when it's locked
+        # by concurrent runs for too long) makes the cache use memory only for the rest of the run
+        self.logger.warning("Not able to use the metadata cache at {} ({}), using memory only".format(
+            self.path, error))
+        try:
+            self._connection.close()
+        except sqlite3.Error:
+            pass
+        self._connection = None
+
+    def hydrate(self, entity):
+        """
+        Ensures that a genologics entity has its XML loaded, from the cache if possible. Otherwise it's
+        fetched from the LIMS and cached by its URI.
+        """
+        if entity.root is not None:
+            return entity
+        xml = self.get(entity.uri)
+        if xml is not None:
+            entity.root = ET.fromstring(xml)
+        else:
+            entity.get()
+            self.set(entity.uri, ET.tostring(entity.root, encoding="unicode"))
+        return entity
@@ -3,18 +3,21 @@ from clarity_ext.domain.reagent import ReagentType
 
 
 class ReagentTypeRepository:
-    def __init__(self, session):
+    def __init__(self, session, metadata_cache=None):
         self.session = session
+        self.metadata_cache = metadata_cache
 
     def get_reagent_types(self, label):
-        reagent_types = self.session.api.get_reagent_types(name=label)
-        ret = list()
-        for reagent_type_lims in reagent_types:
-            reagent_type = ReagentType(label=label,
-                                       category=reagent_type_lims.category,
-                                       sequence=reagent_type_lims.sequence)
-            ret.append(reagent_type)
-        return ret
+        key = "reagenttypes?name={}".format(label)
+        entries = self.metadata_cache.get(key) if self.metadata_cache else None
+        if entries is None:
+            reagent_types = self.session.api.get_reagent_types(name=label)
+            entries = [{"category": reagent_type_lims.category, "sequence": reagent_type_lims.sequence}
+                       for reagent_type_lims in reagent_types]
+            if self.metadata_cache:
+                self.metadata_cache.set(key, entries)
+        return [ReagentType(label=label, category=entry["category"], sequence=entry["sequence"])
+                for entry in entries]
 
     def get_reagent_type(self, label):
         return single(self.get_reagent_types(label=label))
@@ -1,22 +1,42 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from clarity_ext import utils
 from clarity_ext.mappers.clarity_mapper import ClarityMapper
 
 
 class SampleRepository(object):
     """
     During initiation of current context (i.e. at step repository at clarity-ext
-    or container repository at snpseq-data) fill up a list of candidates,
+    or container repository at snpseq-data) fill up a registry of candidates,
     consisting of all (un-fetched) samples needed in the current context.
     Upon first request of a sample (typically within script execution), fetch
     them all in one swoop, by get_batch()
+
+    Each sample is registered once, even though it's typically added for the input,
+    the output and every pool that contains it.
     """
+    # Projects are fetched concurrently, since there's no batch endpoint for them, and cached for
+    # PROJECT_TTL seconds for all repositories in the process: uri => (xml root, time fetched)
+    PROJECT_WORKERS = 8
+    PROJECT_TTL = 60 * 60
+    _projects = dict()
+    _projects_lock = threading.Lock()
+
     def __init__(self, session, clarity_mapper):
         self.session = session
         self.clarity_mapper = clarity_mapper
-        self.candidates = list()  # not-fetched genologics sample resources
-        self.samples = dict()
+        self.candidates = dict()  # genologics sample resources, by uri
+        self.samples = dict()  # sample domain objects, by uri
+        self._pending = dict()  # candidates that have not been fetched yet, by uri
 
     def add_candidate(self, sample_resource):
-        self.candidates.append(sample_resource)
+        uri = getattr(sample_resource, "uri", None)
+        if uri is None or uri in self.candidates:
+            # Already registered, or not a REST resource, so there's nothing to fetch
+            return
+        self.candidates[uri] = sample_resource
+        self._pending[uri] = sample_resource
 
     def get_samples(self, sample_resources):
         if not self._is_fetched:
@@ -30,16 +50,42 @@ class SampleRepository(object):
 
     @property
     def _is_fetched(self):
-        return len(self.candidates) == len(self.samples)
-
-    @property
-    def _not_fetched_candidates(self):
-        return [c for c in self.candidates if c.uri not in self.samples]
+        return not self._pending
 
     def _fetch_candidates(self):
-        candidates = self._not_fetched_candidates
-        fetched_resources = self.session.api.get_batch(candidates)
+        """Fetches and maps all candidates that have not been fetched yet, with one call to get_batch"""
+        fetched_resources = self.session.get_batch(list(self._pending.values()))
+        self._fetch_projects(fetched_resources)
         for resource in fetched_resources:
             sample = self.clarity_mapper.sample_create_object(resource)
             self.samples[resource.uri] = sample
+        self._pending.clear()
+
+    def _fetch_projects(self, sample_resources):
+        """Loads the projects of the samples, so they're not fetched one by one when mapping the samples"""
+        projects = utils.unique((resource.project for resource in sample_resources if resource.project is not None),
+                                lambda project: project.uri)
+        now = time.time()
+        to_fetch = list()
+        with self._projects_lock:
+            for project in projects:
+                if project.root is not None:
+                    continue
+                cached = self._projects.get(project.uri)
+                if cached is not None and now - cached[1] < self.PROJECT_TTL:
+                    project.root = cached[0]
+                else:
+                    to_fetch.append(project)
+        if not to_fetch:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.PROJECT_WORKERS, len(to_fetch))) as executor:
+            list(executor.map(lambda project: project.get(), to_fetch))
+        with self._projects_lock:
+            for project in to_fetch:
+                self._projects[project.uri] = (project.root, now)
 
+    @classmethod
+    def clear_projects(cls):
+        """Removes all projects cached in the process"""
+        with cls._projects_lock:
+            cls._projects.clear()
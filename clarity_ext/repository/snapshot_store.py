@@ -0,0 +1,123 @@
+import os
+import io
+import stat
+import zlib
+import pickle
+import logging
+
+
+class SnapshotStore(object):
+    """
+    Stores the mapped domain objects of a step (the input/output pairs with their containers, wells
+    and UDF maps) as compressed pickles, so a step that's loaded again without changes doesn't
+    have to be fetched, parsed and mapped again.
+
+    Snapshots are keyed by the step, the current state of its artifacts and their containers, see
+    `StepRepository.snapshot_key`, so a snapshot is not used anymore after an artifact or a container
+    in the step has been changed. Samples are not stored, but fetched when first used.
+
+    REST resources (genologics entities) are not stored. When loading, they are replaced by not yet
+    fetched entities with the same URI, which are fetched if they are used, e.g. when committing changes.
+    References to the mapper are replaced by the mapper sent to `load`.
+
+    Loading a snapshot unpickles it, which can run arbitrary code, so the directory must only be
+    writable by the user running the extensions. Snapshots are not loaded if the directory or the
+    snapshot is owned by another user or is writable by the group or others.
+
+    :param directory: The directory to keep the snapshots in. Created, only accessible by the
+                      current user, if it doesn't exist.
+    """
+
+    # Increase when the layout of the domain objects changes, to not load incompatible snapshots:
+    FORMAT_VERSION = 3
+    EXTENSION = ".snapshot"
+
+    def __init__(self, directory, logger=None):
+        self.directory = directory
+        self.logger = logger or logging.getLogger(__name__)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.EXTENSION)
+
+    def save(self, key, graph):
+        """Saves the graph, any object that can be pickled except for genologics entities and the mapper"""
+        from clarity_ext.mappers.clarity_mapper import ClarityMapper
+        from genologics.entities import Entity
+        from genologics.lims import Lims
+
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def persistent_id(obj):
+            if isinstance(obj, Entity):
+                return "entity", type(obj).__module__, type(obj).__name__, obj.uri
+            elif isinstance(obj, ClarityMapper):
+                return "mapper",
+            elif isinstance(obj, Lims):
+                return "lims",
+            return None
+
+        pickler.persistent_id = persistent_id
+        pickler.dump((self.FORMAT_VERSION, graph))
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, mode=0o700)
+        # Write to a temporary file first, so a concurrent load never sees a partial snapshot:
+        path = self.path(key)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(zlib.compress(buffer.getvalue()))
+        os.replace(temp_path, path)
+
+    def load(self, key, api, mapper):
+        """
+        Returns the graph saved with the key, or None if there is no such snapshot or it can't be read
+
+        :param api: The genologics api object, used for the entities in the graph
+        :param mapper: The ClarityMapper to use for the domain objects in the graph
+        """
+        import importlib
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        if not self._is_trusted(self.directory) or not self._is_trusted(path):
+            self.logger.warning("Not loading the snapshot {}, since it or its directory is owned by another "
+                                "user or writable by the group or others".format(path))
+            return None
+
+        def persistent_load(pid):
+            if pid[0] == "entity":
+                _, module, class_name, uri = pid
+                return getattr(importlib.import_module(module), class_name)(api, uri=uri)
+            elif pid[0] == "mapper":
+                return mapper
+            elif pid[0] == "lims":
+                return api
+            raise pickle.UnpicklingError("Unknown persistent id {}".format(pid))
+
+        try:
+            with open(path, "rb") as f:
+                unpickler = pickle.Unpickler(io.BytesIO(zlib.decompress(f.read())))
+            unpickler.persistent_load = persistent_load
+            version, graph = unpickler.load()
+        except Exception as e:
+            # The snapshot is an optimization only, so we load the step from the LIMS instead
+            self.logger.warning("Not able to load the snapshot {} ({})".format(path, e))
+            return None
+        if version != self.FORMAT_VERSION:
+            return None
+        return graph
+
+    @staticmethod
+    def _is_trusted(path):
+        """Returns True if the path is owned by the current user and only writable by them"""
+        st = os.stat(path)
+        return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+    def clear(self):
+        """Removes all snapshots"""
+        if not os.path.exists(self.directory):
+            return
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(self.EXTENSION):
+                os.remove(os.path.join(self.directory, file_name))
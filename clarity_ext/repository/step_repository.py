@@ -1,12 +1,47 @@
-from genologics.entities import Artifact as ApiArtifact
+import xml.etree.ElementTree as ET
+import asyncio
+from clarity_ext import utils
 from clarity_ext.domain.artifact import Artifact
-from clarity_ext.domain.shared_result_file import SharedResultFile
-from clarity_ext.repository.container_repository import ContainerRepository
+from clarity_ext.domain.aliquot import Aliquot
+from clarity_ext.inversion_of_control.ioc import ioc
 from clarity_ext.domain.user import User
 from clarity_ext.domain import ProcessType
 from urllib.parse import urlparse
 
 
+class LoadingProfile(object):
+    """
+    Declares which artifacts in a step a `StepRepository` loads. Rows in the input/output map that
+    the profile excludes are neither fetched nor mapped.
+
+    Shared result files are always loaded, since they're used for the step log.
+
+    :param name: A descriptive name
+    :param output_types: The output types to load, e.g. ("Analyte",). Loads all if None.
+    :param inputs: If False, the inputs are not loaded. Pairs will then have None as the input.
+    """
+
+    def __init__(self, name, output_types=None, inputs=True):
+        self.name = name
+        self.output_types = output_types
+        self.inputs = inputs
+
+    def includes(self, output_info):
+        """Returns True if the row in the input/output map having this output should be loaded"""
+        if output_info["output-type"] == "ResultFile" and output_info["output-generation-type"] == "PerAllInputs":
+            return True
+        return self.output_types is None or output_info["output-type"] in self.output_types
+
+    def __repr__(self):
+        return "LoadingProfile({})".format(self.name)
+
+
+LoadingProfile.ALL = LoadingProfile("all")
+LoadingProfile.ANALYTES = LoadingProfile("analytes", output_types=("Analyte",))
+LoadingProfile.OUTPUTS = LoadingProfile("outputs", inputs=False)
+LoadingProfile.SHARED_FILES = LoadingProfile("shared files", output_types=(), inputs=False)
+
+
 class StepRepository(object):
     """
     Provides access to data that's available through a current step.
@@ -22,14 +57,25 @@ class StepRepository(object):
     ARTIFACT_FETCH_STRATEGY_USE_POST_PROCESS_URI = 3
 
 
-    def __init__(self, session, clarity_mapper):
+    def __init__(self, session, clarity_mapper, metadata_cache=None, loading_profile=None, snapshot_store=None):
         """
         Creates a new StepRepository
 
         :param session: A session object for connecting to Clarity
+        :param metadata_cache: A `MetadataCache` for the process type definition. Optional.
+        :param loading_profile: A `LoadingProfile` defining which artifacts are loaded. Loads all by default.
+        :param snapshot_store: A `SnapshotStore`. If provided, the mapped artifacts are saved to it and
+                               loaded from it when the step is loaded again with no changes. Optional.
         """
         self.session = session
         self.clarity_mapper = clarity_mapper
+        self.metadata_cache = metadata_cache
+        self.loading_profile = loading_profile or LoadingProfile.ALL
+        self.snapshot_store = snapshot_store
+        self._process_type = None
+        self._prefetched = None
+        # The current state of each loaded artifact, by artifact ID:
+        self._loaded_states = None
 
         self._input_strategy = self.ARTIFACT_FETCH_STRATEGY_USE_CURRENT_STATE
         self._output_strategy = self.ARTIFACT_FETCH_STRATEGY_USE_CURRENT_STATE
@@ -47,81 +93,256 @@ class StepRepository(object):
 
         The list is not unique, i.e. artifacts will be fetched more than once.
 
+        Only the artifacts included in the repository's `LoadingProfile` are returned. If the profile
+        excludes inputs, the input in each pair is None.
+
         Performance note: This method may fetch much more data than necessary as it's designed
         for simplified use of the API. If optimal performance is required, use the underlying REST API
         instead.
         """
+        if self.snapshot_store is None:
+            return self._map_artifacts()
+
+        key = self.snapshot_key()
+        graph = self.snapshot_store.load(key, self.session.api, self.clarity_mapper)
+        if graph is not None:
+            return self._restore_snapshot(graph)
+        ret = self._map_artifacts()
+        self._save_snapshot(key, ret)
+        return ret
+
+    def _map_artifacts(self):
+        resource_pairs, input_containers, output_containers, process_type = self.prefetch()
+        ioc.app.container_repository.prefetch(self.session, input_containers, output_containers)
 
-        def fetch_entry(strategy, info_object):
-            # NOTE: When fetching step info, artifacts come in a certain state, but this state
-            # is *not* the latest state. In particular, if QC flags have been set by another script
-            # or the user in the UI, we don't see the latest changes. Because of this
-            # we want to fetch using the current state, which you can do by not sending in the
-            # state flag.
-            # Temporarily, we provide two other strategies for this. These are only provided for
-            # debug reasons and should not be altered.
-            if strategy == self.ARTIFACT_FETCH_STRATEGY_USE_URI:
-                return info_object["uri"]
-            elif strategy == self.ARTIFACT_FETCH_STRATEGY_USE_CURRENT_STATE:
-                # The other two strategies fetch using the state flag:
-                # https://lims-dev.snpseq.medsci.uu.se/api/v2/artifacts/2-192121?state=108523
-                # as that's in the input/output map we get from the backend.
-                # Here we remove this state flag
-                overview_entry = info_object["uri"]
+        ret = []
 
-                parsed = urlparse(overview_entry.uri)
-                current_state_uri = "{}://{}{}".format(parsed.scheme, parsed.netloc, parsed.path)
-                return ApiArtifact(overview_entry.lims, uri=current_state_uri)
-            elif strategy == self.ARTIFACT_FETCH_STRATEGY_USE_POST_PROCESS_URI:
-                return info_object["post-process-uri"]
+        # In the case of pools, we might have the same output artifact repeated more than once, ensure
+        # that we create only one artifact domain object in this case:
+        outputs_by_id = dict()
 
-        def fetch_input(info_object):
-            return fetch_entry(self._input_strategy, info_object)
+        for input_resource, output_resource, output_gen_type in resource_pairs:
+            input_domain_obj, output_domain_obj = self._wrap_input_output(
+                    input_resource,
+                    output_resource,
+                    output_gen_type,
+                    process_type)
+            if output_domain_obj.id in outputs_by_id:
+                output_domain_obj = outputs_by_id[output_domain_obj.id]
+            ret.append((input_domain_obj, output_domain_obj))
+            outputs_by_id[output_domain_obj.id] = output_domain_obj
+        return ret
 
-        def fetch_output(info_object):
-            return fetch_entry(self._output_strategy, info_object)
+    def snapshot_key(self):
+        """
+        Returns a key for the current state of the step, made from the step ID, the loading profile, the
+        current state IDs of all artifacts in it and a digest of their containers. The artifacts and the
+        containers are fetched with batch calls.
 
-        input_output_maps = self.session.current_step.api_resource.input_output_maps
+        Samples are not part of the snapshot, see `_save_snapshot`, so changes to them don't need to
+        change the key.
+        """
+        import hashlib
+        artifacts = self.session.get_batch(self.artifact_resources())
+        states = sorted(self._current_states(artifacts).values())
+        # Container names and UDFs can change without changing the state of the artifacts in them:
+        containers = self.session.get_batch(self.container_resources(artifacts))
+        container_digests = sorted(
+            "{} {}".format(container.uri, hashlib.sha1(ET.tostring(container.root)).hexdigest())
+            for container in containers)
+        digest = hashlib.sha1("\n".join([self.loading_profile.name] + states + container_digests)
+                              .encode("utf-8")).hexdigest()
+        return "{}-{}".format(self.session.current_step_id, digest)
+
+    def _save_snapshot(self, key, pairs):
+        # Samples (and their projects) are not saved, since they can be changed without changing the state of
+        # the artifacts. They are fetched with batch calls when first used, as when not using snapshots.
+        self.snapshot_store.save(key, {"pairs": pairs, "process_type": self.get_process_type()})
+
+    def _restore_snapshot(self, graph):
+        """Registers the domain objects in a snapshot with the mapper, the sample and the container repository"""
+        container_repo = ioc.app.container_repository
+        for artifact in self._artifacts_in(graph["pairs"]):
+            self.clarity_mapper.register(artifact)
+            if isinstance(artifact, Aliquot):
+                artifact._init_samples()
+            if getattr(artifact, "container", None) is not None:
+                container_repo.cache.setdefault(artifact.container.id, artifact.container)
+        self._process_type = graph["process_type"]
+        # The artifacts were fetched when creating the key of the snapshot:
+        self._loaded_states = self._current_states(self.session.get_batch(self.artifact_resources()))
+        return graph["pairs"]
+
+    @staticmethod
+    def _artifacts_in(pairs):
+        return utils.unique((artifact for pair in pairs for artifact in pair if artifact is not None),
+                            lambda artifact: artifact.id)
+
+    def prefetch(self):
+        """
+        Fetches everything `all_artifacts` needs from the LIMS, without creating any domain objects:
+        the step, its artifacts (with batch calls), their containers (with batch calls) and the
+        process type.
 
-        artifact_keys = set()
+        This can be called on several repositories concurrently, while creating the domain objects
+        in `all_artifacts` should be done on one thread at a time, since they share a mapper.
 
-        for input_info, output_info in input_output_maps:
-            artifact_keys.add(fetch_input(input_info))
-            artifact_keys.add(fetch_output(output_info))
+        Returns a tuple of (list of (input resource, output resource, output generation type),
+        input container resources, output container resources, process type). The result is memoised.
+        """
+        if self._prefetched is not None:
+            return self._prefetched
 
-        artifacts = self.session.api.get_batch(artifact_keys)
+        artifacts = self.session.get_batch(self.artifact_resources())
+        self._loaded_states = self._current_states(artifacts)
 
         artifacts_by_uri = {artifact.uri: artifact for artifact in artifacts}
+        resource_pairs = [(artifacts_by_uri[self._fetch_input(input_info).uri] if self.loading_profile.inputs else None,
+                           artifacts_by_uri[self._fetch_output(output_info).uri],
+                           output_info["output-generation-type"])
+                          for input_info, output_info in self._input_output_maps()]
 
+        # Fetch all containers with batch calls rather than one by one when mapping the wells:
+        input_containers = self._containers(input_resource for input_resource, _, _ in resource_pairs
+                                            if input_resource is not None)
+        output_containers = self._containers(output_resource for _, output_resource, _ in resource_pairs)
+        self.session.get_batch(input_containers + output_containers)
 
         # Artifacts do not contain UDFs that have not been given a value. Since the domain
         # objects returned must know all UDFs available, we fetch them here:
         # TODO: Move this to the service
         process_type = self.get_process_type()
 
-        ret = []
-        # TODO: Ensure that the container repo fetches all containers in one batch call:
+        self._prefetched = (resource_pairs, input_containers, output_containers, process_type)
+        return self._prefetched
 
-        # In the case of pools, we might have the same output artifact repeated more than once, ensure
-        # that we create only one artifact domain object in this case:
-        outputs_by_id = dict()
-        container_repo = ContainerRepository()
+    async def load_async(self, client):
+        """
+        Fetches what the context needs when it's created, overlapping the requests that don't depend
+        on each other:
 
-        for input_info, output_info in input_output_maps:
-            input_resource = artifacts_by_uri[fetch_input(input_info).uri]
-            output_resource = artifacts_by_uri[fetch_output(output_info).uri]
-            output_gen_type = output_info["output-generation-type"]
+            1. The step (and the version check, if it's due)
+            2. The process type, the technician and the artifacts (with batch calls)
+            3. The containers and the samples of the artifacts (with batch calls)
 
-            input_domain_obj, output_domain_obj = self._wrap_input_output(
-                    input_resource,
-                    output_resource,
-                    output_gen_type,
-                    process_type)
-            if output_domain_obj.id in outputs_by_id:
-                output_domain_obj = outputs_by_id[output_domain_obj.id]
-            ret.append((input_domain_obj, output_domain_obj))
-            outputs_by_id[output_domain_obj.id] = output_domain_obj
-        return ret
+        The resources are loaded in place, so `prefetch`, `current_user` etc. won't fetch them again.
+
+        :param client: An `AsyncRestClient` for the session
+        """
+        if not self.session.current_step_id:
+            return
+        from genologics.entities import Process as ApiProcess
+        process_resource = ApiProcess(self.session.api, id=self.session.current_step_id)
+        await asyncio.gather(client.call(self.session.check_version), client.get(process_resource))
+
+        # The step is fetched, so this only creates the domain object:
+        technician = self.session.current_step.technician
+        requests = [client.batch_retrieve(self.artifact_resources()), client.call(self.get_process_type)]
+        if technician is not None:
+            requests.append(client.get(technician))
+        artifacts = (await asyncio.gather(*requests))[0]
+
+        samples = utils.unique((sample for artifact in artifacts for sample in artifact.samples),
+                               lambda sample: sample.uri)
+        await asyncio.gather(client.batch_retrieve(self.container_resources(artifacts)),
+                             client.batch_retrieve(samples))
+
+    def refresh(self):
+        """
+        Fetches the step and the current state of its artifacts again (the artifacts with one batch call),
+        and compares the state IDs with those of the artifacts already loaded. Changed artifacts (or new
+        artifacts in the step) will be mapped again by the next call to `all_artifacts`, while the domain
+        objects of unchanged artifacts are left in place.
+
+        The state IDs in the input/output map of the step are not used, since they don't change when
+        e.g. QC flags or UDFs are set in the UI or by other scripts.
+
+        Returns the IDs of the artifacts that have changed. Does nothing if the artifacts haven't been
+        loaded yet.
+        """
+        if self._loaded_states is None:
+            return set()
+        self.session.current_step.api_resource.get(force=True)
+        states = self._current_states(self.session.get_batch(self.artifact_resources(), force=True))
+        changed_ids = set(artifact_id for artifact_id, state in states.items()
+                          if self._loaded_states.get(artifact_id) != state)
+        if not changed_ids:
+            return changed_ids
+
+        for artifact_id in changed_ids:
+            self.clarity_mapper.forget(artifact_id)
+        self._prefetched = None
+        return changed_ids
+
+    @staticmethod
+    def _current_states(artifacts):
+        """Returns the current state of each (fetched) artifact resource, i.e. the URI it was fetched with, by ID"""
+        return {artifact.id: artifact.root.get("uri") for artifact in artifacts}
+
+    def artifact_resources(self):
+        """
+        Returns the (not yet fetched) resources of all distinct artifacts in the step. Use this to fetch
+        the artifacts of several steps in one batch call before calling `prefetch`.
+        """
+        artifact_keys = dict()
+        for input_info, output_info in self._input_output_maps():
+            if self.loading_profile.inputs:
+                resource = self._fetch_input(input_info)
+                artifact_keys.setdefault(resource.uri, resource)
+            resource = self._fetch_output(output_info)
+            artifact_keys.setdefault(resource.uri, resource)
+        return list(artifact_keys.values())
+
+    def _input_output_maps(self):
+        """The rows in the input/output map of the step that are included in the loading profile"""
+        return [(input_info, output_info)
+                for input_info, output_info in self.session.current_step.api_resource.input_output_maps
+                if self.loading_profile.includes(output_info)]
+
+    @classmethod
+    def container_resources(cls, artifact_resources):
+        """Returns the distinct containers of the (fetched) artifact resources"""
+        return cls._containers(artifact_resources)
+
+    def _fetch_entry(self, strategy, info_object):
+        # NOTE: When fetching step info, artifacts come in a certain state, but this state
+        # is *not* the latest state. In particular, if QC flags have been set by another script
+        # or the user in the UI, we don't see the latest changes. Because of this
+        # we want to fetch using the current state, which you can do by not sending in the
+        # state flag.
+        # Temporarily, we provide two other strategies for this. These are only provided for
+        # debug reasons and should not be altered.
+        if strategy == self.ARTIFACT_FETCH_STRATEGY_USE_URI:
+            return info_object["uri"]
+        elif strategy == self.ARTIFACT_FETCH_STRATEGY_USE_CURRENT_STATE:
+            # The other two strategies fetch using the state flag:
+            # https://lims-dev.snpseq.medsci.uu.se/api/v2/artifacts/2-192121?state=108523
+            # as that's in the input/output map we get from the backend.
+            # Here we remove this state flag
+            overview_entry = info_object["uri"]
+
+            parsed = urlparse(overview_entry.uri)
+            current_state_uri = "{}://{}{}".format(parsed.scheme, parsed.netloc, parsed.path)
+            from genologics.entities import Artifact as ApiArtifact
+            return ApiArtifact(overview_entry.lims, uri=current_state_uri)
+        elif strategy == self.ARTIFACT_FETCH_STRATEGY_USE_POST_PROCESS_URI:
+            return info_object["post-process-uri"]
+
+    def _fetch_input(self, info_object):
+        return self._fetch_entry(self._input_strategy, info_object)
+
+    def _fetch_output(self, info_object):
+        return self._fetch_entry(self._output_strategy, info_object)
+
+    @staticmethod
+    def _containers(artifact_resources):
+        """Returns the distinct container resources the artifacts are in, in order of first appearance"""
+        containers = dict()
+        for artifact_resource in artifact_resources:
+            container = artifact_resource.location[0] if artifact_resource.location else None
+            if container is not None:
+                containers.setdefault(container.id, container)
+        return list(containers.values())
 
     def _wrap_input_output(
             self, input_resource, output_resource,
@@ -132,11 +353,13 @@ class StepRepository(object):
         # Create a fresh container repository. Then we know that only one container
         # will be created for each object in a call to this method
 
-        input = self._wrap_artifact(
-            input_resource,
-            gen_type="Input",
-            is_input=True,
-            process_type=process_type)
+        input = None
+        if input_resource is not None:
+            input = self._wrap_artifact(
+                input_resource,
+                gen_type="Input",
+                is_input=True,
+                process_type=process_type)
 
         output = self._wrap_artifact(
             output_resource,
@@ -158,7 +381,8 @@ class StepRepository(object):
         # analyte/resultfile. As a consequence, there are several instances of the same
         # input artifact, with different values of .output. When populating containers, there
         # is no check as of which one of these input artifacts are used!
-        input.output = output
+        if input is not None:
+            input.output = output
         output.input = input
 
         return input, output
@@ -176,7 +400,7 @@ class StepRepository(object):
             wrapped = self.clarity_mapper.result_file_create_object(
                 artifact, is_input, process_type)
         elif artifact.type == "ResultFile" and gen_type == "PerAllInputs":
-            wrapped = SharedResultFile.create_from_rest_resource(
+            wrapped = self.clarity_mapper.shared_result_file_create_object(
                 artifact, process_type)
         else:
             raise Exception("Unknown type and gen_type combination {}, {}".format(
@@ -206,8 +430,14 @@ class StepRepository(object):
 
     def get_process_type(self):
         """Returns the process type of the current process"""
-        self.session.current_step.api_resource.type.get()
-        return ProcessType.create_from_resource(self.session.current_step.api_resource.type)
+        if self._process_type is None:
+            resource = self.session.current_step.api_resource.type
+            if self.metadata_cache:
+                self.metadata_cache.hydrate(resource)
+            else:
+                resource.get()
+            self._process_type = ProcessType.create_from_resource(resource)
+        return self._process_type
 
     def get_process(self):
         """Returns the currently running process (step)"""
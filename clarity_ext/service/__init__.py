@@ -4,3 +4,5 @@ from .step_logger_service import StepLoggerService
 from .process_service import ProcessService
 from .clarity_service import ClarityService
 from .validation_service import ValidationService
+from .change_set import ChangeSet
+from .commit_scheduler import CommitScheduler
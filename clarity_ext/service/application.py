@@ -7,6 +7,7 @@ class ApplicationService(object):
     Sets up instances of all required repositories in the system.
     """
 
-    def __init__(self, session, clarity_mapper):
+    def __init__(self, session, clarity_mapper, metadata_cache=None):
+        self.metadata_cache = metadata_cache
         self.sample_repository = SampleRepository(session, clarity_mapper)
-        self.container_repository = ContainerRepository()
+        self.container_repository = ContainerRepository(metadata_cache)
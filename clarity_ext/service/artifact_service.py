@@ -1,9 +1,10 @@
 import logging
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from clarity_ext.domain import *
 from clarity_ext.domain.shared_result_file import SharedResultFile
 from clarity_ext.repository import StepRepository
-from clarity_ext.clarity import ClaritySession
+from clarity_ext.service.lineage import LineageGraph
 
 
 class ArtifactService:
@@ -12,122 +13,119 @@ class ArtifactService:
 
     Artifacts are fetched through the step_repository, provided in the constructor.
 
-    All objects fetched from the step repository are cached.
+    All objects fetched from the step repository are cached. This includes artifacts in other steps
+    (e.g. parent steps), which are cached per process id.
     """
 
+    # The max number of steps that are loaded concurrently, e.g. when fetching parent steps
+    STEP_WORKERS = 4
+
     def __init__(self, step_repository, logger=None):
         self.step_repository = step_repository
         self.logger = logger or logging.getLogger(__name__)
         self._artifacts = None
+        self._index = None
         self._parent_input_artifacts_by_sample_id = None
+        self._artifact_services_by_step_id = dict()
+        self._lineage_graphs = dict()
 
     def all_artifacts(self):
         # NOTE: The underlying REST library does also do some caching, but since this library wraps
         # objects, some benefit may be achieved by caching on this level too.
         if not self._artifacts:
             self._artifacts = self.step_repository.all_artifacts()
+            self._index = None
         return self._artifacts
 
+    def refresh(self):
+        """
+        Reloads the artifacts in the step that have changed in the LIMS since they were loaded, e.g. after
+        an update. The domain objects of unchanged artifacts are kept. See `StepRepository.refresh`.
+
+        Returns the new domain objects of the changed artifacts.
+        """
+        changed_ids = self.step_repository.refresh()
+        if not changed_ids:
+            return list()
+        self._artifacts = None
+        return list(utils.unique((artifact for pair in self.all_artifacts() for artifact in pair
+                                  if artifact is not None and artifact.id in changed_ids),
+                                 lambda artifact: artifact.id))
+
+    @property
+    def index(self):
+        """
+        An `ArtifactIndex` over the artifacts in the step, built the first time it's used after the
+        artifacts have been loaded. All queries in this service are answered from it.
+        """
+        artifacts = self.all_artifacts()
+        if self._index is None:
+            self._index = ArtifactIndex(artifacts)
+        return self._index
+
     def shared_files(self):
         """
         Returns all shared files for the current step
         """
-        outputs = (outp for inp, outp in self.all_artifacts())
-        shared_files = (
-            outp for outp in outputs if isinstance(outp, SharedResultFile))
-        ret = list(utils.unique(shared_files, lambda f: f.id))
-        assert len(ret) == 0 or isinstance(ret[0], SharedResultFile)
-        return ret
+        return list(self.index.shared_files)
+
+    def shared_files_by_handle(self, file_handle):
+        """
+        Returns all shared files having the file handle (name), e.g. "Step log"
+        """
+        return list(self.index.shared_files_by_handle.get(file_handle, ()))
 
     def all_aliquot_pairs(self):
         """
         Returns all aliquots in a step as an artifact pair (input/output)
         """
-        pairs = self.all_artifacts()
-        aliquots_only = [
-            pair for pair in pairs
-            if isinstance(pair[0], Aliquot) and isinstance(pair[1], Aliquot)
-        ]
-        return [ArtifactPair(i, o) for i, o in aliquots_only]
+        return [ArtifactPair(i, o) for i, o in self.index.aliquot_pairs]
 
     def all_analyte_pairs(self):
         """
         Returns all analytes in a step as an artifact pair (input/output)
         """
-        pairs = self.all_artifacts()
-        analytes_only = [pair for pair in pairs if isinstance(pair[0], Analyte) and
-                               isinstance(pair[1], Analyte)]
-        return [ArtifactPair(i, o) for i, o in analytes_only]
+        return [ArtifactPair(i, o) for i, o in self.index.analyte_pairs]
 
     def all_input_artifacts(self):
         """Returns a unique list of input artifacts"""
-        return utils.unique(self._filter_artifact(True, Artifact), lambda item: item.id)
+        return list(self.index.inputs)
 
     def all_output_artifacts(self):
         """Returns a unique list of output artifacts"""
-        return utils.unique(self._filter_artifact(False, Artifact), lambda item: item.id)
-
-    def _filter_artifact(self, input, type):
-        # Fetches all input analytes in the step, unique
-        pair_index = 0 if input else 1
-        for pair in self.all_artifacts():
-            if isinstance(pair[pair_index], type):
-                yield pair[pair_index]
+        return list(self.index.outputs)
 
     def all_input_analytes(self):
         """Returns a unique list of input analytes"""
-        return [x for x in self.all_input_artifacts() if isinstance(x, Analyte)]
+        return [x for x in self.index.inputs if isinstance(x, Analyte)]
 
     def all_output_analytes(self):
         """Returns a unique list of output analytes"""
-        return [x for x in self.all_output_artifacts() if isinstance(x, Analyte)]
+        return [x for x in self.index.outputs if isinstance(x, Analyte)]
 
     def all_containers(self):
         """
         Returns the mapping of all input containers to output containers
         """
-        containers = dict()
-        for in_artifact, out_artifact in self.all_artifacts():
-            if isinstance(in_artifact, Aliquot) and isinstance(out_artifact, Aliquot):
-                if in_artifact.container and out_artifact.container:
-                    key = in_artifact.container.id + "|" + out_artifact.container.id
-                    if key not in containers:
-                        containers[key] = (in_artifact.container, out_artifact.container)
-        return list(containers.values())
+        return list(self.index.container_pairs)
 
     def all_output_containers(self):
-        containers_non_unique = (artifact.container
-                                 for artifact in self.all_output_artifacts()
-                                 if isinstance(artifact, Aliquot) and artifact.container is not None)
-        containers = utils.unique(
-            containers_non_unique, lambda item: item.id)
-        return list(containers)
+        return list(self.index.output_containers)
 
     def all_input_containers(self):
-        artifacts_having_container = (artifact.container
-                                      for artifact in self.all_input_artifacts()
-                                      if artifact.container is not None)
-        containers = utils.unique(
-            artifacts_having_container, lambda item: item.id)
-        return list(containers)
+        return list(self.index.input_containers)
 
     def all_output_files(self):
-        outputs = (outp for inp, outp in self.all_artifacts())
-        files = (outp for outp in outputs
-                 if outp.output_type == Artifact.OUTPUT_TYPE_RESULT_FILE)
-        ret = list(utils.unique(files, lambda f: f.id))
-        return ret
+        return list(self.index.outputs_by_type.get(Artifact.OUTPUT_TYPE_RESULT_FILE, ()))
 
     def output_file_by_id(self, file_id):
-        ret = utils.single(
-            [outp for outp in self.all_output_files() if outp.id == file_id])
+        output = self.index.outputs_by_id.get(file_id)
+        ret = utils.single([output] if output is not None and
+                           output.output_type == Artifact.OUTPUT_TYPE_RESULT_FILE else [])
         return ret
 
     def all_shared_result_files(self):
-        outputs = (outp for inp, outp in self.all_artifacts())
-        files = (outp for outp in outputs
-                 if outp.output_type == Artifact.OUTPUT_TYPE_SHARED_RESULT_FILE)
-        ret = list(utils.unique(files, lambda f: f.id))
+        ret = list(self.index.outputs_by_type.get(Artifact.OUTPUT_TYPE_SHARED_RESULT_FILE, ()))
         assert len(ret) == 0 or isinstance(ret[0], ResultFile)
         return ret
 
@@ -135,6 +133,8 @@ class ArtifactService:
         """
         Returns a dictionary of all parent input artifacts, indexed by process ID.
 
+        Requires a `LoadingProfile` that loads the inputs of the step. Raises a ValueError otherwise.
+
         Details:
         In your current step (CS), you will have input and output artifacts like this:
             [CS-I1  ->  CS-O1]
@@ -148,18 +148,71 @@ class ArtifactService:
         This method will fetch all of the input artifacts based on all of your output artifacts in one call
         and index them by their respective process id.
         """
+        outputs = self.all_output_artifacts()
+        if any(artifact.input is None for artifact in outputs):
+            raise ValueError("Fetching the parent input artifacts requires the inputs of the step, which are not "
+                             "loaded with the loading profile '{}'. Use a LoadingProfile that includes the inputs, "
+                             "e.g. LoadingProfile.ALL".format(self.step_repository.loading_profile.name))
         # We will need the input artifacts from the previous step
-        parent_processes = set([artifact.input.parent_process for artifact in self.all_output_artifacts()])
-
-        for process in parent_processes:
-            # This might seem roundabout, but for simplicity, we create another artifact service for
-            # fetching the parent items:
-            parent_step_repo = StepRepository(ClaritySession.create(process.id),
-                                              self.step_repository.clarity_mapper)
-            parent_artifact_service = ArtifactService(parent_step_repo)
+        parent_processes = utils.unique((artifact.input.parent_process for artifact in outputs
+                                         if artifact.input.parent_process is not None),
+                                        lambda process: process.id)
+
+        for parent_artifact_service in self.artifact_services_for_steps([process.id for process in parent_processes]):
             for input in parent_artifact_service.all_input_artifacts():
                 yield input
 
+    def artifact_services_for_steps(self, step_ids):
+        """
+        Returns an `ArtifactService` for each of the steps, in the same order.
+
+        Steps that have not been requested before are fetched from the LIMS concurrently, over the
+        same HTTP session as the current step, and mapped with the same mapper. The services are cached
+        for the lifetime of this service.
+        """
+        # This might seem roundabout, but for simplicity, we create another artifact service for
+        # fetching the items in the other steps:
+        new_services = dict()
+        for step_id in step_ids:
+            if step_id not in self._artifact_services_by_step_id and step_id not in new_services:
+                step_repo = StepRepository(self.step_repository.session.for_step(step_id),
+                                           self.step_repository.clarity_mapper,
+                                           self.step_repository.metadata_cache)
+                new_services[step_id] = ArtifactService(step_repo, self.logger)
+
+        if new_services:
+            self._fetch_steps([service.step_repository for service in new_services.values()])
+            # The domain objects are created on this thread, since all steps share the mapper:
+            for step_id, service in new_services.items():
+                service.all_artifacts()
+                self._artifact_services_by_step_id[step_id] = service
+        return [self._artifact_services_by_step_id[step_id] for step_id in step_ids]
+
+    def _fetch_steps(self, step_repos):
+        """
+        Fetches the steps concurrently, then the artifacts in all of them with batch calls and
+        then the containers.
+        """
+        session = self.step_repository.session
+        with ThreadPoolExecutor(max_workers=min(self.STEP_WORKERS, len(step_repos))) as executor:
+            artifact_resources = list(executor.map(lambda step_repo: step_repo.artifact_resources(), step_repos))
+        artifact_resources = list(utils.unique((resource for resources in artifact_resources
+                                                for resource in resources), lambda resource: resource.uri))
+        session.get_batch(artifact_resources)
+        session.get_batch(StepRepository.container_resources(artifact_resources))
+        # Only the process types are left to fetch, if they're not cached:
+        for step_repo in step_repos:
+            step_repo.prefetch()
+
+    def lineage_graph(self, generations):
+        """
+        Returns a `LineageGraph` of the current step and the given number of generations of
+        ancestor steps. The ancestor steps are loaded breadth-first, a generation at a time.
+        """
+        if generations not in self._lineage_graphs:
+            self._lineage_graphs[generations] = LineageGraph.load(self, generations)
+        return self._lineage_graphs[generations]
+
     def get_parent_input_artifact(self, sample):
         """
         Given a sample in some artifact, returns a list of parent artifacts for that sample. This should usually
@@ -180,14 +233,74 @@ class ArtifactService:
         """
         Returns all individual output `ResultFile`s. These are generated "per input".
         """
-        return [output for _, output in self.all_artifacts()
-                if output.generation_type == output.PER_INPUT]
+        return list(self.index.per_input_outputs)
 
     def get_all_analyte_pairs_from_process(self, process):
         """
         Returns all analyte_pairs from a specific process
         """
-        process_step_repo = StepRepository(ClaritySession.create(process.id),
-                                          self.step_repository.clarity_mapper)
-        parent_artifact_service = ArtifactService(process_step_repo)
-        return parent_artifact_service.all_analyte_pairs()
+        process_artifact_service = utils.single(self.artifact_services_for_steps([process.id]))
+        return process_artifact_service.all_analyte_pairs()
+
+
+class ArtifactIndex(object):
+    """
+    Indexes the artifact pairs in a step, by id, output type, role (input/output), container and
+    file handle, so that queries on the step don't need to scan all pairs.
+
+    Lists are unique by id and in the order of first appearance in the pairs, except for
+    `per_input_outputs` which has one entry per pair. Inputs may be None, these are not indexed.
+
+    NOTE: The index is a snapshot. Containers are indexed as they were when the index was built.
+    """
+
+    def __init__(self, pairs):
+        self.inputs = list()
+        self.outputs = list()
+        self.outputs_by_id = dict()
+        self.outputs_by_type = defaultdict(list)
+        self.shared_files = list()
+        self.shared_files_by_handle = defaultdict(list)
+        self.aliquot_pairs = list()
+        self.analyte_pairs = list()
+        self.per_input_outputs = list()
+        self.input_containers = list()
+        self.output_containers = list()
+        self.container_pairs = list()
+
+        input_ids = set()
+        input_container_ids = set()
+        output_container_ids = set()
+        container_pair_keys = set()
+        for inp, outp in pairs:
+            if isinstance(inp, Artifact) and inp.id not in input_ids:
+                input_ids.add(inp.id)
+                self.inputs.append(inp)
+                container = getattr(inp, "container", None)
+                if container is not None and container.id not in input_container_ids:
+                    input_container_ids.add(container.id)
+                    self.input_containers.append(container)
+
+            if outp.generation_type == outp.PER_INPUT:
+                self.per_input_outputs.append(outp)
+            if isinstance(outp, Artifact) and outp.id not in self.outputs_by_id:
+                self.outputs_by_id[outp.id] = outp
+                self.outputs.append(outp)
+                self.outputs_by_type[outp.output_type].append(outp)
+                if isinstance(outp, SharedResultFile):
+                    self.shared_files.append(outp)
+                    self.shared_files_by_handle[outp.name].append(outp)
+                if isinstance(outp, Aliquot) and outp.container is not None and \
+                        outp.container.id not in output_container_ids:
+                    output_container_ids.add(outp.container.id)
+                    self.output_containers.append(outp.container)
+
+            if isinstance(inp, Aliquot) and isinstance(outp, Aliquot):
+                self.aliquot_pairs.append((inp, outp))
+                if inp.container and outp.container:
+                    key = (inp.container.id, outp.container.id)
+                    if key not in container_pair_keys:
+                        container_pair_keys.add(key)
+                        self.container_pairs.append((inp.container, outp.container))
+            if isinstance(inp, Analyte) and isinstance(outp, Analyte):
+                self.analyte_pairs.append((inp, outp))
@@ -0,0 +1,62 @@
+import json
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+
+class ChangeSetEntry(namedtuple("ChangeSetEntry", ["uri", "field", "old_value", "new_value", "payload_size"])):
+    """
+    A write to one field of a REST resource. The payload size is the size in bytes of the serialized
+    resource, which is the same for all entries of a resource.
+    """
+
+
+class ChangeSet(object):
+    """
+    The writes a commit makes, or would have made if commits are disabled.
+
+    Built by `ClarityService.update` in both modes, so a test run does the same serialization work as
+    a production run and its writes can be compared with those of a frozen run, see `RunDirectoryInfo`.
+    """
+
+    FILE_NAME = "change_set.json"
+
+    def __init__(self):
+        self.entries = list()
+
+    def add(self, resource, changes):
+        """
+        Adds the changes to the resource. The resource is serialized to get the size of the payload.
+
+        :param resource: The genologics entity that's updated
+        :param changes: An iterable of (field, old value, new value)
+        """
+        changes = list(changes)
+        if not changes:
+            return
+        payload_size = self.payload_size(resource)
+        for field, old_value, new_value in changes:
+            self.entries.append(ChangeSetEntry(resource.uri, field, old_value, new_value, payload_size))
+
+    @staticmethod
+    def payload_size(resource):
+        """Returns the size of the resource serialized as it's sent to the LIMS, or None if it's not loaded"""
+        root = getattr(resource, "root", None)
+        if not isinstance(root, ET.Element):
+            return None
+        return len(resource.lims.tostring(ET.ElementTree(root)))
+
+    def to_list(self):
+        """Returns the entries as dicts, ordered by uri and field so two runs can be compared"""
+        return [entry._asdict() for entry in sorted(self.entries, key=lambda entry: (str(entry.uri), entry.field))]
+
+    def save(self, path):
+        with open(path, "w") as f:
+            # Values that aren't JSON types, e.g. dates, are written as strings
+            json.dump(self.to_list(), f, indent=2, sort_keys=True, default=str)
+            f.write("\n")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
@@ -1,8 +1,9 @@
 import logging
-from genologics import entities
+from collections import Counter
 from clarity_ext.domain import Container, Artifact, Sample, Project, Process
 from clarity_ext import utils
 from clarity_ext.mappers.clarity_mapper import ProjectClarityMapper
+from clarity_ext.service.change_set import ChangeSet
 
 
 class ClarityService(object):
@@ -18,51 +19,102 @@ class ClarityService(object):
         self.step_repository = step_repo
         self.clarity_mapper = clarity_mapper
         self.session = session
+        self._container_types = dict()
 
-    def update(self, domain_objects, ignore_commit=False):
-        """Updates the domain object"""
+    def update(self, domain_objects, ignore_commit=False, change_set=None):
+        """
+        Updates the domain objects. Returns a `ChangeSet` with the writes that were made.
+
+        The updated resources are built in the same way if ignore_commit is True, only sending them
+        to the LIMS is skipped, so the change set lists the writes that would have been made.
+
+        :param change_set: A `ChangeSet` to add the writes to. A new one is created if not provided.
+        """
+        if change_set is None:
+            change_set = ChangeSet()
+        for _, send in self.update_phases(domain_objects, ignore_commit, change_set):
+            send()
+        return change_set
+
+    def update_phases(self, domain_objects, ignore_commit=False, change_set=None):
+        """
+        Builds the updated resources of the domain objects and returns the calls that send them, as a list
+        of (phase name, function) with the phases "process", "containers_and_samples" and "artifacts".
+        The phases write to different resources, so they can be sent in any order or concurrently,
+        see `CommitScheduler`.
+
+        No phases are returned if ignore_commit is True. See `update` for the other arguments.
+        """
         artifacts = list()
+        processes = list()
         other_domain_objects = list()
         for item in domain_objects:
             if isinstance(item, Artifact):
                 artifacts.append(item)
-            elif isinstance(item, Container) or isinstance(item, Sample):
+            elif isinstance(item, Sample):
+                # Only the UDFs of samples are committed, so samples without UDF changes are skipped:
+                if item.is_dirty():
+                    other_domain_objects.append(item)
+            elif isinstance(item, Container):
                 # TODO: This is temporarily limited to Sample and Container. LIMS-1057
                 other_domain_objects.append(item)
             elif isinstance(item, Process):
-                self._update_process(item)
+                processes.append(item)
             else:
                 raise NotImplementedError("No update method available for {}".format(type(item)))
 
-        for domain_object in other_domain_objects:
-            self.update_single(domain_object, ignore_commit)
-
+        process_resources = [resource for resource in (self._updated_process_resource(process, change_set)
+                                                       for process in processes) if resource is not None]
+        # Containers and samples are committed with batch calls:
+        resources = [self._updated_resource(domain_object, change_set) for domain_object in other_domain_objects]
         if ignore_commit:
-            # TODO: When ignoring commits, the changes that would have been committed are not logged anymore
-            # Ignoring commits should only skip writing to the backend, but should log the changes that should have
-            # happened. Recommended fix is to update all domain objects through the repository and use a repo that logs
-            # only when called.
             self.logger.info("A request for updating artifacts was ignored. "
                              "View log to see which properties have changed.")
-            return
+        map_artifact_to_resource = self._updated_artifact_resources(artifacts, change_set) if artifacts else dict()
+        if ignore_commit:
+            return list()
 
-        if len(artifacts) > 0:
-            self._update_artifacts(artifacts)
+        phases = list()
+        if process_resources:
+            phases.append(("process", lambda: [resource.put() for resource in process_resources]))
+        if resources:
+            phases.append(("containers_and_samples", lambda: self.clarity_repository.update_batch(resources)))
+        if any(resource is not None for resource in map_artifact_to_resource.values()):
+            phases.append(("artifacts", lambda: self._send_artifacts(map_artifact_to_resource)))
+        return phases
 
-    def _update_process(self, process):
+    def _updated_process_resource(self, process, change_set=None):
         # Updates the process itself. Currently only the udfs
+        changes = list(process.enumerate_changes())
+        if not changes:
+            return None
         for item in process.udf_map.enumerate_updated():
             print(item.key, item.value)
             process.api_resource.udf[item.key] = item.value
-        process.api_resource.put()
+        if change_set is not None:
+            change_set.add(process.api_resource, changes)
+        return process.api_resource
+
+    def _updated_artifact_resources(self, artifacts, change_set=None):
+        """Returns the artifacts mapped to their updated api resource, or None if they haven't changed"""
+        # Artifacts loaded from a snapshot don't have their resources fetched. Fetch those that will
+        # be updated in one batch call rather than one by one:
+        not_fetched = [artifact.api_resource for artifact in artifacts
+                       if artifact.is_dirty() and artifact.api_resource is not None and
+                       artifact.api_resource.root is None]
+        if not_fetched:
+            self.step_repository.session.get_batch(not_fetched)
 
-    def _update_artifacts(self, artifacts):
+        map_artifact_to_resource = dict()
+        for artifact in artifacts:
+            changes = list(artifact.enumerate_changes())
+            map_artifact_to_resource[artifact] = artifact.get_updated_api_resource()
+            if change_set is not None and map_artifact_to_resource[artifact] is not None:
+                change_set.add(map_artifact_to_resource[artifact], changes)
+        return map_artifact_to_resource
+
+    def _send_artifacts(self, map_artifact_to_resource):
         # Filter out artifacts that don't have any updated fields:
-        map_artifact_to_resource = {artifact: artifact.get_updated_api_resource()
-                                    for artifact in artifacts}
-        if sum(1 for value in list(map_artifact_to_resource.values())
-               if value is not None) == 0:
-            return 0
         ret = self.step_repository.update_artifacts([res for res in list(map_artifact_to_resource.values())
                                                      if res is not None])
 
@@ -74,27 +126,39 @@ class ClarityService(object):
                 artifact.api_resource = resource
         return ret
 
-    def update_single(self, domain_object, ignore_commit):
+    def update_single(self, domain_object, ignore_commit, change_set=None):
+        api_resource = self._updated_resource(domain_object, change_set)
+        if not ignore_commit:
+            self.clarity_repository.update(api_resource)
+
+    def _updated_resource(self, domain_object, change_set=None):
+        """
+        Returns the api resource of a container or a sample, updated with the changes in the domain object.
+        The changes are added to the change set, if provided.
+        """
         # TODO: This is a quick-fix to support changing container names
         if isinstance(domain_object, Container):
             api_resource = domain_object.api_resource
+            changes = list()
             if api_resource.name != domain_object.name:
                 self.logger.info("Updating name of {} from {} to {}".format(domain_object,
                                                                             api_resource.name, domain_object.name))
+                changes.append(("name", api_resource.name, domain_object.name))
                 api_resource.name = domain_object.name
             # Update UDFs. TODO: Clean this up and do it the same way for all resources
             for udf in domain_object.udf_map.values:
                 if udf.key not in api_resource.udf or api_resource.udf[udf.key] != udf.value:
+                    changes.append(("udf:" + udf.key, api_resource.udf.get(udf.key), udf.value))
                     api_resource.udf[udf.key] = udf.value
-            if not ignore_commit:
-                self.clarity_repository.update(api_resource)
         elif isinstance(domain_object, Sample):
             # TODO: Update in a consistent way. LIMS-1057
+            changes = list(domain_object.enumerate_changes())
             api_resource = self.clarity_mapper.create_resource(domain_object)
-            if not ignore_commit:
-                self.clarity_repository.update(api_resource)
         else:
             raise NotImplementedError("The type '{}' isn't implemented".format(type(domain_object)))
+        if change_set is not None:
+            change_set.add(api_resource, changes)
+        return api_resource
 
     def get_project_by_name(self, project_name):
         project_resource = utils.single(self.session.api.get_projects(name=project_name))
@@ -105,48 +169,97 @@ class ClarityService(object):
         Creates the container and all samples in it.
 
         Requires a container and samples that do not have an ID. The samples are interpreted as
+        original samples, not analytes. See `create_containers` to create several containers.
+        """
+        return self.create_containers([in_mem_container], with_samples=with_samples, assign_to=assign_to)[0]
+
+    def create_containers(self, in_mem_containers, with_samples=False, assign_to=None):
+        """
+        Creates the containers and all samples in them, with batch calls.
+
+        Requires containers and samples that do not have an ID. The samples are interpreted as
         original samples, not analytes.
+
+        The containers are created before the samples. If creating the samples fails, the containers
+        exist in the LIMS and have their IDs set, and a `SamplesNotCreatedError` listing them is raised,
+        so they can be reused or removed.
+
+        :param with_samples: If True, the samples in the containers are created too
+        :param assign_to: The name of a workflow to assign the created samples to, or a dict from container
+                          name to workflow name, in which case the container names must be unique. The
+                          samples are assigned with one call per workflow.
         """
-        # TODO: Supporting sending in several containers and create them via a batch call too
+        from genologics import entities
 
-        if in_mem_container.id:
-            raise AssertionError("This container already has an ID: {}".format(container))
-        container_type = utils.single(
-                self.session.api.get_containertypes(name=in_mem_container.container_type))
+        in_mem_containers = list(in_mem_containers)
+        for in_mem_container in in_mem_containers:
+            if in_mem_container.id:
+                raise AssertionError("This container already has an ID: {}".format(in_mem_container))
+        if isinstance(assign_to, dict):
+            name_counts = Counter(in_mem_container.name for in_mem_container in in_mem_containers)
+            duplicates = sorted(name for name, count in name_counts.items() if count > 1)
+            if duplicates:
+                raise ValueError("Workflows are assigned by container name, but several containers are named {}"
+                                 .format(", ".join(duplicates)))
 
-        container_res = entities.Container.create(
-                self.session.api, name=in_mem_container.name, type=container_type)
-        in_mem_container.id = container_res.id
+        container_instances = [entities.Container._create(self.session.api, name=in_mem_container.name,
+                                                          type=self._get_container_type(in_mem_container))
+                               for in_mem_container in in_mem_containers]
+        container_resources = self.clarity_repository.create_batch(container_instances)
+        for in_mem_container, container_res in zip(in_mem_containers, container_resources):
+            in_mem_container.id = container_res.id
 
         if not with_samples:
-            return in_mem_container
+            return in_mem_containers
+
+        sample_instances = list()
+        workflows = list()
+        for in_mem_container, container_res in zip(in_mem_containers, container_resources):
+            workflow = assign_to.get(in_mem_container.name) if isinstance(assign_to, dict) else assign_to
+            for well in in_mem_container.occupied:
+                sample = well.artifact
+                if sample.id:
+                    raise AssertionError("This sample already has an ID: {}".format(sample))
+                instance = entities.Sample.create_in_memory_instance(
+                        self.session.api,
+                        container_res,
+                        position=repr(well.position),
+                        name=sample.name,
+                        project=sample.project.api_resource,
+                        udfs=sample.udf_map.to_dict())
+                sample_instances.append(instance)
+                workflows.append(workflow)
 
-        in_mem_instance = list()
+        try:
+            created_instances = self.clarity_repository.create_batch(sample_instances)
+        except Exception as e:
+            raise SamplesNotCreatedError([in_mem_container.id for in_mem_container in in_mem_containers], e) from e
 
-        for well in in_mem_container.occupied:
-            sample = well.artifact
-            if sample.id:
-                raise AssertionError("This sample already has an ID: {}".format(sample))
-            instance = entities.Sample.create_in_memory_instance(
-                    self.session.api,
-                    container_res,
-                    position=repr(well.position),
-                    name=sample.name,
-                    project=sample.project.api_resource,
-                    udfs=sample.udf_map.to_dict())
-            in_mem_instance.append(instance)
+        # Assign the samples directly to workflows, with one call per workflow:
+        artifacts_by_workflow = dict()
+        for sample_res, workflow in zip(created_instances, workflows):
+            if workflow:
+                artifact = entities.Artifact(self.session.api, id=sample_res.id + "PA1")
+                artifacts_by_workflow.setdefault(workflow, list()).append(artifact)
+        for workflow_name, artifacts in artifacts_by_workflow.items():
+            workflow = utils.single(self.session.api.get_workflows(name=workflow_name))
+            self.session.api.route_artifacts(artifacts, workflow_uri=workflow.uri)
 
-        created_instances = entities.Sample.batch_create(self.session.api, in_mem_instance)
+        return in_mem_containers
 
-        created_artifacts = list()
-        for sample_res in created_instances:
-            artifact = entities.Artifact(self.session.api, id=sample_res.id + "PA1")
-            created_artifacts.append(artifact)
+    def _get_container_type(self, in_mem_container):
+        """Returns the container type resource of the container, looked up by name once per service"""
+        name = in_mem_container.container_type
+        if name not in self._container_types:
+            self._container_types[name] = utils.single(self.session.api.get_containertypes(name=name))
+        return self._container_types[name]
 
-        if assign_to:
-            # Assign all the samples directly to a workflow
-            workflow = utils.single(self.session.api.get_workflows(name=assign_to))
-            self.session.api.route_artifacts(created_artifacts, workflow_uri=workflow.uri)
 
-        return in_mem_container
+class SamplesNotCreatedError(Exception):
+    """Raised when containers were created but (some of) the samples in them could not be created"""
 
+    def __init__(self, container_ids, error):
+        self.container_ids = container_ids
+        self.error = error
+        super(SamplesNotCreatedError, self).__init__(
+            "The containers {} were created, but not all samples in them: {}".format(", ".join(container_ids), error))
@@ -0,0 +1,101 @@
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class CommitScheduler(object):
+    """
+    Runs the phases of a commit, e.g. updating artifacts and uploading files, concurrently. A phase is
+    started as soon as the phases it depends on have finished.
+
+    The outcome doesn't depend on the order the phases finish in: all phases that can run are run to
+    the end before any error is raised, a phase is skipped if a phase it depends on failed, and if more
+    than one phase failed, the error of the first one added is raised.
+
+        scheduler = CommitScheduler()
+        scheduler.add("artifacts", update_artifacts)
+        scheduler.add("files", upload_files, depends_on=["artifacts"])
+        scheduler.run()
+
+    :param workers: The max number of phases running at the same time
+    """
+
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, workers=DEFAULT_WORKERS, logger=None):
+        self.workers = workers
+        self.logger = logger or logging.getLogger(__name__)
+        self._phases = OrderedDict()
+        # Seconds each phase took, in the order they were added. None for phases that were skipped.
+        self.timings = OrderedDict()
+
+    def add(self, name, fn, depends_on=None):
+        """
+        Adds a phase. Dependencies on phases that aren't added are ignored, so a phase can depend on
+        phases that have nothing to commit.
+        """
+        if name in self._phases:
+            raise ValueError("The phase '{}' has already been added".format(name))
+        self._phases[name] = (fn, list(depends_on or list()))
+
+    def run(self):
+        self.timings = OrderedDict((name, None) for name in self._phases)
+        errors = dict()
+        done = set()
+        skipped = set()
+        pending = OrderedDict((name, [dependency for dependency in depends_on if dependency in self._phases])
+                              for name, (_, depends_on) in self._phases.items())
+        running = dict()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                self._start_ready(pending, running, done, skipped, errors, executor)
+                if not running:
+                    if pending:
+                        raise ValueError("Circular dependencies between the commit phases {}".format(
+                            ", ".join(pending)))
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(name)
+                    except Exception as e:
+                        errors[name] = e
+
+        for name, elapsed in self.timings.items():
+            if elapsed is not None:
+                self.logger.debug("Commit phase '{}' took {:.3f}s".format(name, elapsed))
+
+        if errors:
+            failed = [name for name in self._phases if name in errors]
+            for name in failed[1:]:
+                self.logger.error("The commit phase '{}' failed: {}".format(name, errors[name]))
+            raise errors[failed[0]]
+
+    def _start_ready(self, pending, running, done, skipped, errors, executor):
+        """Starts the pending phases whose dependencies are done and skips those with a failed dependency"""
+        changed = True
+        while changed:
+            changed = False
+            for name, depends_on in list(pending.items()):
+                if any(dependency in errors or dependency in skipped for dependency in depends_on):
+                    self.logger.warning("Skipping the commit phase '{}' since a phase it depends on failed"
+                                        .format(name))
+                    skipped.add(name)
+                elif all(dependency in done for dependency in depends_on):
+                    running[executor.submit(self._run_phase, name)] = name
+                else:
+                    continue
+                del pending[name]
+                changed = True
+
+    def _run_phase(self, name):
+        fn, _ = self._phases[name]
+        start = time.perf_counter()
+        try:
+            fn()
+        finally:
+            self.timings[name] = time.perf_counter() - start
@@ -2,12 +2,13 @@
 import re
 import os
 import shutil
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
-from lxml import objectify
 from clarity_ext import utils
 import requests
-from openpyxl import load_workbook
+import xml.etree.ElementTree as ET
 
 
 class FileService:
@@ -22,6 +23,11 @@ class FileService:
     FILE_PREFIX_ARTIFACT_ID = 1
     FILE_PREFIX_RUNNING_NUMBER = 2
 
+    # Settings for the upload pipeline used when committing
+    UPLOAD_WORKERS = 4
+    UPLOAD_ATTEMPTS = 3
+    UPLOAD_RETRY_DELAY = 1.0
+
     def __init__(self, artifact_service, file_repo, should_cache, os_service, uploaded_to_stdout=False,
                  disable_commits=False, session=None):
         """
@@ -60,6 +66,7 @@ class FileService:
         self.os_service.makedirs(self.downloaded_path)
 
     def parse_xlsx(self, f):
+        from openpyxl import load_workbook
         with open(f.name, "rb") as wbook:
             workbook = load_workbook(wbook, data_only=True)
             return workbook
@@ -69,6 +76,7 @@ class FileService:
         Parses the file like object as XML and returns an object that provides simple access to
         the leaves, such as `parent.child.grandchild`
         """
+        from lxml import objectify
         with f:
             tree = objectify.parse(f)
             return tree.getroot()
@@ -84,6 +92,14 @@ class FileService:
                             modify_attached=modify_attached,
                             file_name_contains=file_name_contains)
 
+    def prefetch(self, file_handles, extension="", max_workers=None):
+        """
+        Downloads the files attached to all shared files with any of the file handles, concurrently.
+
+        Later calls to `local_shared_file` for these file handles are then served from disk.
+        """
+        self.local_shared_file_provider.prefetch(file_handles, extension=extension, max_workers=max_workers)
+
     def local_shared_file_search_or_create(self, file_handle, mode='r', extension="",
                                            modify_attached=False, filename=None):
         return self.local_shared_file_provider.\
@@ -227,14 +243,13 @@ class FileService:
     def commit(self, disable_commits):
         """Copies files in the upload queue to the server"""
         self.close_local_shared_files()
-        for artifact_id, file_name in self._file_associations:
-            self._commit_file(disable_commits, artifact_id, file_name)
+        self._commit_files(disable_commits, self._file_associations)
 
     def commit_selective_files(self, disable_commits, file_names):
         self.close_local_shared_files()
-        for artifact_id, file_name in self._file_associations:
-            if file_name in file_names:
-                self._commit_file(disable_commits, artifact_id, file_name)
+        self._commit_files(disable_commits, [(artifact_id, file_name)
+                                             for artifact_id, file_name in self._file_associations
+                                             if file_name in file_names])
 
     @property
     def _file_associations(self):
@@ -244,22 +259,94 @@ class FileService:
                 associations.append((artifact_id, file_name))
         return associations
 
-    def _commit_file(self, disable_commits, artifact_id, file_name):
-        """Copies files in the upload queue to the server"""
+    def _commit_files(self, disable_commits, associations):
+        """
+        Uploads the files in the upload queue to the server, using a bounded thread pool.
+
+        All uploads are awaited before any error is raised. If more than one upload fails, the
+        error of the first one in the queue is raised.
+        """
         if disable_commits:
-            self.logger.info("Uploading (disabled) file: {}".format(os.path.abspath(file_name)))
-        else:
-            artifact = utils.single([shared_file for shared_file in self.artifact_service.shared_files()
-                                     if shared_file.id == artifact_id])
+            for artifact_id, file_name in associations:
+                self.logger.info("Uploading (disabled) file: {}".format(os.path.abspath(file_name)))
+            return
+        if len(associations) == 0:
+            return
+
+        shared_files_by_id = {shared_file.id: shared_file for shared_file in self.artifact_service.shared_files()}
+        uploads = list()
+        for artifact_id, file_name in associations:
+            if artifact_id not in shared_files_by_id:
+                raise SharedFileNotFound("No shared file with id {} in the step, can't upload '{}'".format(
+                    artifact_id, file_name))
             local_file = os.path.join(self.upload_queue_path, artifact_id, file_name)
             self.logger.info("Uploading file {}".format(local_file))
+            uploads.append((shared_files_by_id[artifact_id], local_file))
+
+        with ThreadPoolExecutor(max_workers=self.UPLOAD_WORKERS) as executor:
+            futures = [executor.submit(self._upload_file, artifact, local_file) for artifact, local_file in uploads]
+            errors = list()
+            for future in futures:
+                try:
+                    if not future.result():
+                        self.logger.error("Not able to upload step log as some of the samples are in review")
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def _upload_file(self, artifact, local_file):
+        """
+        Uploads one file and attaches it to the artifact, in the same way as `Lims.upload_new_file`.
+
+        Creating the file resource attaches it to the artifact, so that request is never repeated, as
+        that would attach a second file. Reserving the storage before it and sending the content to the
+        created file after it are retried on connection errors and server errors.
+
+        Returns False if the file was not uploaded because samples in the step are under review.
+        """
+        from genologics.constants import nsmap
+        from genologics.entities import File
+        api = self.session.api
+        root = ET.Element(nsmap("file:file"))
+        ET.SubElement(root, "attached-to").text = artifact.api_resource.uri
+        ET.SubElement(root, "original-location").text = os.path.abspath(local_file)
+        try:
+            storage = self._with_retries(local_file, lambda: api.post(
+                uri=api.get_uri("glsstorage"), data=api.tostring(ET.ElementTree(root))))
+            file_root = api.post(uri=api.get_uri("files"), data=api.tostring(ET.ElementTree(storage)))
+        except requests.HTTPError as e:
+            if "UNDER_REVIEW" in str(e):
+                return False
+            raise
+        remote_file = File(api, uri=file_root.attrib["uri"])
+        self._with_retries(local_file, lambda: self._send_file_content(remote_file, local_file))
+        return True
+
+    def _send_file_content(self, remote_file, local_file):
+        api = self.session.api
+        with self.os_service.open_file(local_file, "rb") as f:
+            response = self.session.http_session.post(api.get_uri("files", remote_file.id, "upload"),
+                                                      files={"file": (os.path.abspath(local_file), f)},
+                                                      auth=(api.username, api.password))
+        api.validate_response(response)
+
+    def _with_retries(self, local_file, fn):
+        """Calls fn, retrying on connection errors and server errors. Only use with requests that can be repeated."""
+        attempt = 1
+        while True:
             try:
-                self.session.api.upload_new_file(artifact.api_resource, local_file)
+                return fn()
             except requests.HTTPError as e:
-                if "UNDER_REVIEW" in str(e):
-                    self.logger.error("Not able to upload step log as some of the samples are in review")
-                else:
+                if attempt >= self.UPLOAD_ATTEMPTS or e.response is None or e.response.status_code < 500:
                     raise e
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.UPLOAD_ATTEMPTS:
+                    raise
+            self.logger.warning("Upload of {} failed (attempt {}/{}), retrying".format(
+                local_file, attempt, self.UPLOAD_ATTEMPTS))
+            time.sleep(self.UPLOAD_RETRY_DELAY * attempt)
+            attempt += 1
 
     def _split_file_name(self, name):
         m = re.match(self.SERVER_FILE_NAME_PATTERN, name)
@@ -284,6 +371,8 @@ class FileService:
 
 
 class LocalSharedFileProvider:
+    DEFAULT_PREFETCH_WORKERS = 4
+
     def __init__(self, file_service, file_repo, artifact_service, downloaded_path, os_service, should_cache, logger):
         self.file_service = file_service
         self.file_repo = file_repo
@@ -301,6 +390,41 @@ class LocalSharedFileProvider:
         ]
         return [a.files[0].original_location for a in by_handle]
 
+    def prefetch(self, file_handles, extension="", max_workers=None):
+        """
+        Downloads the files of all shared files having any of the file handles, using a bounded thread pool.
+
+        The files are downloaded to the same paths as `search_existing` uses, so they will not be
+        downloaded again. Failures are logged and left to `search_existing`, which will then
+        try to download the file again.
+        """
+        file_handles = set(file_handles)
+        downloads = list()
+        for artifact in self.artifact_service.shared_files():
+            if artifact.name not in file_handles or len(artifact.files) == 0:
+                continue
+            local_path, cache_path = self._local_paths(artifact, artifact.name, extension)
+            if self.os_service.exists(local_path) or (self.should_cache and self.os_service.exists(cache_path)):
+                continue
+            downloads.append((artifact, local_path))
+
+        if len(downloads) == 0:
+            return
+
+        # Log from the calling thread only, so the order of the log entries is the same for every run
+        for artifact, local_path in downloads:
+            self.logger.info("Prefetching file {} (artifact={} '{}')".format(
+                artifact.api_resource.files[0].id, artifact.id, artifact.name))
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.DEFAULT_PREFETCH_WORKERS) as executor:
+            futures = [executor.submit(self.file_repo.copy_remote_file, artifact.api_resource.files[0].id, local_path)
+                       for artifact, local_path in downloads]
+            for (artifact, local_path), future in zip(downloads, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.warning("Not able to prefetch the file for artifact {}: {}".format(artifact.id, e))
+
     def search_existing(self, file_handle, mode='r', extension="", modify_attached=False, file_name_contains=None):
         artifact = self._artifact_by_name(file_handle, file_name_contains)
         return self._local_shared_file(artifact, file_handle, mode=mode, extension=extension,
@@ -342,11 +466,8 @@ class LocalSharedFileProvider:
         The downloaded files will be removed when the context is cleaned up. This ensures
         that the LIMS will not upload them by accident
         """
-        local_file_name = "{}_{}.{}".format(artifact.id, filename.replace(" ", "_"), extension)
-        local_file_name_rel_path = os.path.join(self.downloaded_path, local_file_name)
-        local_file_name_abs_path = self.os_service.abspath(local_file_name_rel_path)
-        cache_directory = self.os_service.abspath(".cache")
-        cache_path = os.path.join(cache_directory, local_file_name)
+        local_file_name_abs_path, cache_path = self._local_paths(artifact, filename, extension)
+        cache_directory = os.path.dirname(cache_path)
 
         if self.should_cache and self.os_service.exists(cache_path):
             self._use_cache(cache_path)
@@ -367,6 +488,13 @@ class LocalSharedFileProvider:
         self.file_service._local_shared_files.append(f)
         return f
 
+    def _local_paths(self, artifact, filename, extension):
+        """Returns the absolute path the shared file is downloaded to, and the path it's cached at"""
+        local_file_name = "{}_{}.{}".format(artifact.id, filename.replace(" ", "_"), extension)
+        local_file_name_rel_path = os.path.join(self.downloaded_path, local_file_name)
+        cache_path = os.path.join(self.os_service.abspath(".cache"), local_file_name)
+        return self.os_service.abspath(local_file_name_rel_path), cache_path
+
     def _download_or_create_local_file(self, artifact, local_file_name_abs_path, modify_attached):
         if not self.os_service.exists(local_file_name_abs_path) and len(artifact.files) == 0 and modify_attached:
             # No file has been uploaded yet
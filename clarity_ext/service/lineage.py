@@ -0,0 +1,109 @@
+from collections import defaultdict
+from clarity_ext import utils
+
+
+class LineageGraph(object):
+    """
+    The artifacts of a step and of a number of generations of ancestor steps, i.e. the steps that
+    produced the inputs to the step, the steps that produced their inputs and so on.
+
+    Generation 0 is the current step, generation 1 its parent steps etc. All steps are loaded when the
+    graph is created (see `ArtifactService.lineage_graph`), so lookups don't call the LIMS.
+
+    Since all steps are mapped with the same mapper, an analyte that's an output in one step is the
+    same object as the corresponding input in the next step.
+    """
+
+    def __init__(self):
+        # The ArtifactService of each step, per generation:
+        self.generations = list()
+        self._inputs_by_output_id = defaultdict(list)
+        self._inputs_by_sample_id = defaultdict(list)
+        self._generation_by_input_id = dict()
+
+    @classmethod
+    def load(cls, artifact_service, generations):
+        """
+        Loads the step of the artifact service and `generations` generations of ancestor steps,
+        breadth-first. The steps in each generation are fetched together, see
+        `ArtifactService.artifact_services_for_steps`.
+        """
+        graph = cls()
+        graph._add_generation([artifact_service])
+        visited = {artifact_service.step_repository.session.current_step_id}
+        for _ in range(generations):
+            parent_processes = utils.unique(
+                (artifact.parent_process for service in graph.generations[-1]
+                 for artifact in service.all_input_artifacts()
+                 if getattr(artifact, "parent_process", None) is not None and
+                 artifact.parent_process.id not in visited),
+                lambda process: process.id)
+            step_ids = [process.id for process in parent_processes]
+            if not step_ids:
+                break
+            visited.update(step_ids)
+            graph._add_generation(artifact_service.artifact_services_for_steps(step_ids))
+        return graph
+
+    def _add_generation(self, artifact_services):
+        generation = len(self.generations)
+        self.generations.append(artifact_services)
+        for service in artifact_services:
+            for inp, outp in service.all_artifacts():
+                if inp is None:
+                    continue
+                if all(inp is not known for known in self._inputs_by_output_id[outp.id]):
+                    self._inputs_by_output_id[outp.id].append(inp)
+                if inp.id in self._generation_by_input_id:
+                    continue
+                self._generation_by_input_id[inp.id] = generation
+                for sample in getattr(inp, "samples", ()):
+                    self._inputs_by_sample_id[sample.id].append(inp)
+
+    def step_ids(self, generation):
+        """Returns the ids of the steps in the generation"""
+        return [service.step_repository.session.current_step_id for service in self.generations[generation]]
+
+    def generation_of(self, artifact):
+        """
+        Returns the generation of the earliest loaded step that has the artifact as an input,
+        or None if it's not an input to any loaded step
+        """
+        return self._generation_by_input_id.get(artifact.id)
+
+    def parents(self, artifact_id):
+        """Returns the inputs that the artifact was created from, in the step that created it"""
+        return list(self._inputs_by_output_id.get(artifact_id, ()))
+
+    def ancestors(self, artifact_id, generation=None):
+        """
+        Returns all loaded ancestors of the artifact, nearest first.
+
+        :param generation: If provided, only returns the ancestors that are inputs to steps in that generation
+        """
+        ret = list()
+        seen = {artifact_id}
+        queue = [artifact_id]
+        while queue:
+            current_id = queue.pop(0)
+            for parent in self._inputs_by_output_id.get(current_id, ()):
+                if parent.id in seen:
+                    continue
+                seen.add(parent.id)
+                queue.append(parent.id)
+                ret.append(parent)
+        return self._in_generation(ret, generation)
+
+    def ancestors_by_sample(self, sample_id, generation=None):
+        """
+        Returns all input artifacts in the loaded steps that contain the sample, nearest first.
+
+        :param generation: If provided, only returns the artifacts that are inputs to steps in that generation
+        """
+        ret = sorted(self._inputs_by_sample_id.get(sample_id, ()), key=self.generation_of)
+        return self._in_generation(ret, generation)
+
+    def _in_generation(self, artifacts, generation):
+        if generation is None:
+            return artifacts
+        return [artifact for artifact in artifacts if self.generation_of(artifact) == generation]
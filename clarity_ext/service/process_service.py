@@ -1,4 +1,3 @@
-import requests_cache
 import clarity_ext
 import xml.etree.ElementTree as ET
 import logging
@@ -11,6 +10,7 @@ class ProcessService(object):
         self.logger = logger or logging.getLogger(__name__)
         if use_cache:
             cache_name = "process-types"
+            import requests_cache
             requests_cache.configure(cache_name)
 
     def list_process_types(self, filter_contains_pattern):
@@ -1,8 +1,6 @@
 import logging
-from fuzzywuzzy import fuzz
 from clarity_ext import utils
 import copy
-from genologics.entities import Artifact
 
 
 class RoutingService(object):
@@ -12,13 +10,15 @@ class RoutingService(object):
         self.commit = commit
 
     def build_plan(self, artifact_ids, assign_workflow_name, assign_stage_name):
+        from fuzzywuzzy import fuzz
+        from genologics.entities import Artifact
         plan = dict()
         errors_entry = list()
         plan["errors"] = errors_entry
         plan["reroutes"] = reroutes = list()
 
         artifacts = [Artifact(self.session.api, id=artifact_id) for artifact_id in artifact_ids]
-        artifacts = list(self.session.api.get_batch(artifacts))
+        artifacts = list(self.session.get_batch(artifacts))
 
         # TODO: Move to some utility
         def matches_by_ratio(search, values):
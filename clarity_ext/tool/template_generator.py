@@ -3,7 +3,6 @@ from clarity_ext.resources import templates
 import logging
 import shutil
 import codecs
-from jinja2 import Template
 from clarity_ext.integration import ConfigFromConventionProvider
 
 
@@ -93,6 +92,7 @@ class TemplateGenerator(object):
         base_template = self.find_by_name("_base")
         template_config = os.path.join(base_template.template_dir, "pycharm_config.xml.j2")
 
+        from jinja2 import Template
         with open(template_config, "r") as from_fs:
             text = from_fs.read()
             template = Template(text)
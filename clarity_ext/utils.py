@@ -1,4 +1,3 @@
-import requests_cache
 import os
 import shutil
 import hashlib
@@ -22,6 +21,7 @@ def lazyprop(fn):
 
 def use_requests_cache(cache):
     """Turns on caching for the requests library"""
+    import requests_cache
     requests_cache.install_cache(
         cache, allowable_methods=('GET', 'POST', 'DELETE', 'PUT'))
 
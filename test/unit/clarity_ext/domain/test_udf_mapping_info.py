@@ -1,5 +1,6 @@
 import unittest
-from clarity_ext.domain.udf import UdfMapping
+from clarity_ext.domain.udf import UdfMapping, UdfSchema
+from clarity_ext.domain.process import ProcessOutput
 from clarity_ext.domain import ResultFile, Analyte, SharedResultFile, Process
 from clarity_ext.domain.udf import UdfMappingNotUniqueException
 
@@ -105,6 +106,22 @@ class TestUdfMappingInfo(unittest.TestCase):
         result_file1.udf_map["% Total"].value *= 2
         result_file1.udf_total == original * 2
 
+    def test_expand_with_schema_shared_by_process_output(self):
+        process_output = ProcessOutput("ResultFile", "PerInput", ["% Total", "# Total", "Conc."])
+        resource = FakeResource({"Conc.": 0.5, "Comment": "ok"})
+
+        udf_map = UdfMapping.expand(resource, process_output)
+
+        self.assertIs(process_output.udf_schema, process_output.udf_schema)
+        self.assertEqual({"% Total": None, "# Total": None, "Conc.": 0.5, "Comment": "ok"}, udf_map.to_dict())
+        self.assertEqual(0.5, udf_map["udf_conc"].value)
+        with self.assertRaises(UdfMappingNotUniqueException):
+            udf_map["udf_total"]
+
+    def test_schema_reports_clashes(self):
+        schema = UdfSchema(["% Total", "# Total", "Conc."])
+        self.assertEqual({"udf_total": ["# Total", "% Total"]}, schema.clashes)
+
     @staticmethod
     def _get_non_unique_udf_mapping():
         original = {"% Total": 10,
@@ -116,3 +133,40 @@ class TestUdfMappingInfo(unittest.TestCase):
         original = {"% Total": 10,
                     "Conc.": 0.5}
         return UdfMapping(original)
+
+
+class TestChangeJournal(unittest.TestCase):
+    def test_only_changed_udfs_are_in_the_journal(self):
+        mapping = UdfMapping({"Conc": 1.0, "Volume": 10, "Comment": None})
+        mapping["Conc"] = 2.0
+        mapping["Volume"] = 20
+        mapping["Volume"] = 10  # Back to the original value
+
+        self.assertEqual([("Conc", 2.0)], [(udf.key, udf.value) for udf in mapping.enumerate_updated()])
+
+    def test_unchanged_artifact_is_skipped_without_reading_the_api_resource(self):
+        analyte = Analyte(api_resource=None, is_input=False, name="Sample 1", qc_flag="UNKNOWN",
+                          udf_map=UdfMapping({"Conc": 1.0}))
+        analyte.api_resource = object()  # Fails if any attribute is read
+        analyte.qc_flag = "PASSED"
+        analyte.qc_flag = "UNKNOWN"
+
+        self.assertFalse(analyte.is_dirty())
+        self.assertIsNone(analyte.get_updated_api_resource())
+
+    def test_changed_fields_are_written_to_the_api_resource(self):
+        analyte = Analyte(api_resource=None, is_input=False, name="Sample 1", qc_flag="UNKNOWN",
+                          udf_map=UdfMapping({"Conc": 1.0}))
+        resource = FakeResource(udf=dict())
+        analyte.api_resource = resource
+        analyte.name = "Renamed"
+        analyte.udf_conc = 2.0
+
+        self.assertIs(resource, analyte.get_updated_api_resource())
+        self.assertEqual(("Renamed", "UNKNOWN", {"Conc": 2.0}),
+                         (resource.name, getattr(resource, "qc_flag", "UNKNOWN"), resource.udf))
+
+
+class FakeResource(object):
+    def __init__(self, udf):
+        self.udf = udf
@@ -0,0 +1,184 @@
+import time
+import threading
+import xml.etree.ElementTree as ET
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeLimsServer(object):
+    """
+    Serves recorded responses, by (method, path), on a local port. Records the requests, their bodies
+    and the max number of requests handled at the same time.
+    """
+
+    def __init__(self, responses, delay=0):
+        self.responses = responses
+        self.delay = delay
+        self.requests = list()
+        self.bodies = list()
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.base_uri = "http://127.0.0.1:{}".format(self._httpd.server_address[1])
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self):
+        """Forgets the requests made so far"""
+        with self._lock:
+            del self.requests[:]
+            del self.bodies[:]
+            self.max_in_flight = 0
+
+    def respond(self, method, path, body=None):
+        with self._lock:
+            self.requests.append((method, path))
+            self.bodies.append(body)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            time.sleep(self.delay)
+            response = self.responses.get((method, path))
+            if response is None:
+                return None
+            response = response.format(base=self.base_uri).encode("utf-8")
+            if path.endswith("/batch/retrieve"):
+                response = self._requested_only(response, body)
+            return response
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    @staticmethod
+    def _requested_only(response, request_body):
+        """Removes the entities that were not requested from a batch response, as the LIMS would"""
+        requested = set(link.get("uri").split("?")[0].split("/")[-1] for link in ET.fromstring(request_body))
+        root = ET.fromstring(response)
+        for node in list(root):
+            if node.get("limsid") not in requested:
+                root.remove(node)
+        return ET.tostring(root)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST", self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+            def _respond(self, method, request_body=None):
+                body = server.respond(method, self.path.split("?")[0], request_body)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+RECORDED_RESPONSES = {
+    ("GET", "/api"): """<?xml version="1.0" encoding="UTF-8"?>
+<ver:versions xmlns:ver="http://genologics.com/ri/version">
+    <version uri="{base}/api/v2" major="v2" minor="0"/>
+</ver:versions>""",
+    ("GET", "/api/v2/processes/24-1"): """<?xml version="1.0" encoding="UTF-8"?>
+<prc:process xmlns:udf="http://genologics.com/ri/userdefined" xmlns:prc="http://genologics.com/ri/process"
+        uri="{base}/api/v2/processes/24-1" limsid="24-1">
+    <type uri="{base}/api/v2/processtypes/1">Dilution</type>
+    <date-run>2026-01-01</date-run>
+    <technician uri="{base}/api/v2/researchers/3">
+        <first-name>Ada</first-name>
+        <last-name>Lovelace</last-name>
+    </technician>
+    <input-output-map>
+        <input post-process-uri="{base}/api/v2/artifacts/2-1?state=2" uri="{base}/api/v2/artifacts/2-1?state=1"
+            limsid="2-1"/>
+        <output uri="{base}/api/v2/artifacts/2-11?state=3" output-generation-type="PerInput"
+            output-type="Analyte" limsid="2-11"/>
+    </input-output-map>
+</prc:process>""",
+    ("GET", "/api/v2/processtypes/1"): """<?xml version="1.0" encoding="UTF-8"?>
+<ptp:process-type xmlns:ptp="http://genologics.com/ri/processtype" uri="{base}/api/v2/processtypes/1"
+        name="Dilution">
+    <process-output>
+        <artifact-type>Analyte</artifact-type>
+        <output-generation-type>PerInput</output-generation-type>
+        <field-definition name="Concentration"/>
+    </process-output>
+</ptp:process-type>""",
+    ("GET", "/api/v2/researchers/3"): """<?xml version="1.0" encoding="UTF-8"?>
+<res:researcher xmlns:res="http://genologics.com/ri/researcher" uri="{base}/api/v2/researchers/3">
+    <first-name>Ada</first-name>
+    <last-name>Lovelace</last-name>
+    <email>ada@example.com</email>
+    <initials>ADL</initials>
+</res:researcher>""",
+    ("POST", "/api/v2/artifacts/batch/retrieve"): """<?xml version="1.0" encoding="UTF-8"?>
+<art:details xmlns:art="http://genologics.com/ri/artifact">
+    <art:artifact uri="{base}/api/v2/artifacts/2-1?state=1" limsid="2-1">
+        <name>Sample 1</name>
+        <type>Analyte</type>
+        <location>
+            <container uri="{base}/api/v2/containers/27-1" limsid="27-1"/>
+            <value>A:1</value>
+        </location>
+        <sample uri="{base}/api/v2/samples/S1" limsid="S1"/>
+    </art:artifact>
+    <art:artifact uri="{base}/api/v2/artifacts/2-11?state=3" limsid="2-11">
+        <name>Sample 1</name>
+        <type>Analyte</type>
+        <location>
+            <container uri="{base}/api/v2/containers/27-2" limsid="27-2"/>
+            <value>B:1</value>
+        </location>
+        <sample uri="{base}/api/v2/samples/S1" limsid="S1"/>
+    </art:artifact>
+</art:details>""",
+    ("POST", "/api/v2/containers/batch/retrieve"): """<?xml version="1.0" encoding="UTF-8"?>
+<con:details xmlns:con="http://genologics.com/ri/container">
+    <con:container uri="{base}/api/v2/containers/27-1" limsid="27-1">
+        <name>Source</name>
+        <type uri="{base}/api/v2/containertypes/1" name="96 well plate"/>
+    </con:container>
+    <con:container uri="{base}/api/v2/containers/27-2" limsid="27-2">
+        <name>Target</name>
+        <type uri="{base}/api/v2/containertypes/1" name="96 well plate"/>
+    </con:container>
+</con:details>""",
+    ("GET", "/api/v2/containertypes/1"): """<?xml version="1.0" encoding="UTF-8"?>
+<ctp:container-type xmlns:ctp="http://genologics.com/ri/containertype" uri="{base}/api/v2/containertypes/1"
+        name="96 well plate">
+    <x-dimension>
+        <is-alpha>false</is-alpha>
+        <offset>1</offset>
+        <size>12</size>
+    </x-dimension>
+    <y-dimension>
+        <is-alpha>true</is-alpha>
+        <offset>0</offset>
+        <size>8</size>
+    </y-dimension>
+</ctp:container-type>""",
+    ("POST", "/api/v2/samples/batch/retrieve"): """<?xml version="1.0" encoding="UTF-8"?>
+<smp:details xmlns:smp="http://genologics.com/ri/sample">
+    <smp:sample uri="{base}/api/v2/samples/S1" limsid="S1">
+        <name>Sample 1</name>
+    </smp:sample>
+</smp:details>""",
+}
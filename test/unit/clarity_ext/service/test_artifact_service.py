@@ -1,7 +1,8 @@
 import unittest
-from mock import MagicMock
+from mock import MagicMock, patch
 from test.unit.clarity_ext import helpers
 from clarity_ext.service import ClarityService, ArtifactService
+from clarity_ext.repository import LoadingProfile
 
 
 class TestArtifactService(unittest.TestCase):
@@ -33,6 +34,52 @@ class TestArtifactService(unittest.TestCase):
         self.assertTrue(all(pair.input_artifact.is_input and
                             not pair.output_artifact.is_input for pair in analytes))
 
+    def test_queries_are_answered_from_one_load(self):
+        repo = MagicMock()
+        repo.all_artifacts = MagicMock(side_effect=helpers.two_containers_artifact_set)
+        svc = ArtifactService(repo)
+
+        self.assertEqual(4, len(svc.all_input_artifacts()))
+        self.assertEqual(2, len(svc.all_output_containers()))
+        self.assertEqual(3, len(svc.all_containers()))
+        self.assertEqual("art-id2", svc.index.outputs_by_id["art-id2"].id)
+        repo.all_artifacts.assert_called_once_with()
+
+    def test_shared_files_by_handle_without_inputs(self):
+        step_log = helpers.fake_shared_result_file("92-1", "Step log")
+        other = helpers.fake_shared_result_file("92-2", "Other")
+        svc = helpers.mock_artifact_service(lambda: [(None, step_log), (None, other), (None, step_log)])
+
+        self.assertEqual([step_log], svc.shared_files_by_handle("Step log"))
+        self.assertEqual([step_log, other], svc.shared_files())
+        self.assertEqual(list(), svc.all_input_artifacts())
+        self.assertEqual(list(), svc.shared_files_by_handle("Missing"))
+
+    def test_parent_input_artifacts_requires_a_profile_with_inputs(self):
+        output = helpers.fake_analyte("cont-id1", "art-id1", "sample1", "sample1", "B:2", is_input=False)
+        output.input = None
+        svc = helpers.mock_artifact_service(lambda: [(None, output)])
+        svc.step_repository.loading_profile = LoadingProfile.OUTPUTS
+
+        with self.assertRaisesRegex(ValueError, "'outputs'"):
+            list(svc.parent_input_artifacts())
+
+    @patch("clarity_ext.service.artifact_service.StepRepository")
+    def test_other_steps_share_the_session_and_are_loaded_once(self, step_repository_type):
+        step_repo = MagicMock()
+        svc = ArtifactService(step_repo)
+
+        first = svc.artifact_services_for_steps(["24-1", "24-2", "24-1"])
+        second = svc.artifact_services_for_steps(["24-2"])
+
+        self.assertEqual(2, step_repo.session.for_step.call_count)
+        self.assertEqual(2, step_repository_type.call_count)
+        self.assertIs(first[0], first[2])
+        self.assertIs(first[1], second[0])
+        step_repository_type.return_value.prefetch.assert_called_with()
+        step_repository_type.assert_called_with(step_repo.session.for_step.return_value,
+                                                step_repo.clarity_mapper, step_repo.metadata_cache)
+
     @unittest.skip("Broken in a previous commit. Can be fixed later.")
     def test_commit_untouched_artifacts_has_no_effect(self):
         """
@@ -0,0 +1,51 @@
+import unittest
+from mock import MagicMock
+from genologics.lims import Lims
+from clarity_ext import ClaritySession
+from clarity_ext.repository import StepRepository, MetadataCache, AsyncRestClient
+from test.unit.clarity_ext.fake_lims import FakeLimsServer, RECORDED_RESPONSES
+
+
+class TestLoadStepAsync(unittest.TestCase):
+    """Loads a step from a local stand-in for the LIMS, serving recorded XML"""
+
+    def setUp(self):
+        self.server = FakeLimsServer(RECORDED_RESPONSES, delay=0.05)
+        self.server.start()
+        api = Lims(self.server.base_uri, "user", "password")
+        self.session = ClaritySession(api, "24-1", lazy=True)
+        self.repo = StepRepository(self.session, MagicMock(), MetadataCache())
+
+    def tearDown(self):
+        self.server.stop()
+        ClaritySession._version_checked_at.pop(self.server.base_uri, None)
+
+    def load(self):
+        with AsyncRestClient(self.session) as client:
+            client.run(self.repo.load_async(client))
+
+    def test_independent_requests_are_overlapped(self):
+        self.load()
+        self.assertEqual({("GET", "/api"), ("GET", "/api/v2/processes/24-1"),
+                          ("GET", "/api/v2/processtypes/1"), ("GET", "/api/v2/researchers/3"),
+                          ("POST", "/api/v2/artifacts/batch/retrieve"),
+                          ("POST", "/api/v2/containers/batch/retrieve"),
+                          ("POST", "/api/v2/samples/batch/retrieve")}, set(self.server.requests))
+        self.assertEqual(7, len(self.server.requests))
+        # The process type, the technician and the artifacts are fetched at the same time:
+        self.assertGreaterEqual(self.server.max_in_flight, 3)
+
+    def test_nothing_is_fetched_again_after_loading(self):
+        self.load()
+        requests = len(self.server.requests)
+
+        resource_pairs, input_containers, output_containers, process_type = self.repo.prefetch()
+        user = self.repo.current_user()
+
+        self.assertEqual(requests, len(self.server.requests))
+        self.assertEqual([("2-1", "2-11")], [(inp.id, outp.id) for inp, outp, _ in resource_pairs])
+        self.assertEqual(["27-1"], [container.id for container in input_containers])
+        self.assertEqual(["27-2"], [container.id for container in output_containers])
+        self.assertEqual("Dilution", process_type.name)
+        self.assertEqual("Ada", user.first_name)
+        self.assertEqual("Sample 1", resource_pairs[0][0].samples[0].name)
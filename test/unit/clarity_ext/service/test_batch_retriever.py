@@ -0,0 +1,51 @@
+import unittest
+import requests
+from genologics.lims import Lims
+from genologics.entities import Artifact
+from clarity_ext import ClaritySession
+from clarity_ext.repository.batch_retriever import BatchRetriever
+from test.unit.clarity_ext.fake_lims import FakeLimsServer
+
+
+class TestBatchRetriever(unittest.TestCase):
+    ARTIFACTS = 384
+
+    def setUp(self):
+        details = "\n".join('<art:artifact uri="{{base}}/api/v2/artifacts/2-{0}" limsid="2-{0}">'
+                            '<name>Sample {0}</name><type>Analyte</type></art:artifact>'.format(i)
+                            for i in range(self.ARTIFACTS))
+        self.server = FakeLimsServer({("POST", "/api/v2/artifacts/batch/retrieve"):
+                                      '<art:details xmlns:art="http://genologics.com/ri/artifact">' +
+                                      details + '</art:details>'}, delay=0.05)
+        self.server.start()
+        self.api = Lims(self.server.base_uri, "user", "password")
+        self.retriever = BatchRetriever(self.api, ClaritySession.create_http_session(), chunk_size=100)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def artifacts(self, count):
+        return [Artifact(self.api, id="2-{}".format(i)) for i in range(count)]
+
+    def test_large_batch_is_fetched_in_concurrent_chunks(self):
+        artifacts = self.artifacts(self.ARTIFACTS)
+        fetched = self.retriever.get_batch(artifacts + artifacts[:10])
+
+        self.assertEqual(artifacts, fetched)
+        self.assertEqual(["Sample {}".format(i) for i in range(self.ARTIFACTS)],
+                         [artifact.name for artifact in fetched])
+        self.assertEqual(4, len(self.server.requests))
+        self.assertGreater(self.server.max_in_flight, 1)
+
+    def test_loaded_instances_are_only_fetched_when_forced(self):
+        artifacts = self.artifacts(3)
+        self.retriever.get_batch(artifacts)
+        self.retriever.get_batch(artifacts)
+        self.assertEqual(1, len(self.server.requests))
+        self.retriever.get_batch(artifacts, force=True)
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_errors_are_raised(self):
+        self.server.responses.clear()
+        with self.assertRaises(requests.HTTPError):
+            self.retriever.get_batch(self.artifacts(300))
@@ -0,0 +1,148 @@
+import unittest
+import xml.etree.ElementTree as ET
+from mock import MagicMock, patch
+from clarity_ext.repository import ClarityRepository, BatchUpdateError
+from clarity_ext.service.clarity_service import ClarityService, SamplesNotCreatedError
+from clarity_ext.domain import Container, Analyte, Sample
+from clarity_ext.domain.udf import UdfMapping
+
+
+class TestClarityRepositoryBatchUpdate(unittest.TestCase):
+    def setUp(self):
+        self.lims = MagicMock()
+        self.repo = ClarityRepository(batch_chunk_size=2, logger=MagicMock())
+
+    def resources(self, tag, count):
+        return [MagicMock(_TAG=tag, id="{}-{}".format(tag, i), lims=self.lims) for i in range(count)]
+
+    def test_resources_are_updated_in_chunks_per_type(self):
+        containers = self.resources("container", 3)
+        samples = self.resources("sample", 2)
+        self.repo.update_batch(containers + samples)
+
+        self.assertEqual([[containers[0], containers[1]], [containers[2]], samples],
+                         [args[0][0] for args in self.lims.put_batch.call_args_list])
+
+    def test_failing_chunks_are_reported_once_after_all_chunks(self):
+        containers = self.resources("container", 5)
+
+        def put_batch(chunk):
+            if containers[2] in chunk:
+                raise ValueError("Container name is not unique")
+        self.lims.put_batch.side_effect = put_batch
+
+        with self.assertRaises(BatchUpdateError) as context:
+            self.repo.update_batch(containers)
+
+        self.assertEqual(3, self.lims.put_batch.call_count)
+        self.assertEqual([["container-2", "container-3"]], [failure.ids for failure in context.exception.failures])
+        self.repo.logger.error.assert_called_once_with(
+            "Not able to update container container-2, container-3: Container name is not unique")
+
+    def test_other_resources_are_updated_one_by_one(self):
+        process = MagicMock(_TAG="process")
+        self.repo.update_batch([process])
+        process.put.assert_called_once_with()
+        self.lims.put_batch.assert_not_called()
+
+    def test_resources_are_created_in_chunks(self):
+        from genologics.entities import Container as ContainerResource
+        self.lims.cache = dict()
+        self.lims.tostring.side_effect = lambda tree: ET.tostring(tree.getroot())
+        self.lims.get_uri.return_value = "http://lims/api/v2/containers/batch/create"
+        # Gives each container an ID from its name, e.g. 27-5 for "Plate 5":
+        self.lims.post.side_effect = lambda uri, data: ET.fromstring("<links>{}</links>".format("".join(
+            '<link uri="http://lims/api/v2/containers/27-{}"/>'.format(name.text.split()[-1])
+            for name in ET.fromstring(data).iter("name"))))
+        instances = [ContainerResource._create(self.lims, name="Plate {}".format(i)) for i in range(5)]
+
+        created = self.repo.create_batch(instances)
+
+        self.assertEqual(3, self.lims.post.call_count)
+        self.assertEqual({"{http://genologics.com/ri/container}details"},
+                         set(ET.fromstring(call[0][1]).tag for call in self.lims.post.call_args_list))
+        self.assertEqual(["27-{}".format(i) for i in range(5)], [container.id for container in created])
+
+
+class TestClarityServiceUpdate(unittest.TestCase):
+    def containers(self):
+        ret = list()
+        for i in range(3):
+            container = Container(container_type="96 well plate")
+            container.name = "Plate {}".format(i)
+            container.api_resource = MagicMock(udf=dict(), uri="http://lims/api/v2/containers/27-{}".format(i))
+            container.api_resource.name = "Old name"
+            ret.append(container)
+        return ret
+
+    def test_containers_are_committed_with_one_batch_update(self):
+        clarity_repo = MagicMock()
+        containers = self.containers()
+        ClarityService(clarity_repo, MagicMock(), MagicMock()).update(containers)
+        clarity_repo.update_batch.assert_called_once_with([container.api_resource for container in containers])
+        clarity_repo.update.assert_not_called()
+
+    def test_ignore_commit_does_not_commit(self):
+        clarity_repo = MagicMock()
+        containers = self.containers()
+        ClarityService(clarity_repo, MagicMock(), MagicMock()).update(containers, ignore_commit=True)
+        clarity_repo.update_batch.assert_not_called()
+        self.assertEqual("Plate 0", containers[0].api_resource.name)
+
+    def test_ignore_commit_builds_the_same_change_set(self):
+        committed = ClarityService(MagicMock(), MagicMock(), MagicMock()).update(self.containers())
+        ignored = ClarityService(MagicMock(), MagicMock(), MagicMock()).update(self.containers(), ignore_commit=True)
+        self.assertEqual(3, len(ignored))
+        self.assertEqual(committed.to_list(), ignored.to_list())
+
+    def test_change_set_lists_artifact_writes_without_sending_them(self):
+        step_repo = MagicMock()
+        analyte = Analyte(api_resource=None, is_input=False, name="Sample 1", udf_map=UdfMapping({"Conc": 1.0}))
+        analyte.api_resource = MagicMock(udf=dict(), uri="http://lims/api/v2/artifacts/2-11", root=None)
+        analyte.udf_conc = 2.0
+
+        change_set = ClarityService(MagicMock(), step_repo, MagicMock()).update([analyte], ignore_commit=True)
+
+        step_repo.update_artifacts.assert_not_called()
+        self.assertEqual([dict(uri="http://lims/api/v2/artifacts/2-11", field="udf:Conc", old_value=1.0,
+                               new_value=2.0, payload_size=None)], change_set.to_list())
+
+
+class TestClarityServiceCreateContainers(unittest.TestCase):
+    def test_containers_are_created_with_one_type_lookup_and_batch_calls(self):
+        clarity_repo = MagicMock()
+        clarity_repo.create_batch.side_effect = lambda instances: [MagicMock(id="27-{}".format(i))
+                                                                   for i, _ in enumerate(instances)]
+        session = MagicMock()
+        session.api.get_containertypes.return_value = [MagicMock(uri="http://lims/api/v2/containertypes/1")]
+        containers = [Container(name="Plate {}".format(i), container_type="96 well plate") for i in range(10)]
+
+        ClarityService(clarity_repo, MagicMock(), MagicMock(), session=session).create_containers(containers)
+
+        session.api.get_containertypes.assert_called_once_with(name="96 well plate")
+        clarity_repo.create_batch.assert_called_once()
+        self.assertEqual(["27-{}".format(i) for i in range(10)], [container.id for container in containers])
+
+    def test_workflows_by_container_name_require_unique_names(self):
+        clarity_repo = MagicMock()
+        containers = [Container(name="Plate", container_type="96 well plate") for _ in range(2)]
+        svc = ClarityService(clarity_repo, MagicMock(), MagicMock(), session=MagicMock())
+
+        with self.assertRaises(ValueError):
+            svc.create_containers(containers, with_samples=True, assign_to={"Plate": "Workflow"})
+        clarity_repo.create_batch.assert_not_called()
+
+    @patch("genologics.entities.Sample.create_in_memory_instance", create=True)
+    def test_created_containers_are_listed_if_the_samples_are_not_created(self, create_in_memory_instance):
+        clarity_repo = MagicMock()
+        clarity_repo.create_batch.side_effect = [[MagicMock(id="27-1")], IOError("Timeout")]
+        container = Container(name="Plate", container_type="96 well plate")
+        container.append(Sample(None, "Sample 1", MagicMock()))
+        session = MagicMock()
+        session.api.get_containertypes.return_value = [MagicMock(uri="http://lims/api/v2/containertypes/1")]
+        svc = ClarityService(clarity_repo, MagicMock(), MagicMock(), session=session)
+
+        with self.assertRaises(SamplesNotCreatedError) as context:
+            svc.create_containers([container], with_samples=True)
+        self.assertEqual(["27-1"], context.exception.container_ids)
+        self.assertEqual("27-1", container.id)
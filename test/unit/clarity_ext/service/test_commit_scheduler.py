@@ -0,0 +1,50 @@
+import time
+import threading
+import unittest
+from mock import MagicMock
+from clarity_ext.service import CommitScheduler
+
+
+class TestCommitScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = CommitScheduler(logger=MagicMock())
+        self.calls = list()
+
+    def phase(self, name, error=None, delay=0):
+        def fn():
+            time.sleep(delay)
+            self.calls.append(name)
+            if error:
+                raise error
+        return fn
+
+    def test_independent_phases_are_overlapped(self):
+        barrier = threading.Barrier(3, timeout=5)
+        for name in ["process", "containers_and_samples", "artifacts"]:
+            self.scheduler.add(name, barrier.wait)
+        self.scheduler.run()  # Raises BrokenBarrierError if the phases run one at a time
+        self.assertEqual(["process", "containers_and_samples", "artifacts"], list(self.scheduler.timings))
+
+    def test_phase_waits_for_its_dependencies(self):
+        self.scheduler.add("files", self.phase("files"), depends_on=["artifacts"])
+        self.scheduler.add("artifacts", self.phase("artifacts", delay=0.05))
+        self.scheduler.run()
+        self.assertEqual(["artifacts", "files"], self.calls)
+
+    def test_dependencies_on_phases_not_added_are_ignored(self):
+        self.scheduler.add("files", self.phase("files"), depends_on=["artifacts"])
+        self.scheduler.run()
+        self.assertEqual(["files"], self.calls)
+
+    def test_failures_are_raised_in_the_order_the_phases_were_added(self):
+        self.scheduler.add("process", self.phase("process", ValueError("process"), delay=0.05))
+        self.scheduler.add("artifacts", self.phase("artifacts", ValueError("artifacts")))
+        self.scheduler.add("files", self.phase("files"), depends_on=["artifacts"])
+        self.scheduler.add("containers_and_samples", self.phase("containers_and_samples"))
+
+        with self.assertRaisesRegex(ValueError, "process"):
+            self.scheduler.run()
+        # The other phases are run to the end, except the one depending on the failed phase:
+        self.assertEqual({"process", "artifacts", "containers_and_samples"}, set(self.calls))
+        self.assertIsNone(self.scheduler.timings["files"])
+        self.assertIsNotNone(self.scheduler.timings["artifacts"])
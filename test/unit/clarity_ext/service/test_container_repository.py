@@ -0,0 +1,36 @@
+import unittest
+from mock import MagicMock
+from clarity_ext.repository.container_repository import ContainerRepository
+
+
+class TestContainerRepository(unittest.TestCase):
+    def test_prefetch_fetches_all_containers_in_one_batch(self):
+        api = MagicMock()
+        source = fake_container_resource("27-1")
+        target = fake_container_resource("27-2")
+        repo = ContainerRepository()
+
+        repo.prefetch(api, [source], [target, source])
+
+        api.get_batch.assert_called_once_with([source, target])
+        self.assertTrue(repo.get_container(source, is_source=False).is_source)
+        self.assertFalse(repo.get_container(target, is_source=True).is_source)
+
+    def test_prefetch_skips_cached_containers(self):
+        api = MagicMock()
+        container = fake_container_resource("27-1")
+        repo = ContainerRepository()
+        repo.get_container(container, is_source=True)
+
+        repo.prefetch(api, [container], [])
+
+        api.get_batch.assert_not_called()
+
+
+def fake_container_resource(container_id):
+    resource = MagicMock(id=container_id, udf=dict())
+    resource.name = "container-{}".format(container_id)
+    resource.type.name = "96 well plate"
+    resource.type.x_dimension = {"size": 12}
+    resource.type.y_dimension = {"size": 8}
+    return resource
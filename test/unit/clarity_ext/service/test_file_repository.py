@@ -0,0 +1,73 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+import requests
+from mock import MagicMock
+from clarity_ext.repository.file_repository import FileRepository
+
+
+class TestFileRepository(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.directory, "downloaded.txt")
+        self.content = b"0123456789" * 100
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_download_streams_in_chunks_and_checksums(self):
+        session = MagicMock()
+        session.get.return_value = fake_response(self.content, 200)
+        repo = FileRepository(session, chunk_size=64)
+
+        result = repo.copy_remote_file("40-1", self.local_path)
+
+        session.get.return_value.iter_content.assert_called_once_with(chunk_size=64)
+        with open(self.local_path, "rb") as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual(len(self.content), result.size)
+        self.assertEqual(hashlib.sha256(self.content).hexdigest(), result.sha256)
+        self.assertFalse(os.path.exists(self.local_path + FileRepository.PARTIAL_SUFFIX))
+
+    def test_interrupted_download_is_resumed_from_partial_file(self):
+        session = MagicMock()
+        half = len(self.content) // 2
+        session.get.side_effect = [fake_response(self.content[:half], 200, interrupt=True),
+                                   fake_response(self.content[half:], 206)]
+        repo = FileRepository(session, chunk_size=64)
+
+        result = repo.copy_remote_file("40-1", self.local_path)
+
+        _, kwargs = session.get.call_args
+        self.assertEqual({"Range": "bytes={}-".format(half)}, kwargs["headers"])
+        with open(self.local_path, "rb") as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual(hashlib.sha256(self.content).hexdigest(), result.sha256)
+
+    def test_download_starts_over_if_range_is_not_supported(self):
+        partial_path = self.local_path + FileRepository.PARTIAL_SUFFIX
+        with open(partial_path, "wb") as f:
+            f.write(b"stale")
+        session = MagicMock()
+        session.get.side_effect = [fake_response(self.content, 200), fake_response(self.content, 200)]
+        repo = FileRepository(session)
+
+        result = repo.copy_remote_file("40-1", self.local_path)
+
+        with open(self.local_path, "rb") as f:
+            self.assertEqual(self.content, f.read())
+        self.assertEqual(len(self.content), result.size)
+
+
+def fake_response(content, status_code, interrupt=False):
+    def iter_content(chunk_size):
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+        if interrupt:
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+    response = MagicMock()
+    response.status_code = status_code
+    response.iter_content = MagicMock(side_effect=iter_content)
+    return response
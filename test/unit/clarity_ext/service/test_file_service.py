@@ -1,6 +1,9 @@
 import unittest
+import requests
+import xml.etree.ElementTree as ET
 from mock import MagicMock
 from clarity_ext.domain.analyte import Analyte
+from clarity_ext.domain.shared_result_file import SharedResultFile
 from clarity_ext.service.file_service import FileService
 
 
@@ -27,3 +30,106 @@ def fake_artifact(artifact_id, name):
     artifact.name = name
     artifact.id = artifact_id
     return artifact
+
+
+class TestPrefetchFileService(unittest.TestCase):
+
+    def test_prefetch_downloads_matching_shared_files_once(self):
+        artifact_service = MagicMock()
+        shared_files = [fake_shared_file("92-1", "Result", "40-1"),
+                        fake_shared_file("92-2", "Result", "40-2"),
+                        fake_shared_file("92-3", "Other", "40-3"),
+                        fake_shared_file("92-4", "Result", None)]
+        artifact_service.shared_files = MagicMock(return_value=shared_files)
+        os_service = MagicMock()
+        os_service.exists.return_value = False
+        os_service.abspath.side_effect = lambda path: path
+        file_repo = MagicMock()
+        file_service = FileService(artifact_service, file_repo, False, os_service)
+
+        file_service.prefetch(["Result"])
+
+        downloaded = sorted(call[0] for call in file_repo.copy_remote_file.call_args_list)
+        self.assertEqual([("40-1", "./context_files/downloaded/92-1_Result."),
+                          ("40-2", "./context_files/downloaded/92-2_Result.")], downloaded)
+
+
+def fake_shared_file(artifact_id, name, file_id):
+    shared_file = SharedResultFile(api_resource=MagicMock(), id=artifact_id, name=name)
+    if file_id:
+        remote_file = MagicMock()
+        remote_file.id = file_id
+        shared_file.files = [remote_file]
+        shared_file.api_resource.files = [remote_file]
+    return shared_file
+
+
+class TestCommitFileService(unittest.TestCase):
+
+    def setUp(self):
+        self.artifact_service = MagicMock()
+        self.shared_files = [fake_shared_file("92-1", "Result", None), fake_shared_file("92-2", "Step log", None)]
+        self.artifact_service.shared_files = MagicMock(return_value=self.shared_files)
+        self.os_service = MagicMock()
+        self.os_service.listdir.side_effect = lambda path: {
+            "./context_files/upload_queue": ["92-1", "92-2"],
+            "./context_files/upload_queue/92-1": ["92-1_result.txt"],
+            "./context_files/upload_queue/92-2": ["Step_log.txt"]}[path]
+        self.session = MagicMock()
+        self.file_service = FileService(self.artifact_service, MagicMock(), False, self.os_service,
+                                        session=self.session)
+        self.file_service.UPLOAD_RETRY_DELAY = 0
+
+    def post_responses(self, glsstorage=(), files=()):
+        """Fakes the POST requests of an upload, raising the errors in the lists in order before succeeding"""
+        errors = {"glsstorage": list(glsstorage), "files": list(files)}
+
+        def post(uri, data):
+            if errors[uri]:
+                raise errors[uri].pop(0)
+            return ET.Element("file", uri="files/40-{}".format(len(self.posts(uri))))
+        self.session.api.cache = dict()
+        self.session.api.get_uri.side_effect = lambda *parts: "/".join(parts)
+        self.session.api.post.side_effect = post
+
+    def posts(self, uri):
+        return [call for call in self.session.api.post.call_args_list if call[1]["uri"] == uri]
+
+    def test_commit_uploads_all_files_and_retries_server_errors(self):
+        server_error = requests.HTTPError("503", response=MagicMock(status_code=503))
+        self.post_responses(glsstorage=[server_error])
+        self.session.http_session.post.side_effect = [requests.ConnectionError(), MagicMock(), MagicMock()]
+
+        self.file_service.commit(False)
+
+        self.assertEqual(3, len(self.posts("glsstorage")))
+        self.assertEqual(2, len(self.posts("files")))
+        self.assertEqual(3, self.session.http_session.post.call_count)
+        self.assertEqual({"files/40-1/upload", "files/40-2/upload"},
+                         set(call[0][0] for call in self.session.http_session.post.call_args_list))
+        self.assertEqual({(self.session.api.username, self.session.api.password)},
+                         set(call[1]["auth"] for call in self.session.http_session.post.call_args_list))
+
+    def test_creating_the_file_resource_is_not_retried(self):
+        server_error = requests.HTTPError("503", response=MagicMock(status_code=503))
+        self.post_responses(files=[server_error])
+
+        with self.assertRaises(requests.HTTPError):
+            self.file_service.commit(False)
+
+        # A retry could attach a second file to the artifact, if the first request created the file:
+        self.assertEqual(2, len(self.posts("files")))
+        self.assertEqual(1, self.session.http_session.post.call_count)
+
+    def test_commit_ignores_under_review(self):
+        under_review = requests.HTTPError("400: UNDER_REVIEW", response=MagicMock(status_code=400))
+        self.post_responses(glsstorage=[under_review, under_review])
+
+        self.file_service.commit(False)
+
+        self.assertEqual(2, len(self.posts("glsstorage")))
+        self.session.http_session.post.assert_not_called()
+
+    def test_commit_disabled_uploads_nothing(self):
+        self.file_service.commit(True)
+        self.session.api.post.assert_not_called()
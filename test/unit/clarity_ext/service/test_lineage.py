@@ -0,0 +1,54 @@
+import unittest
+from mock import MagicMock
+from clarity_ext.domain import Analyte
+from clarity_ext.service import ArtifactService
+
+
+class TestLineageGraph(unittest.TestCase):
+    def setUp(self):
+        self.original = fake_analyte("2-1", "S1", None)
+        self.first = fake_analyte("2-2", "S1", "24-1")
+        self.second = fake_analyte("2-3", "S1", "24-2")
+        self.current = fake_analyte("2-4", "S1", "24-3")
+        self.steps = {
+            "24-1": fake_artifact_service("24-1", [(self.original, self.first)]),
+            "24-2": fake_artifact_service("24-2", [(self.first, self.second)]),
+        }
+        self.artifact_service = fake_artifact_service("24-3", [(self.second, self.current)])
+        self.artifact_service.artifact_services_for_steps = MagicMock(
+            side_effect=lambda step_ids: [self.steps[step_id] for step_id in step_ids])
+
+    def test_generations_are_loaded_breadth_first(self):
+        graph = self.artifact_service.lineage_graph(5)
+
+        self.assertEqual([["24-2"], ["24-1"]],
+                         [call[0][0] for call in self.artifact_service.artifact_services_for_steps.call_args_list])
+        self.assertEqual(["24-1"], graph.step_ids(2))
+
+    def test_ancestors_by_artifact_id(self):
+        graph = self.artifact_service.lineage_graph(2)
+
+        self.assertEqual([self.second, self.first, self.original], graph.ancestors("2-4"))
+        self.assertEqual([self.first], graph.ancestors("2-4", generation=1))
+        self.assertEqual([self.second], graph.parents("2-4"))
+
+    def test_ancestors_by_sample_id(self):
+        graph = self.artifact_service.lineage_graph(1)
+
+        self.assertEqual([self.second, self.first], graph.ancestors_by_sample("S1"))
+        self.assertEqual(list(), graph.ancestors_by_sample("S2"))
+        self.assertIs(graph, self.artifact_service.lineage_graph(1))
+
+
+def fake_analyte(artifact_id, sample_id, parent_process_id):
+    analyte = Analyte(api_resource=None, is_input=None, id=artifact_id)
+    analyte._samples = [MagicMock(id=sample_id)]
+    analyte.parent_process = MagicMock(id=parent_process_id) if parent_process_id else None
+    return analyte
+
+
+def fake_artifact_service(step_id, pairs):
+    step_repo = MagicMock()
+    step_repo.session.current_step_id = step_id
+    step_repo.all_artifacts.return_value = pairs
+    return ArtifactService(step_repo)
@@ -0,0 +1,77 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from mock import MagicMock
+from clarity_ext.repository.metadata_cache import MetadataCache
+from clarity_ext.repository.reagent_type_repository import ReagentTypeRepository
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "metadata.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_entries_are_persisted_between_instances(self):
+        MetadataCache(self.path).set("https://lims/api/v2/processtypes/1", {"name": "Dilution"})
+        self.assertEqual({"name": "Dilution"}, MetadataCache(self.path).get("https://lims/api/v2/processtypes/1"))
+
+    def test_expired_entries_are_ignored(self):
+        MetadataCache(self.path).set("key", "value")
+        self.assertIsNone(MetadataCache(self.path, ttl=0).get("key"))
+
+    def test_invalidate(self):
+        cache = MetadataCache(self.path)
+        cache.set("first", 1)
+        cache.set("second", 2)
+        cache.invalidate("first")
+        self.assertIsNone(MetadataCache(self.path).get("first"))
+        self.assertEqual(2, MetadataCache(self.path).get("second"))
+        cache.invalidate()
+        self.assertIsNone(MetadataCache(self.path).get("second"))
+
+    def test_database_errors_fall_back_to_memory(self):
+        cache = MetadataCache(self.path, logger=MagicMock())
+        cache._connection = MagicMock()
+        cache._connection.execute.side_effect = sqlite3.OperationalError("database is locked")
+
+        cache.set("key", "value")
+
+        self.assertEqual("value", cache.get("key"))
+        self.assertIsNone(cache.get("other"))
+        cache.invalidate()
+        cache.logger.warning.assert_called_once()
+
+    def test_hydrate_fetches_entity_once(self):
+        first = fake_entity("https://lims/api/v2/containertypes/1", "<container-type name='96 well plate'/>")
+        MetadataCache(self.path).hydrate(first)
+        second = fake_entity("https://lims/api/v2/containertypes/1", "<container-type name='96 well plate'/>")
+        MetadataCache(self.path).hydrate(second)
+
+        self.assertEqual(1, first.get.call_count)
+        second.get.assert_not_called()
+        self.assertEqual("96 well plate", second.root.get("name"))
+
+    def test_reagent_types_are_queried_once(self):
+        session = MagicMock()
+        session.api.get_reagent_types.return_value = [MagicMock(category="Index", sequence="ACGT")]
+        cache = MetadataCache()
+        ReagentTypeRepository(session, cache).get_reagent_types("A01")
+        reagent_type = ReagentTypeRepository(session, cache).get_reagent_type("A01")
+
+        self.assertEqual(1, session.api.get_reagent_types.call_count)
+        self.assertEqual(("Index", "ACGT"), (reagent_type.category, reagent_type.sequence))
+
+
+def fake_entity(uri, xml):
+    entity = MagicMock(uri=uri, root=None)
+
+    def get():
+        entity.root = ET.fromstring(xml)
+    entity.get.side_effect = get
+    return entity
@@ -1,9 +1,14 @@
 import unittest
+import xml.etree.ElementTree as ET
+from mock import MagicMock, call
 from clarity_ext.inversion_of_control.ioc import ioc
 from clarity_ext.repository.sample_repository import SampleRepository
 from clarity_ext.service.application import ApplicationService
 from genologics.entities import Container, Artifact, Sample
 from genologics.lims import Lims
+from clarity_ext import ClaritySession
+from clarity_ext.mappers.clarity_mapper import ClarityMapper
+from test.unit.clarity_ext.fake_lims import FakeLimsServer
 
 
 class TestSampleRepository(unittest.TestCase):
@@ -21,3 +26,82 @@ class FakeSession(object):
     def __init__(self, lims):
         self.api = lims
         ioc.set_application(ApplicationService(self, None))
+
+
+class TestSampleRepositoryCandidates(unittest.TestCase):
+    def setUp(self):
+        self.session = MagicMock()
+        self.session.get_batch.side_effect = lambda resources: resources
+        self.sample_repo = SampleRepository(self.session, MagicMock())
+        self.lims = Lims('', '', '')
+
+    def sample_resource(self, uri):
+        resource = Sample(self.lims, uri=uri)
+        resource.root = ET.Element("sample")
+        return resource
+
+    def test_duplicate_candidates_are_fetched_once(self):
+        first = self.sample_resource('https://lims/api/v2/samples/S1')
+        second = self.sample_resource('https://lims/api/v2/samples/S2')
+        # The sample is on the input, the output and a pool:
+        for resource in [first, first, second, first]:
+            self.sample_repo.add_candidate(resource)
+
+        self.sample_repo.get_samples([first])
+        self.sample_repo.get_samples([second, first])
+
+        self.session.get_batch.assert_called_once_with([first, second])
+
+    def test_candidates_added_later_are_fetched_on_next_use(self):
+        first = self.sample_resource('https://lims/api/v2/samples/S1')
+        second = self.sample_resource('https://lims/api/v2/samples/S2')
+        self.sample_repo.add_candidate(first)
+        self.sample_repo.get_samples([first])
+        self.sample_repo.add_candidate(second)
+        self.sample_repo.add_candidate(first)
+        self.sample_repo.get_samples([second])
+
+        self.assertEqual([call([first]), call([second])], self.session.get_batch.call_args_list)
+
+
+class TestSampleRepositoryProjects(unittest.TestCase):
+    PROJECTS = 3
+
+    def setUp(self):
+        SampleRepository.clear_projects()
+        responses = {("POST", "/api/v2/samples/batch/retrieve"):
+                     '<smp:details xmlns:smp="http://genologics.com/ri/sample">' +
+                     "".join('<smp:sample uri="{{base}}/api/v2/samples/S{0}" limsid="S{0}"><name>S{0}</name>'
+                             '<project uri="{{base}}/api/v2/projects/P{1}" limsid="P{1}"/></smp:sample>'
+                             .format(i, i % self.PROJECTS) for i in range(2 * self.PROJECTS)) +
+                     '</smp:details>'}
+        for i in range(self.PROJECTS):
+            responses[("GET", "/api/v2/projects/P{}".format(i))] = \
+                '<prj:project xmlns:prj="http://genologics.com/ri/project" uri="{{base}}/api/v2/projects/P{0}" ' \
+                'limsid="P{0}"><name>Project {0}</name></prj:project>'.format(i)
+        self.server = FakeLimsServer(responses, delay=0.05)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        SampleRepository.clear_projects()
+
+    def samples(self):
+        """Maps all samples with a new session and repository, as a new context would"""
+        session = ClaritySession(Lims(self.server.base_uri, "user", "password"), None, lazy=True)
+        sample_repo = SampleRepository(session, ClarityMapper())
+        resources = [Sample(session.api, id="S{}".format(i)) for i in range(2 * self.PROJECTS)]
+        for resource in resources:
+            sample_repo.add_candidate(resource)
+        return sample_repo.get_samples(resources)
+
+    def test_projects_are_fetched_concurrently_once_per_process(self):
+        samples = self.samples()
+        self.assertEqual(["Project {}".format(i % self.PROJECTS) for i in range(2 * self.PROJECTS)],
+                         [sample.project.name for sample in samples])
+        self.assertEqual(self.PROJECTS, sum(1 for method, _ in self.server.requests if method == "GET"))
+        self.assertGreater(self.server.max_in_flight, 1)
+
+        self.server.reset()
+        self.samples()
+        self.assertEqual([("POST", "/api/v2/samples/batch/retrieve")], self.server.requests)
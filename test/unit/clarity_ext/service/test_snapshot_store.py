@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+from genologics.lims import Lims
+from clarity_ext import ClaritySession
+from clarity_ext.inversion_of_control.ioc import ioc
+from clarity_ext.mappers.clarity_mapper import ClarityMapper
+from clarity_ext.repository import StepRepository, MetadataCache, SnapshotStore
+from clarity_ext.service.application import ApplicationService
+from test.unit.clarity_ext.fake_lims import FakeLimsServer, RECORDED_RESPONSES
+
+
+class TestStepSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.responses = dict(RECORDED_RESPONSES)
+        self.server = FakeLimsServer(self.responses)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+        ClaritySession._version_checked_at.pop(self.server.base_uri, None)
+
+    def load_step(self):
+        """Loads the step as a new run of an extension would, i.e. with nothing cached in memory"""
+        session = ClaritySession(Lims(self.server.base_uri, "user", "password"), "24-1", lazy=True)
+        mapper = ClarityMapper()
+        ioc.set_application(ApplicationService(session, mapper, MetadataCache()))
+        self.repo = StepRepository(session, mapper, snapshot_store=SnapshotStore(self.directory))
+        self.server.reset()
+        return self.repo.all_artifacts()
+
+    def test_unchanged_step_is_loaded_from_snapshot(self):
+        first = self.load_step()
+        second = self.load_step()
+
+        # Only the step, the state of its artifacts and their containers are fetched:
+        self.assertEqual([("GET", "/api/v2/processes/24-1"), ("POST", "/api/v2/artifacts/batch/retrieve"),
+                          ("POST", "/api/v2/containers/batch/retrieve")], self.server.requests)
+        self.assertEqual(describe(first), describe(second))
+        inp, outp = second[0]
+        self.assertIs(inp, self.repo.clarity_mapper.domain_map["2-1"])
+        self.assertIs(inp.api_resource, self.repo.clarity_mapper.map[inp])
+        self.assertEqual("Dilution", self.repo.get_process_type().name)
+
+    def test_snapshot_is_not_used_if_others_can_write_to_the_directory(self):
+        self.load_step()
+        os.chmod(self.directory, 0o777)
+        self.load_step()
+        self.assertIn(("POST", "/api/v2/containers/batch/retrieve"), self.server.requests)
+
+    def test_snapshots_are_only_writable_by_the_current_user(self):
+        directory = os.path.join(self.directory, "snapshots")
+        store = SnapshotStore(directory)
+        store.save("key", ["graph"])
+        self.assertEqual(0o700, os.stat(directory).st_mode & 0o777)
+        self.assertEqual(0o600, os.stat(store.path("key")).st_mode & 0o777)
+        self.assertEqual(["graph"], store.load("key", None, None))
+
+    def test_snapshot_is_not_used_after_an_artifact_changed(self):
+        self.load_step()
+        self.responses[("POST", "/api/v2/artifacts/batch/retrieve")] = \
+            RECORDED_RESPONSES[("POST", "/api/v2/artifacts/batch/retrieve")].replace("2-11?state=3", "2-11?state=4")
+        self.load_step()
+        self.assertIn(("POST", "/api/v2/containers/batch/retrieve"), self.server.requests)
+
+    def test_snapshot_is_not_used_after_a_container_changed(self):
+        self.load_step()
+        self.responses[("POST", "/api/v2/containers/batch/retrieve")] = \
+            RECORDED_RESPONSES[("POST", "/api/v2/containers/batch/retrieve")].replace("Target", "Renamed")
+        (_, outp), = self.load_step()
+        self.assertEqual("Renamed", outp.container.name)
+
+    def test_samples_are_not_loaded_from_snapshot(self):
+        self.load_step()[0][0].samples
+        self.responses[("POST", "/api/v2/samples/batch/retrieve")] = \
+            RECORDED_RESPONSES[("POST", "/api/v2/samples/batch/retrieve")].replace("Sample 1", "Renamed")
+        (inp, _), = self.load_step()
+        self.assertEqual(["Renamed"], [sample.name for sample in inp.samples])
+
+
+def describe(pairs):
+    return [(inp.id, inp.container.id, str(inp.well.position), [sample.name for sample in inp.samples],
+             outp.id, outp.container.id, str(outp.well.position), sorted(udf.key for udf in outp.udf_map.values))
+            for inp, outp in pairs]
@@ -0,0 +1,109 @@
+import unittest
+from mock import MagicMock
+from genologics.lims import Lims
+from clarity_ext import ClaritySession
+from clarity_ext.inversion_of_control.ioc import ioc
+from clarity_ext.mappers.clarity_mapper import ClarityMapper
+from clarity_ext.repository import StepRepository, LoadingProfile, MetadataCache
+from clarity_ext.service import ArtifactService
+from clarity_ext.service.application import ApplicationService
+from test.unit.clarity_ext.fake_lims import FakeLimsServer, RECORDED_RESPONSES
+
+
+class TestStepRepositoryLoadingProfile(unittest.TestCase):
+    def setUp(self):
+        self.rows = [
+            fake_row("2-1", "2-11", "Analyte", "PerInput"),
+            fake_row("2-1", "92-12", "ResultFile", "PerInput"),
+            fake_row("2-1", "92-13", "ResultFile", "PerAllInputs"),
+        ]
+
+    def artifact_ids(self, loading_profile):
+        session = MagicMock()
+        session.current_step.api_resource.input_output_maps = self.rows
+        repo = StepRepository(session, MagicMock(), loading_profile=loading_profile)
+        repo._input_strategy = repo._output_strategy = StepRepository.ARTIFACT_FETCH_STRATEGY_USE_URI
+        return [resource.id for resource in repo.artifact_resources()]
+
+    def test_all_artifacts_are_loaded_by_default(self):
+        self.assertEqual(["2-1", "2-11", "92-12", "92-13"], self.artifact_ids(None))
+
+    def test_analytes_profile_skips_result_files(self):
+        self.assertEqual(["2-1", "2-11", "92-13"], self.artifact_ids(LoadingProfile.ANALYTES))
+
+    def test_shared_files_profile_skips_inputs(self):
+        self.assertEqual(["92-13"], self.artifact_ids(LoadingProfile.SHARED_FILES))
+
+    def test_outputs_profile_skips_inputs(self):
+        self.assertEqual(["2-11", "92-12", "92-13"], self.artifact_ids(LoadingProfile.OUTPUTS))
+
+
+def fake_row(input_id, output_id, output_type, generation_type):
+    input_info = {"uri": MagicMock(id=input_id, uri="https://lims/api/v2/artifacts/" + input_id)}
+    output_info = {"uri": MagicMock(id=output_id, uri="https://lims/api/v2/artifacts/" + output_id),
+                   "output-type": output_type, "output-generation-type": generation_type}
+    return input_info, output_info
+
+
+class TestStepRepositoryRefresh(unittest.TestCase):
+    def setUp(self):
+        self.responses = dict(RECORDED_RESPONSES)
+        self.server = FakeLimsServer(self.responses)
+        self.server.start()
+        session = ClaritySession(Lims(self.server.base_uri, "user", "password"), "24-1", lazy=True)
+        mapper = ClarityMapper()
+        ioc.set_application(ApplicationService(session, mapper, MetadataCache()))
+        self.artifact_service = ArtifactService(StepRepository(session, mapper))
+
+    def tearDown(self):
+        self.server.stop()
+        ClaritySession._version_checked_at.pop(self.server.base_uri, None)
+
+    def update_output(self, name, in_step=True):
+        """
+        Simulates that the output was renamed in the LIMS, giving it a new state. If in_step is False, the
+        state in the input/output map of the step is not updated, as when the artifact is changed in the UI.
+        """
+        keys = [("POST", "/api/v2/artifacts/batch/retrieve")]
+        if in_step:
+            keys.append(("GET", "/api/v2/processes/24-1"))
+        for key in keys:
+            self.responses[key] = self.responses[key].replace("2-11?state=3", "2-11?state=4")
+        key = ("POST", "/api/v2/artifacts/batch/retrieve")
+        self.responses[key] = self.responses[key].replace(
+            "<name>Sample 1</name>\n        <type>Analyte</type>\n        <location>\n            "
+            "<container uri=\"{base}/api/v2/containers/27-2\"",
+            "<name>" + name + "</name>\n        <type>Analyte</type>\n        <location>\n            "
+            "<container uri=\"{base}/api/v2/containers/27-2\"")
+
+    def test_only_changed_artifacts_are_mapped_again(self):
+        (inp, outp), = self.artifact_service.all_artifacts()
+        self.update_output("Renamed")
+        self.server.reset()
+
+        changed = self.artifact_service.refresh()
+
+        (new_inp, new_outp), = self.artifact_service.all_artifacts()
+        self.assertEqual(["2-11"], [artifact.id for artifact in changed])
+        self.assertIs(inp, new_inp)
+        self.assertIsNot(outp, new_outp)
+        self.assertEqual("Renamed", new_outp.name)
+        self.assertIs(new_outp, new_inp.output)
+        self.assertEqual([("GET", "/api/v2/processes/24-1"), ("POST", "/api/v2/artifacts/batch/retrieve")],
+                         self.server.requests)
+
+    def test_changes_not_in_the_step_are_found(self):
+        (inp, outp), = self.artifact_service.all_artifacts()
+        self.update_output("Renamed", in_step=False)
+
+        changed = self.artifact_service.refresh()
+
+        (new_inp, new_outp), = self.artifact_service.all_artifacts()
+        self.assertEqual(["2-11"], [artifact.id for artifact in changed])
+        self.assertIs(inp, new_inp)
+        self.assertEqual("Renamed", new_outp.name)
+
+    def test_refresh_without_changes_keeps_all_artifacts(self):
+        pairs = self.artifact_service.all_artifacts()
+        self.assertEqual(list(), self.artifact_service.refresh())
+        self.assertIs(pairs, self.artifact_service.all_artifacts())
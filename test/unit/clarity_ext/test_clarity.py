@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from mock import MagicMock
+from clarity_ext.clarity import ClaritySession
+from clarity_ext.repository import MetadataCache
+from clarity_ext.domain.shared_result_file import SharedResultFile
+
+
+class TestClaritySession(unittest.TestCase):
+
+    def test_http_session_is_pooled_and_retries(self):
+        http_session = ClaritySession.create_http_session(pool_size=7, max_retries=2)
+        adapter = http_session.get_adapter("https://lims.example.com/api/v2/")
+        self.assertEqual(7, adapter._pool_maxsize)
+        self.assertEqual(2, adapter.max_retries.total)
+        self.assertNotIn("POST", adapter.max_retries.allowed_methods)
+
+    def test_api_shares_the_http_session(self):
+        api = MagicMock()
+        http_session = MagicMock()
+        session = ClaritySession(api, None, http_session)
+        self.assertIs(http_session, api.request_session)
+        self.assertIs(http_session, session.http_session)
+
+    def test_version_check_is_cached_per_server(self):
+        api = MagicMock(baseuri="https://lims-{}.example.com".format(id(self)))
+        ClaritySession(api, None, MagicMock())
+        ClaritySession(api, None, MagicMock())
+        self.assertEqual(1, api.check_version.call_count)
+        ClaritySession(api, None, MagicMock(), version_check_ttl=0)
+        self.assertEqual(2, api.check_version.call_count)
+
+    def test_version_check_is_shared_with_other_processes_through_the_metadata_cache(self):
+        api = MagicMock(baseuri="https://lims-{}.example.com".format(id(self)))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "metadata.sqlite")
+            ClaritySession(api, None, MagicMock(), metadata_cache=MetadataCache(path))
+            # Simulates a new process, with an empty in-memory cache:
+            ClaritySession._version_checked_at.pop(api.baseuri)
+            ClaritySession(api, None, MagicMock(), metadata_cache=MetadataCache(path))
+        self.assertEqual(1, api.check_version.call_count)
+
+    def test_lazy_session_makes_no_calls_until_step_is_used(self):
+        api = MagicMock(baseuri="https://lims-{}.example.com".format(id(self)))
+        session = ClaritySession(api, "24-1", MagicMock(), lazy=True)
+        api.check_version.assert_not_called()
+        self.assertIsNone(session._current_step)
+
+    def test_session_for_other_step_shares_connections(self):
+        api = MagicMock(baseuri="https://lims-{}.example.com".format(id(self)))
+        session = ClaritySession(api, None, MagicMock())
+        other = session.for_step("24-2")
+        self.assertIs(session.api, other.api)
+        self.assertIs(session.http_session, other.http_session)
+        self.assertEqual("24-2", other.current_step_id)
+
+    def test_unlinking_files_goes_through_the_session(self):
+        session = MagicMock()
+        session.delete.return_value.status_code = 204
+        shared_file = SharedResultFile(api_resource=MagicMock(), id="92-1", name="Step log")
+        shared_file.files = [MagicMock(uri="https://lims/api/v2/files/1"), MagicMock(uri="https://lims/api/v2/files/2")]
+        shared_file.remove_files(False, MagicMock(), session)
+        self.assertEqual(2, session.delete.call_count)
+        self.assertEqual(list(), shared_file.files)
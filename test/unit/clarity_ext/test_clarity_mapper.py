@@ -0,0 +1,76 @@
+import gc
+import unittest
+import xml.etree.ElementTree as ET
+from mock import MagicMock
+from clarity_ext.mappers.clarity_mapper import ClarityMapper
+from clarity_ext.repository import StepRepository
+from clarity_ext.service.application import ApplicationService
+from clarity_ext.inversion_of_control.ioc import ioc
+from clarity_ext.domain.process import ProcessType, ProcessOutput
+from clarity_ext.domain.shared_result_file import SharedResultFile
+
+
+class TestClarityMapperIdentityMap(unittest.TestCase):
+    PAIRS = 1000
+
+    def setUp(self):
+        self.process_type = ProcessType([ProcessOutput("ResultFile", "PerInput", ["Concentration"]),
+                                         ProcessOutput("ResultFile", "PerAllInputs", ["Comment"])], None, "Measure")
+        self.inputs = [FakeResource("2-{}".format(i), "Analyte") for i in range(self.PAIRS)]
+        self.outputs = [FakeResource("92-{}".format(i), "ResultFile") for i in range(self.PAIRS)]
+        self.shared_file = FakeResource("92-shared", "ResultFile")
+
+    def map_rows(self, rows):
+        self.mapper = ClarityMapper()
+        ioc.set_application(ApplicationService(MagicMock(), self.mapper))
+        step_repo = StepRepository(MagicMock(), self.mapper)
+        return [step_repo._wrap_input_output(input_resource, output_resource, gen_type, self.process_type)
+                for input_resource, output_resource, gen_type in rows]
+
+    def test_inputs_in_several_rows_are_mapped_once(self):
+        rows = list(zip(self.inputs, self.outputs, ["PerInput"] * self.PAIRS)) + \
+            [(input_resource, self.shared_file, "PerAllInputs") for input_resource in self.inputs]
+
+        pairs = self.map_rows(rows)
+
+        self.assertEqual(self.PAIRS, len(set(id(inp) for inp, _ in pairs)))
+        self.assertEqual(self.PAIRS + 1, len(set(id(outp) for _, outp in pairs)))
+
+    def test_objects_that_are_not_used_are_released(self):
+        mapper = ClarityMapper()
+        ioc.set_application(ApplicationService(MagicMock(), mapper))
+        step_repo = StepRepository(MagicMock(), mapper)
+        step_repo._wrap_input_output(self.inputs[0], self.outputs[0], "PerInput", self.process_type)
+        self.assertEqual((2, 1), (len(mapper.domain_map), len(mapper.map)))
+
+        gc.collect()
+
+        self.assertEqual((0, 0), (len(mapper.domain_map), len(mapper.map)))
+
+    def test_shared_file_is_mapped_once_for_all_rows(self):
+        rows = list(zip(self.inputs, self.outputs, ["PerInput"] * self.PAIRS)) + \
+            [(input_resource, self.shared_file, "PerAllInputs") for input_resource in self.inputs]
+
+        pairs = self.map_rows(rows)
+
+        shared_files = [outp for _, outp in pairs[self.PAIRS:]]
+        self.assertIsInstance(shared_files[0], SharedResultFile)
+        self.assertTrue(all(outp is shared_files[0] for outp in shared_files))
+        # One domain object per distinct resource: the inputs, their result files and the shared file
+        self.assertEqual(2 * self.PAIRS + 1, len(self.mapper.domain_map))
+
+
+class FakeResource(object):
+    def __init__(self, resource_id, resource_type):
+        self.id = resource_id
+        self.type = resource_type
+        self.name = "name-" + resource_id
+        self.samples = list()
+        self.qc_flag = None
+        self.udf = {"Concentration": 1.0}
+        self.location = (None, None)
+        self.root = ET.Element("artifact")
+        self.files = list()
+        self.parent_process = None
+        self.reagent_labels = list()
+
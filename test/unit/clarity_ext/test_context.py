@@ -1,4 +1,5 @@
 import unittest
+from mock import MagicMock
 from test.unit.clarity_ext.helpers import mock_context
 
 
@@ -22,5 +23,39 @@ class TestContext(unittest.TestCase):
         self.assertRaises(ValueError, input_should_raise)
         self.assertRaises(ValueError, output_should_raise)
 
+    def test_commit_clears_the_update_queue(self):
+        context = mock_context()
+        self.assertIsNone(context.change_set_path)
+        sent = list()
+        context.clarity_service.update_phases.side_effect = \
+            lambda queue, disable_commits, change_set: sent.append(set(queue)) or list()
+        queued = MagicMock()
+        context.update(queued)
+
+        context.commit()
+        self.assertEqual(set(), context._update_queue)
+        context.commit()
+
+        self.assertEqual([{queued}, set()], sent)
+
+    def test_failing_to_save_the_change_set_does_not_fail_the_commit(self):
+        context = mock_context()
+        context.change_set_path = "/nonexistent/change_set.json"
+        context.clarity_service.update_phases.return_value = [("artifacts", MagicMock())]
+
+        context.commit()
+
+        context.file_service.commit.assert_called_once_with(context.disable_commits)
+
+    def test_change_set_is_saved_when_the_commit_fails(self):
+        context = mock_context()
+        context.change_set_path = "/nonexistent/change_set.json"
+        context.clarity_service.update_phases.return_value = [("artifacts", MagicMock(side_effect=ValueError()))]
+        context.change_set.save = MagicMock()
+
+        with self.assertRaises(ValueError):
+            context.commit()
+        context.change_set.save.assert_called_once_with("/nonexistent/change_set.json")
+
     def _mock_context(self):
         return mock_context(artifact_service=mock_two_containers_artifact_service())
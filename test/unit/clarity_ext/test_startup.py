@@ -0,0 +1,49 @@
+import os
+import re
+import sys
+import subprocess
+import unittest
+
+
+class TestStartup(unittest.TestCase):
+    """
+    Guards the cold-start time of the `clarity-ext` entry point, which is paid on every EPP call.
+
+    Heavy dependencies must be imported in the functions that use them, not at module level.
+    """
+
+    ENTRY_POINT = "clarity_ext.cli"
+    LAZY_DEPENDENCIES = ["jinja2", "lxml", "openpyxl", "bs4", "fuzzywuzzy", "requests_cache",
+                         "genologics", "pandas", "xlrd", "PyPDF2"]
+    # Generous, to not fail on slow build servers. Override with CLARITY_EXT_STARTUP_BUDGET_MS.
+    BUDGET_MS = 1500
+
+    @classmethod
+    def setUpClass(cls):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + cls.ENTRY_POINT],
+                                stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        cls.imports = parse_importtime(result.stderr)
+
+    def test_heavy_dependencies_are_not_imported_at_startup(self):
+        imported = [dep for dep in self.LAZY_DEPENDENCIES if dep in self.imports]
+        self.assertEqual(list(), imported)
+
+    def test_startup_is_within_budget(self):
+        budget = int(os.environ.get("CLARITY_EXT_STARTUP_BUDGET_MS", self.BUDGET_MS))
+        total_ms = self.imports[self.ENTRY_POINT] / 1000.0
+        slowest = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)[:10]
+        report = "Importing {} took {:.1f} ms, slowest (cumulative):\n{}".format(
+            self.ENTRY_POINT, total_ms,
+            "\n".join("{:>10.1f} ms  {}".format(us / 1000.0, module) for module, us in slowest))
+        self.assertLess(total_ms, budget, report)
+
+
+def parse_importtime(output):
+    """Parses the output of `python -X importtime` to a dict of module => cumulative time in microseconds"""
+    pattern = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)$")
+    imports = dict()
+    for line in output.splitlines():
+        match = pattern.match(line)
+        if match:
+            imports[match.group(3)] = int(match.group(2))
+    return imports